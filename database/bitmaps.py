@@ -0,0 +1,85 @@
+"""
+按天的完成位图
+第 i 位表示 origin + i 这一天（epoch 天数）完成过；存库时是小端字节串，80 年约 3.6 KB
+"""
+from typing import Optional
+
+
+class DayBitmap:
+    """单个任务的完成位图，底层是 Python 大整数（按位运算、bit_count 统计）"""
+
+    __slots__ = ("origin", "bits")
+
+    def __init__(self, origin: int = 0, bits: int = 0):
+        self.origin = origin
+        self.bits = bits
+
+    @classmethod
+    def from_blob(cls, origin: int, blob: bytes) -> "DayBitmap":
+        return cls(origin, int.from_bytes(blob, "little"))
+
+    def to_blob(self) -> bytes:
+        return self.bits.to_bytes((self.bits.bit_length() + 7) // 8, "little")
+
+    def __bool__(self) -> bool:
+        return self.bits != 0
+
+    def has(self, day: int) -> bool:
+        i = day - self.origin
+        return i >= 0 and (self.bits >> i) & 1 == 1
+
+    def set(self, day: int) -> None:
+        if not self.bits:
+            self.origin = day
+        elif day < self.origin:
+            # 比起点更早：整体左移，起点前挪
+            self.bits <<= self.origin - day
+            self.origin = day
+        self.bits |= 1 << (day - self.origin)
+
+    def clear(self, day: int) -> None:
+        i = day - self.origin
+        if i >= 0:
+            self.bits &= ~(1 << i)
+
+    def count(self, start: int, end: int) -> int:
+        """[start, end] 内完成的天数（对切片做 popcount）"""
+        lo, hi = max(start - self.origin, 0), end - self.origin
+        if hi < lo:
+            return 0
+        return ((self.bits >> lo) & ((1 << (hi - lo + 1)) - 1)).bit_count()
+
+    def rate(self, start: int, end: int) -> float:
+        """[start, end] 内的完成率"""
+        return self.count(start, end) / (end - start + 1) if end >= start else 0.0
+
+    def streak_ending(self, day: int) -> int:
+        """截至 day（含）往前连续完成的天数"""
+        i = day - self.origin
+        if i < 0:
+            return 0
+        mask = (1 << (i + 1)) - 1
+        gaps = ~self.bits & mask
+        # 最高的 0 位之上全是 1
+        return i + 1 if gaps == 0 else i + 1 - gaps.bit_length()
+
+    def first(self) -> Optional[int]:
+        """最早完成的一天"""
+        if not self.bits:
+            return None
+        return self.origin + (self.bits & -self.bits).bit_length() - 1
+
+    def last(self) -> Optional[int]:
+        """最近完成的一天"""
+        return self.origin + self.bits.bit_length() - 1 if self.bits else None
+
+    def days(self, start: int, end: int) -> list[int]:
+        """[start, end] 内完成的日子，升序"""
+        lo = max(start - self.origin, 0)
+        window = (self.bits >> lo) & ((1 << max(end - self.origin - lo + 1, 0)) - 1)
+        result = []
+        while window:
+            low = window & -window
+            result.append(self.origin + lo + low.bit_length() - 1)
+            window ^= low
+        return result
@@ -2,86 +2,181 @@
 数据库管理器 — CRUD 操作层
 职责：纯数据操作，不含业务逻辑
 """
+import weakref
+from contextvars import ContextVar
 from datetime import datetime, date, timedelta
 from typing import Optional
 from contextlib import contextmanager
 
-from sqlalchemy import create_engine, func
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import and_, case, func, literal, text, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, selectinload
 
 from database.models import (
-    Base, UserConfig, Task, TaskRecord, StreakRecord,
+    Base, UserConfig, Task, TaskRecord,
     Realm, Skill, SubTask,
-    Transaction, RecurringTransaction, Debt, DebtRepayment, Budget, Milestone,
+    Transaction, TransactionRollup, BalanceLedger, BalanceCheckpoint, RecurringTransaction, Debt, DebtRepayment, Budget, Milestone,
     Person, PersonalityTag, RelationshipEvent,
-    DailyScore,
-    AIConfig, create_all_tables
+    DailyScore, ScoreCandle, VitalSnapshot, TaskBitmap,
+    AIConfig
 )
+from database.bitmaps import DayBitmap
+from database.storage import DEFAULT_STORAGE_PROFILE, engine_registry
+from database.migrations import migrate
+
+# session.info 标记：本事务修改了 UserConfig，提交后需要让缓存失效
+_CONFIG_DIRTY = "config_dirty"
+# session.info 标记：本事务修改了任务记录，值为受影响的最早逻辑日，提交后写入变更日志
+_RECORDS_DIRTY = "records_dirty"
+# session.info 标记：本事务只新增了这些 (task_id, 逻辑日) 的记录；有过其他改动时为 None
+_RECORDS_APPENDED = "records_appended"
+# session.info 标记：本事务修改了每日评分，值为受影响的最早一天（epoch 天数）
+_SCORES_DIRTY = "scores_dirty"
+# session.info 标记：本事务改写了这些任务的完成位图（集合，含 None 表示全部），提交后让缓存失效
+_BITMAPS_DIRTY = "bitmaps_dirty"
+# session.info：会话创建时位图缓存的版本号，只有版本号没变才把读到的位图放进缓存
+_BITMAP_VERSION = "bitmap_version"
+# 所有逻辑日都受影响（如修改了一天的起始时刻）
+_ALL_DAYS = -(10 ** 9)
+
+# 余额累计表每变更这么多次写一个检查点
+BALANCE_CHECKPOINT_EVERY = 100
+# 核对余额时允许的浮点误差（不到 1 分）
+BALANCE_TOLERANCE = 0.005
+# 任务记录 id 每到这个倍数写一个心境/血量快照
+VITAL_SNAPSHOT_EVERY = 200
+# (K线周期, 合成来源)：周、月由日线合成；季由月线、年由季线合成，每级只读上一级的少量行
+_CANDLE_SOURCES = (("week", None), ("month", None), ("quarter", "month"), ("year", "quarter"))
 
 
 class DatabaseManager:
     """数据库管理器"""
 
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, profile: str = DEFAULT_STORAGE_PROFILE):
         self.db_path = db_path
-        self.engine = create_engine(f"sqlite:///{db_path}", echo=False)
-        self.SessionFactory = sessionmaker(bind=self.engine)
-        create_all_tables(self.engine)
-        self._migrate()
-
-    def _migrate(self):
-        """数据库迁移：为已有表添加新字段"""
-        from sqlalchemy import text, inspect
-        insp = inspect(self.engine)
-
-        # people 表加 personality 字段
-        if 'people' in insp.get_table_names():
-            cols = [c['name'] for c in insp.get_columns('people')]
-            if 'personality' not in cols:
-                with self.engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE people ADD COLUMN personality TEXT'))
-                    conn.commit()
-
-        # relationship_events 表加 is_completed 字段
-        if 'relationship_events' in insp.get_table_names():
-            cols = [c['name'] for c in insp.get_columns('relationship_events')]
-            if 'is_completed' not in cols:
-                with self.engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE relationship_events ADD COLUMN is_completed BOOLEAN DEFAULT 0'))
-                    conn.commit()
+        self.profile = profile
+        # 同一文件的所有 DatabaseManager 共享 engine 和连接池，建表/迁移只做一次
+        self._entry = engine_registry.acquire(db_path, profile)
+        self.engine = self._entry.engine
+        self.SessionFactory = self._entry.session_factory
+        self._finalizer = weakref.finalize(self, engine_registry.release_later, self._entry)
+        self._entry.ensure_schema(self._init_schema)
+        # 当前上下文（线程/协程）正在进行的 unit of work 的 session
+        self._uow_session: ContextVar[Optional[Session]] = ContextVar(f"uow_session_{id(self)}", default=None)
+
+    def close(self) -> None:
+        """释放对共享 engine 的引用（会话结束时调用，可重复调用）"""
+        if self._finalizer.detach() is not None:
+            engine_registry.release(self._entry)
+
+    def _init_schema(self):
+        """按 PRAGMA user_version 执行未完成的迁移（schema 已最新时只读一次版本号）"""
+        migrate(self.engine)
+
+    def checkpoint(self) -> None:
+        """把 WAL 中的内容写回主库文件（备份前调用，保证单文件拷贝完整）"""
+        with self.engine.connect() as conn:
+            conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+
+    def reset_all_data(self) -> None:
+        """删除所有数据并重建空表（设置页的“重置应用”）
+
+        不经 session 的写入，进程级缓存（用户配置、完成位图）要在这里清掉；
+        两份变更日志记一次“全部改动”，统计、连续打卡、热力图、K 线指标随后整体重建。
+        """
+        Base.metadata.drop_all(self.engine)
+        Base.metadata.create_all(self.engine)
+        self._entry.config_cache.invalidate()
+        self._entry.task_bitmaps.invalidate()
+        self._entry.record_changes.record(_ALL_DAYS)
+        self._entry.score_changes.record(_ALL_DAYS)
 
     @contextmanager
     def session_scope(self):
-        """提供事务性 session 上下文管理器"""
+        """提供事务性 session 上下文管理器
+
+        处于 unit_of_work 内时直接复用外层 session，由外层统一提交或回滚。
+        """
+        outer = self._uow_session.get()
+        if outer is not None:
+            yield outer
+            return
         session = self.SessionFactory()
+        # 在任何读库之前记下，会话里读到的位图都不早于这个版本
+        session.info[_BITMAP_VERSION] = self._entry.task_bitmaps.version()
         try:
             yield session
             session.commit()
+            if session.info.pop(_CONFIG_DIRTY, False):
+                self._entry.config_cache.invalidate()
+            changed_from = session.info.pop(_RECORDS_DIRTY, None)
+            if changed_from is not None:
+                self._entry.record_changes.record(changed_from, session.info.pop(_RECORDS_APPENDED, None))
+            scores_from = session.info.pop(_SCORES_DIRTY, None)
+            if scores_from is not None:
+                self._entry.score_changes.record(scores_from)
+            bitmaps = session.info.pop(_BITMAPS_DIRTY, None)
+            if bitmaps:
+                self._entry.task_bitmaps.invalidate(None if None in bitmaps else bitmaps)
         except Exception:
             session.rollback()
             raise
         finally:
             session.close()
 
+    @contextmanager
+    def unit_of_work(self):
+        """一次用户操作只用一个 session、一次提交
+
+        块内调用的所有 DatabaseManager 方法（以及 session_scope）都加入这个 session；
+        正常退出时提交，抛异常时整体回滚。嵌套调用并入最外层。
+
+            with db.unit_of_work():
+                db.add_task_record(...)
+                db.update_spirit(delta)
+        """
+        outer = self._uow_session.get()
+        if outer is not None:
+            yield outer
+            return
+        with self.session_scope() as s:
+            token = self._uow_session.set(s)
+            try:
+                yield s
+            finally:
+                self._uow_session.reset(token)
+
     # ============ 用户配置 ============
 
     def get_user_config(self) -> Optional[dict]:
-        """获取用户配置"""
+        """获取用户配置（进程级缓存，配置未变化时不查库）"""
+        outer = self._uow_session.get()
+        if outer is not None and outer.info.get(_CONFIG_DIRTY):
+            # 本次操作已改过配置但尚未提交，直接读事务内的值
+            return self._config_to_dict(outer.query(UserConfig).first())
+        config = self._entry.config_cache.get(self._load_user_config)
+        return dict(config) if config else None
+
+    def _load_user_config(self) -> Optional[dict]:
         with self.session_scope() as s:
-            config = s.query(UserConfig).first()
-            if not config:
-                return None
-            return {
-                "id": config.id,
-                "birth_year": config.birth_year,
-                "initial_blood": config.initial_blood,
-                "current_blood": config.current_blood,
-                "current_spirit": config.current_spirit,
-                "target_money": config.target_money,
-                "dark_mode": config.dark_mode,
-                "created_at": config.created_at,
-                "updated_at": config.updated_at,
-            }
+            return self._config_to_dict(s.query(UserConfig).first())
+
+    @staticmethod
+    def _config_to_dict(config: Optional[UserConfig]) -> Optional[dict]:
+        if not config:
+            return None
+        return {
+            "id": config.id,
+            "birth_year": config.birth_year,
+            "initial_blood": config.initial_blood,
+            "current_blood": config.current_blood,
+            "current_spirit": config.current_spirit,
+            "target_money": config.target_money,
+            "dark_mode": config.dark_mode,
+            "day_start_hour": config.day_start_hour or 0,
+            "created_at": config.created_at,
+            "updated_at": config.updated_at,
+        }
 
     def init_user_config(self, birth_year: int, target_money: int = 5_000_000) -> dict:
         """初始化用户配置"""
@@ -91,6 +186,7 @@ class DatabaseManager:
         initial_blood = (DEFAULT_LIFESPAN_YEARS - age) * 365 * 24 * 60
 
         with self.session_scope() as s:
+            s.info[_CONFIG_DIRTY] = True
             config = s.query(UserConfig).first()
             if config:
                 config.birth_year = birth_year
@@ -107,6 +203,7 @@ class DatabaseManager:
                 )
                 s.add(config)
             s.flush()
+            self._snapshot_vitals(s, config.current_spirit or 0, config.current_blood)
             return {
                 "birth_year": config.birth_year,
                 "initial_blood": config.initial_blood,
@@ -114,28 +211,139 @@ class DatabaseManager:
                 "target_money": config.target_money,
             }
 
-    def update_spirit(self, delta: int) -> int:
-        """更新心境值，返回更新后的值"""
-        from services.constants import clamp_spirit
+    def _shift_vitals(self, s: Session, spirit_delta: int = 0,
+                      blood_delta: int = 0) -> Optional[tuple[int, int]]:
+        """在数据库端原子地增减心境/血量并钳制范围，返回 (心境, 血量)；未初始化返回 None
+
+        单条 UPDATE ... RETURNING，不先读后写，并发打卡不会丢更新。
+        """
+        from services.constants import SPIRIT_MIN, SPIRIT_MAX
+        s.info[_CONFIG_DIRTY] = True
+        stmt = (
+            update(UserConfig)
+            .values(
+                current_spirit=func.min(func.max(UserConfig.current_spirit + spirit_delta, SPIRIT_MIN), SPIRIT_MAX),
+                current_blood=func.max(UserConfig.current_blood + blood_delta, 0),
+                updated_at=datetime.now(),
+            )
+            .returning(UserConfig.current_spirit, UserConfig.current_blood)
+            .execution_options(synchronize_session="fetch")
+        )
+        row = s.execute(stmt).first()
+        return (row[0], row[1]) if row else None
+
+    def update_target_money(self, target_money: int) -> None:
+        """修改目标灵石"""
+        with self.session_scope() as s:
+            s.info[_CONFIG_DIRTY] = True
+            config = s.query(UserConfig).first()
+            if config:
+                config.target_money = target_money
+                config.updated_at = datetime.now()
+
+    def update_day_start_hour(self, hour: int) -> None:
+        """修改一天的起始时刻（0~23 点），已有任务记录的逻辑日一并重算"""
+        if not 0 <= hour <= 23:
+            raise ValueError("一天的起始时刻必须在 0~23 点之间")
         with self.session_scope() as s:
+            s.info[_CONFIG_DIRTY] = True
             config = s.query(UserConfig).first()
             if not config:
                 raise ValueError("用户未初始化")
-            config.current_spirit = clamp_spirit(config.current_spirit + delta)
+            config.day_start_hour = hour
             config.updated_at = datetime.now()
-            s.flush()
-            return config.current_spirit
+            self._touch_records(s, _ALL_DAYS)
+            s.execute(text(
+                "UPDATE task_records SET day = CAST(julianday(date(completed_at, :shift)) - 2440587.5 AS INTEGER)"
+            ), {"shift": f"-{hour} hours"})
+            self._rebuild_task_bitmaps(s)
+
+    def _day_start_hour(self) -> int:
+        config = self.get_user_config()
+        return config["day_start_hour"] if config else 0
+
+    def current_day(self) -> int:
+        """当前逻辑日（epoch 天数），按 day_start_hour 折算"""
+        from services.constants import local_day
+        return local_day(datetime.now(), self._day_start_hour())
+
+    def update_spirit(self, delta: int) -> int:
+        """更新心境值，返回更新后的值（不经任务记录的变化，随即写快照）"""
+        with self.session_scope() as s:
+            vitals = self._shift_vitals(s, spirit_delta=delta)
+            if vitals is None:
+                raise ValueError("用户未初始化")
+            self._snapshot_vitals(s, *vitals)
+            # 记录数据没变，但按日回放的结果（K 线）今天需要重算
+            self._touch_records(s, self.current_day(), ())
+            return vitals[0]
 
     def update_blood(self, delta: int) -> int:
-        """更新血量，返回更新后的值"""
+        """更新血量，返回更新后的值（不经任务记录的变化，随即写快照）"""
         with self.session_scope() as s:
-            config = s.query(UserConfig).first()
-            if not config:
+            vitals = self._shift_vitals(s, blood_delta=delta)
+            if vitals is None:
                 raise ValueError("用户未初始化")
-            config.current_blood = max(0, config.current_blood + delta)
-            config.updated_at = datetime.now()
-            s.flush()
-            return config.current_blood
+            self._snapshot_vitals(s, *vitals)
+            # 记录数据没变，但按日回放的结果（K 线）今天需要重算
+            self._touch_records(s, self.current_day(), ())
+            return vitals[1]
+
+    # ============ 心境/血量快照 ============
+
+    @staticmethod
+    def _snapshot_vitals(s: Session, spirit: int, blood: int,
+                         taken_at: datetime = None, record_id: int = None) -> None:
+        """记下此刻的心境/血量；record_id 默认取当前最大的任务记录 id"""
+        if record_id is None:
+            record_id = s.query(func.coalesce(func.max(TaskRecord.id), 0)).scalar()
+        s.add(VitalSnapshot(taken_at=taken_at or datetime.now(), record_id=record_id,
+                            spirit=spirit, blood=blood))
+
+    @staticmethod
+    def _invalidate_vital_snapshots(s: Session, since: datetime) -> None:
+        """since 及之后的快照作废（改动了这之前的历史记录时调用）"""
+        s.query(VitalSnapshot).filter(VitalSnapshot.taken_at >= since).delete(synchronize_session=False)
+
+    def get_first_record_day(self) -> Optional[int]:
+        """最早一条有效任务记录的逻辑日"""
+        with self.session_scope() as s:
+            return s.query(func.min(TaskRecord.day)).filter(TaskRecord.is_undo == False).scalar()
+
+    def get_vital_anchor(self, moment: datetime) -> dict:
+        """moment 及之前最近的快照 {"taken_at", "record_id", "spirit", "blood"}
+
+        没有快照时返回初始状态（心境 0、血量为初始血量），taken_at 为 None。
+        """
+        from services.constants import SPIRIT_DEFAULT
+        with self.session_scope() as s:
+            snap = s.query(VitalSnapshot).filter(VitalSnapshot.taken_at <= moment).order_by(
+                VitalSnapshot.taken_at.desc(), VitalSnapshot.record_id.desc()).first()
+            if snap:
+                return {"taken_at": snap.taken_at, "record_id": snap.record_id,
+                        "spirit": snap.spirit, "blood": snap.blood}
+            config = s.query(UserConfig.initial_blood).first()
+            return {"taken_at": None, "record_id": 0, "spirit": SPIRIT_DEFAULT,
+                    "blood": config.initial_blood if config else 0}
+
+    def get_vital_events(self, anchor: dict, until: datetime) -> list[tuple]:
+        """anchor 之后、until（含）之前的有效任务记录 [(completed_at, id, spirit_change, blood_change)]，按发生顺序"""
+        with self.session_scope() as s:
+            q = s.query(TaskRecord.completed_at, TaskRecord.id,
+                        TaskRecord.spirit_change, TaskRecord.blood_change).filter(
+                TaskRecord.is_undo == False, TaskRecord.completed_at <= until)
+            if anchor["taken_at"] is not None:
+                q = q.filter(tuple_(TaskRecord.completed_at, TaskRecord.id) > (anchor["taken_at"], anchor["record_id"]))
+            return [tuple(r) for r in q.order_by(TaskRecord.completed_at, TaskRecord.id).all()]
+
+    def get_vital_snapshots(self, start: datetime, end: datetime) -> list[dict]:
+        """(start, end] 之间的快照，按时间排序（区间回放时用来校准）"""
+        with self.session_scope() as s:
+            snaps = s.query(VitalSnapshot).filter(
+                VitalSnapshot.taken_at > start, VitalSnapshot.taken_at <= end
+            ).order_by(VitalSnapshot.taken_at, VitalSnapshot.record_id).all()
+            return [{"taken_at": v.taken_at, "record_id": v.record_id, "spirit": v.spirit, "blood": v.blood}
+                    for v in snaps]
 
     # ============ 任务 CRUD ============
 
@@ -194,10 +402,37 @@ class DatabaseManager:
 
     # ============ 任务记录 ============
 
+    def record_generation(self) -> int:
+        """任务记录的版本号：同一数据库文件上任何一次写记录的提交都会让它变化"""
+        return self._entry.record_changes.generation
+
+    def records_changed_since(self, generation: int) -> Optional[int]:
+        """generation 之后的提交影响到的最早逻辑日；无法确定时返回 None（需要整体重算）"""
+        return self._entry.record_changes.changed_since(generation)
+
+    def records_appended_since(self, generation: int) -> Optional[list[tuple[int, int]]]:
+        """generation 之后的提交若都只是新增记录，返回新增的 [(task_id, 逻辑日)]；否则 None"""
+        return self._entry.record_changes.appended_since(generation)
+
+    @staticmethod
+    def _touch_records(s: Session, day: Optional[int], appended: tuple = None) -> None:
+        """标记本事务改动了 day 及之后的任务记录统计（day 未知时按全部处理）
+
+        appended 为只是新增记录时的 ((task_id, 逻辑日), ...)，记录本身没变时传 ()；
+        None 表示修改 / 删除 / 撤销 / 补记等，按天追加的缓存需要重读。
+        """
+        day = _ALL_DAYS if day is None else day
+        s.info[_RECORDS_DIRTY] = min(s.info.get(_RECORDS_DIRTY, day), day)
+        previous = s.info.get(_RECORDS_APPENDED, ())
+        s.info[_RECORDS_APPENDED] = None if appended is None or previous is None else previous + appended
+
     def add_task_record(self, task_id: int, task_name: str,
                         spirit_change: int, blood_change: int,
                         is_makeup: bool = False, notes: str = None) -> dict:
         """添加任务完成记录"""
+        from services.constants import local_day
+        now = datetime.now()
+        day = local_day(now, self._day_start_hour())
         with self.session_scope() as s:
             record = TaskRecord(
                 task_id=task_id,
@@ -205,17 +440,19 @@ class DatabaseManager:
                 spirit_change=spirit_change,
                 blood_change=blood_change,
                 is_makeup=is_makeup,
+                completed_at=now,
+                day=day,
                 notes=notes,
             )
             s.add(record)
-            # 更新心境和血量
-            config = s.query(UserConfig).first()
-            if config:
-                from services.constants import clamp_spirit
-                config.current_spirit = clamp_spirit(config.current_spirit + spirit_change)
-                config.current_blood = max(0, config.current_blood + blood_change)
-                config.updated_at = datetime.now()
             s.flush()
+            self._touch_records(s, day, ((task_id, day),))
+            self._mark_completion(s, task_id, day, True)
+            # 更新心境和血量
+            vitals = self._shift_vitals(s, spirit_change, blood_change)
+            new_spirit, new_blood = vitals or (0, 0)
+            if vitals and record.id % VITAL_SNAPSHOT_EVERY == 0:
+                self._snapshot_vitals(s, new_spirit, new_blood, record.completed_at, record.id)
             return {
                 "id": record.id,
                 "task_id": record.task_id,
@@ -223,8 +460,9 @@ class DatabaseManager:
                 "spirit_change": record.spirit_change,
                 "blood_change": record.blood_change,
                 "completed_at": record.completed_at,
-                "new_spirit": config.current_spirit if config else 0,
-                "new_blood": config.current_blood if config else 0,
+                "day": record.day,
+                "new_spirit": new_spirit,
+                "new_blood": new_blood,
             }
 
     def undo_task_record(self, record_id: int) -> Optional[dict]:
@@ -233,63 +471,213 @@ class DatabaseManager:
             record = s.query(TaskRecord).filter(TaskRecord.id == record_id).first()
             if not record or record.is_undo:
                 return None
-            # 检查是否当天
-            today = date.today()
-            if record.completed_at.date() != today:
+            # 检查是否当天（逻辑日）
+            if record.day != self.current_day():
                 return None
             record.is_undo = True
-            # 回退心境和血量
-            config = s.query(UserConfig).first()
-            if config:
-                from services.constants import clamp_spirit
-                config.current_spirit = clamp_spirit(config.current_spirit - record.spirit_change)
-                config.current_blood = max(0, config.current_blood - record.blood_change)
-                config.updated_at = datetime.now()
             s.flush()
+            # 与删除相同：完成位 / 变更日志按撤销的那天处理；该记录之后的快照改写为不含它的值，
+            # 快照里记下的境界奖励等不经任务记录的变化保留下来
+            vitals = self._replay_record_change(
+                s, record.task_id, record.day, None,
+                {record.id: (record.completed_at, record.spirit_change, record.blood_change)}, record.completed_at)
+            new_spirit, new_blood = vitals or (0, 0)
             return {
                 "record_id": record.id,
                 "reverted_spirit": record.spirit_change,
                 "reverted_blood": record.blood_change,
-                "new_spirit": config.current_spirit if config else 0,
-                "new_blood": config.current_blood if config else 0,
+                "new_spirit": new_spirit,
+                "new_blood": new_blood,
+            }
+
+    def add_makeup_records(self, rows: list[dict]) -> dict:
+        """批量补记过去的完成记录，一个事务写入
+
+        rows 每项 {"task_id", "task_name", "spirit_change", "blood_change", "day", "notes"（可选）}，
+        记在该逻辑日的正午（不晚于此刻）、is_makeup=True。写入后按钳制规则重算当前心境/血量并改写
+        受影响的快照；连续打卡、K 线、统计等由记录变更日志从最早的补记日起增量刷新。
+        返回 {"records": [...], "new_spirit", "new_blood"}。
+        """
+        from services.constants import day_to_date
+        if not rows:
+            raise ValueError("没有要补记的记录")
+        now = datetime.now()
+        noon = timedelta(hours=self._day_start_hour() + 12)
+        with self.session_scope() as s:
+            records = [TaskRecord(
+                task_id=row["task_id"],
+                task_name=row["task_name"],
+                spirit_change=row["spirit_change"],
+                blood_change=row["blood_change"],
+                is_makeup=True,
+                completed_at=min(datetime.combine(day_to_date(row["day"]), datetime.min.time()) + noon, now),
+                day=row["day"],
+                notes=row.get("notes"),
+            ) for row in rows]
+            s.add_all(records)
+            s.flush()
+            self._touch_records(s, min(r.day for r in records))
+            by_task = {}
+            for r in records:
+                by_task.setdefault(r.task_id, []).append(r.day)
+            for task_id, days in by_task.items():
+                self._mark_completions(s, task_id, days)
+            vitals = self._rebase_vitals(s, min(r.completed_at for r in records), dict.fromkeys(r.id for r in records))
+            new_spirit, new_blood = vitals or (0, 0)
+            if vitals:
+                self._snapshot_vitals(s, new_spirit, new_blood)
+            return {
+                "records": [self._record_to_dict(r) for r in records],
+                "new_spirit": new_spirit,
+                "new_blood": new_blood,
             }
 
+    def get_task_record(self, record_id: int) -> Optional[dict]:
+        """获取单条任务记录"""
+        with self.session_scope() as s:
+            record = s.query(TaskRecord).filter(TaskRecord.id == record_id).first()
+            return self._record_to_dict(record) if record else None
+
+    def update_task_record(self, record_id: int, **fields) -> Optional[dict]:
+        """修改任意一条任务记录（心境/血量变化、完成时间、备注）
+
+        只从改动涉及的最早时刻往后重算：心境/血量从那之前最近的快照回放，完成位图只改新旧两天，
+        连续打卡、K 线、统计由记录变更日志从受影响的最早逻辑日起增量刷新。
+        """
+        allowed = {"spirit_change", "blood_change", "completed_at", "notes"}
+        unknown = set(fields) - allowed
+        if unknown:
+            raise ValueError(f"不支持修改的字段: {', '.join(sorted(unknown))}")
+        from services.constants import local_day
+        with self.session_scope() as s:
+            record = s.query(TaskRecord).filter(TaskRecord.id == record_id).first()
+            if not record:
+                return None
+            old, old_day = (record.completed_at, record.spirit_change, record.blood_change), record.day
+            for key, value in fields.items():
+                setattr(record, key, value)
+            record.day = local_day(record.completed_at, self._day_start_hour())
+            s.flush()
+            vitals = None
+            if not record.is_undo:
+                vitals = self._replay_record_change(s, record.task_id, old_day, record.day,
+                                                    {record.id: old}, min(old[0], record.completed_at))
+            new_spirit, new_blood = vitals or (0, 0)
+            return {**self._record_to_dict(record), "new_spirit": new_spirit, "new_blood": new_blood}
+
+    def delete_task_record(self, record_id: int) -> Optional[dict]:
+        """删除任意一条任务记录，下游数据同 update_task_record 只从该记录的时刻往后重算"""
+        with self.session_scope() as s:
+            record = s.query(TaskRecord).filter(TaskRecord.id == record_id).first()
+            if not record:
+                return None
+            old = (record.completed_at, record.spirit_change, record.blood_change)
+            task_id, day, live = record.task_id, record.day, not record.is_undo
+            s.delete(record)
+            s.flush()
+            vitals = self._replay_record_change(s, task_id, day, None, {record_id: old}, old[0]) if live else None
+            new_spirit, new_blood = vitals or (0, 0)
+            return {"record_id": record_id, "new_spirit": new_spirit, "new_blood": new_blood}
+
+    def _replay_record_change(self, s: Session, task_id: int, old_day: int, new_day: Optional[int],
+                              before: dict, since: datetime) -> Optional[tuple[int, int]]:
+        """一条记录从 old_day 改到 new_day（None 为删除 / 撤销）后的下游修正，返回新的 (心境, 血量)"""
+        self._touch_records(s, old_day if new_day is None else min(old_day, new_day))
+        if old_day != new_day:
+            still_done = s.query(TaskRecord.id).filter(
+                TaskRecord.task_id == task_id, TaskRecord.day == old_day, TaskRecord.is_undo == False
+            ).first() is not None
+            self._mark_completion(s, task_id, old_day, still_done)
+        if new_day is not None:
+            self._mark_completion(s, task_id, new_day, True)
+        vitals = self._rebase_vitals(s, since, before)
+        if vitals:
+            self._snapshot_vitals(s, *vitals)
+        return vitals
+
+    def _rebase_vitals(self, s: Session, since: datetime, before: dict) -> Optional[tuple[int, int]]:
+        """改动了 since 及之后的任务记录后，重算当前心境/血量并改写 since 之后的快照
+
+        before 是被改动记录改动前的 {record_id: (completed_at, spirit_change, blood_change)}，
+        改动前不在时间线上的（新补记的）为 None。从 since 之前最近的快照起并排回放两条时间线
+        （每步钳制）：旧线用改动前的记录，新线用现在的。到快照时旧线与快照的差就是不经任务记录的
+        变化（境界奖励等），新线同样加上，快照改写为新线的值；末尾与当前值的差同样处理。
+        返回 (心境, 血量)；未初始化返回 None。开销只与 since 之后的记录数有关。
+        """
+        from services.constants import SPIRIT_DEFAULT, clamp_spirit
+        config = s.query(UserConfig).first()
+        if config is None:
+            return None
+        anchor = s.query(VitalSnapshot).filter(VitalSnapshot.taken_at < since).order_by(
+            VitalSnapshot.taken_at.desc(), VitalSnapshot.record_id.desc()).first()
+        events = s.query(TaskRecord.completed_at, TaskRecord.id,
+                         TaskRecord.spirit_change, TaskRecord.blood_change).filter(TaskRecord.is_undo == False)
+        if anchor:
+            old = new = (anchor.spirit, anchor.blood)
+            events = events.filter(tuple_(TaskRecord.completed_at, TaskRecord.id) > (anchor.taken_at, anchor.record_id))
+        else:
+            old = new = (SPIRIT_DEFAULT, config.initial_blood)
+        # (时间, 记录 id, 类别, 数据, 计入旧线, 计入新线)：同一位置上事件排在快照之前，与 VitalsReplay 一致
+        stream = [(t, rid, 0, (ds, db), rid not in before, True) for t, rid, ds, db in events]
+        stream += [(prev[0], rid, 0, prev[1:], True, False) for rid, prev in before.items() if prev is not None]
+        stream += [(v.taken_at, v.record_id, 1, v, False, False)
+                   for v in s.query(VitalSnapshot).filter(VitalSnapshot.taken_at >= since)]
+        stream.sort(key=lambda item: item[:3])
+
+        def shift(vitals, spirit_delta, blood_delta):
+            return clamp_spirit(vitals[0] + spirit_delta), max(vitals[1] + blood_delta, 0)
+
+        for _, _, kind, item, in_old, in_new in stream:
+            if kind == 1:
+                new = shift(new, item.spirit - old[0], item.blood - old[1])
+                old = (item.spirit, item.blood)
+                item.spirit, item.blood = new
+                continue
+            if in_old:
+                old = shift(old, *item)
+            if in_new:
+                new = shift(new, *item)
+        new = shift(new, config.current_spirit - old[0], config.current_blood - old[1])
+        config.current_spirit, config.current_blood = new
+        config.updated_at = datetime.now()
+        s.info[_CONFIG_DIRTY] = True
+        return new
+
     def get_today_records(self) -> list[dict]:
-        """获取今日任务记录"""
-        today_start = datetime.combine(date.today(), datetime.min.time())
-        today_end = datetime.combine(date.today(), datetime.max.time())
+        """获取今日（当前逻辑日）任务记录"""
+        today = self.current_day()
         with self.session_scope() as s:
             records = s.query(TaskRecord).filter(
-                TaskRecord.completed_at >= today_start,
-                TaskRecord.completed_at <= today_end,
+                TaskRecord.day == today,
                 TaskRecord.is_undo == False
             ).all()
             return [self._record_to_dict(r) for r in records]
 
     def is_task_completed_today(self, task_id: int) -> bool:
-        """检查任务今日是否已完成"""
-        today_start = datetime.combine(date.today(), datetime.min.time())
-        today_end = datetime.combine(date.today(), datetime.max.time())
+        """检查任务今日（当前逻辑日）是否已完成，查完成位图"""
+        today = self.current_day()
         with self.session_scope() as s:
-            count = s.query(TaskRecord).filter(
-                TaskRecord.task_id == task_id,
-                TaskRecord.completed_at >= today_start,
-                TaskRecord.completed_at <= today_end,
-                TaskRecord.is_undo == False
-            ).count()
-            return count > 0
+            return self._task_bitmap(s, task_id).has(today)
 
     def get_task_today_count(self, task_id: int) -> int:
-        """获取任务今日完成次数"""
-        today_start = datetime.combine(date.today(), datetime.min.time())
-        today_end = datetime.combine(date.today(), datetime.max.time())
+        """获取任务今日（当前逻辑日）完成次数"""
+        today = self.current_day()
         with self.session_scope() as s:
-            return s.query(TaskRecord).filter(
+            return s.query(func.count(TaskRecord.id)).filter(
                 TaskRecord.task_id == task_id,
-                TaskRecord.completed_at >= today_start,
-                TaskRecord.completed_at <= today_end,
+                TaskRecord.day == today,
                 TaskRecord.is_undo == False
-            ).count()
+            ).scalar()
+
+    def get_today_task_counts(self) -> dict[int, int]:
+        """所有任务今日（当前逻辑日）完成次数 {task_id: 次数}，一条 GROUP BY 查询"""
+        today = self.current_day()
+        with self.session_scope() as s:
+            rows = s.query(TaskRecord.task_id, func.count(TaskRecord.id)).filter(
+                TaskRecord.day == today,
+                TaskRecord.is_undo == False
+            ).group_by(TaskRecord.task_id).all()
+            return {task_id: count for task_id, count in rows}
 
     def get_records_in_range(self, start_date: date, end_date: date) -> list[dict]:
         """获取日期范围内的记录"""
@@ -303,52 +691,175 @@ class DatabaseManager:
             ).order_by(TaskRecord.completed_at).all()
             return [self._record_to_dict(r) for r in records]
 
-    # ============ 连续打卡 ============
+    def get_daily_spirit(self, start_day: Optional[int], end_day: int) -> dict[int, dict]:
+        """按逻辑日汇总心境和血量变化，没有记录的日子不出现；start_day 为 None 时从最早的记录算起
 
-    def update_streak(self, task_id: int) -> dict:
-        """更新连续打卡记录"""
-        today = date.today()
+        {day: {"positive", "demon", "net", "positive_count", "demon_count", "count", "blood"}}
+        positive / demon 都是正数，net = positive - demon
+        """
+        gain, loss = TaskRecord.spirit_change > 0, TaskRecord.spirit_change < 0
         with self.session_scope() as s:
-            streak = s.query(StreakRecord).filter(StreakRecord.task_id == task_id).first()
-            if not streak:
-                streak = StreakRecord(task_id=task_id, current_streak=1, max_streak=1, last_completed_date=today)
-                s.add(streak)
-            else:
-                if streak.last_completed_date == today:
-                    pass  # 今天已打卡
-                elif streak.last_completed_date == today - timedelta(days=1):
-                    streak.current_streak += 1
-                    streak.max_streak = max(streak.max_streak, streak.current_streak)
-                else:
-                    streak.current_streak = 1
-                streak.last_completed_date = today
-            s.flush()
+            q = s.query(
+                TaskRecord.day,
+                func.sum(case((gain, TaskRecord.spirit_change), else_=0)),
+                func.sum(case((loss, -TaskRecord.spirit_change), else_=0)),
+                func.sum(case((gain, 1), else_=0)),
+                func.sum(case((loss, 1), else_=0)),
+                func.count(),
+                func.sum(TaskRecord.blood_change),
+            ).filter(TaskRecord.is_undo == False, TaskRecord.day <= end_day)
+            if start_day is not None:
+                q = q.filter(TaskRecord.day >= start_day)
             return {
-                "task_id": task_id,
-                "current_streak": streak.current_streak,
-                "max_streak": streak.max_streak,
+                day: {"positive": positive, "demon": demon, "net": positive - demon,
+                      "positive_count": positive_count, "demon_count": demon_count,
+                      "count": count, "blood": blood}
+                for day, positive, demon, positive_count, demon_count, count, blood
+                in q.group_by(TaskRecord.day).all()
             }
 
-    def get_streak(self, task_id: int) -> Optional[dict]:
-        """获取打卡记录（实时判断连续性）"""
-        today = date.today()
+    def get_spirit_window_stats(self, end_day: int, windows: list[int]) -> dict[str, dict]:
+        """一条聚合查询算出各任务在多个时间窗口内的统计
+
+        窗口 w 表示 [end_day - w, end_day]，0 即当天。
+        返回 {task_name: {w: {"positive", "demon", "positive_count", "demon_count", "count", "blood"}}}，
+        按任务名归并（任务删除后仍可统计）；positive / demon 都是正数。
+        """
+        columns = [TaskRecord.task_name]
+        for w in windows:
+            in_window = TaskRecord.day >= end_day - w
+            gain = and_(in_window, TaskRecord.spirit_change > 0)
+            loss = and_(in_window, TaskRecord.spirit_change < 0)
+            columns += [
+                func.sum(case((gain, TaskRecord.spirit_change), else_=0)),
+                func.sum(case((loss, -TaskRecord.spirit_change), else_=0)),
+                func.sum(case((gain, 1), else_=0)),
+                func.sum(case((loss, 1), else_=0)),
+                func.sum(case((in_window, 1), else_=0)),
+                func.sum(case((in_window, TaskRecord.blood_change), else_=0)),
+            ]
+        fields = ("positive", "demon", "positive_count", "demon_count", "count", "blood")
         with self.session_scope() as s:
-            streak = s.query(StreakRecord).filter(StreakRecord.task_id == task_id).first()
-            if not streak:
-                return None
-            # 实时判断：如果最后打卡日期不是今天也不是昨天，连续打卡已断
-            actual_streak = streak.current_streak
-            if streak.last_completed_date and streak.last_completed_date < today - timedelta(days=1):
-                actual_streak = 0
-                # 持久化重置
-                streak.current_streak = 0
-                s.flush()
-            return {
-                "task_id": streak.task_id,
-                "current_streak": actual_streak,
-                "max_streak": streak.max_streak,
-                "last_completed_date": streak.last_completed_date,
-            }
+            rows = s.query(*columns).filter(
+                TaskRecord.is_undo == False,
+                TaskRecord.day >= end_day - max(windows),
+                TaskRecord.day <= end_day,
+            ).group_by(TaskRecord.task_name).all()
+            result = {}
+            for name, *values in rows:
+                result[name] = {
+                    w: dict(zip(fields, values[i * len(fields):(i + 1) * len(fields)]))
+                    for i, w in enumerate(windows)
+                }
+            return result
+
+    # ============ 完成位图 ============
+
+    def _task_bitmap(self, s: Session, task_id: int) -> DayBitmap:
+        """任务的完成位图；本事务改过它时读事务内的版本，不进缓存"""
+        dirty = s.info.get(_BITMAPS_DIRTY, ())
+        clean = task_id not in dirty and None not in dirty
+        cache = self._entry.task_bitmaps
+        if clean:
+            bitmap = cache.get(task_id)
+            if bitmap is not None:
+                return bitmap
+        row = s.get(TaskBitmap, task_id)
+        bitmap = DayBitmap.from_blob(row.origin, row.bits) if row else DayBitmap()
+        if clean:
+            cache.put(task_id, bitmap, s.info[_BITMAP_VERSION])
+        return bitmap
+
+    def _mark_completion(self, s: Session, task_id: int, day: int, done: bool) -> None:
+        """置位 / 清除任务在 day 的完成位"""
+        row = s.get(TaskBitmap, task_id)
+        bitmap = DayBitmap.from_blob(row.origin, row.bits) if row else DayBitmap()
+        if bitmap.has(day) == done:
+            return
+        if done:
+            bitmap.set(day)
+        else:
+            bitmap.clear(day)
+        if row is None:
+            s.add(TaskBitmap(task_id=task_id, origin=bitmap.origin, bits=bitmap.to_blob()))
+        else:
+            row.origin, row.bits = bitmap.origin, bitmap.to_blob()
+        s.info.setdefault(_BITMAPS_DIRTY, set()).add(task_id)
+
+    def _mark_completions(self, s: Session, task_id: int, days: list[int]) -> None:
+        """批量置位同一任务的多个完成日（只读写一次位图）"""
+        row = s.get(TaskBitmap, task_id)
+        bitmap = DayBitmap.from_blob(row.origin, row.bits) if row else DayBitmap()
+        for day in sorted(days):
+            bitmap.set(day)
+        if row is None:
+            s.add(TaskBitmap(task_id=task_id, origin=bitmap.origin, bits=bitmap.to_blob()))
+        else:
+            row.origin, row.bits = bitmap.origin, bitmap.to_blob()
+        s.info.setdefault(_BITMAPS_DIRTY, set()).add(task_id)
+
+    def _rebuild_task_bitmaps(self, s: Session) -> None:
+        """按任务记录重建全部完成位图"""
+        bitmaps = {}
+        for task_id, day in s.query(TaskRecord.task_id, TaskRecord.day).filter(
+                TaskRecord.is_undo == False, TaskRecord.day.isnot(None)).distinct():
+            bitmaps.setdefault(task_id, DayBitmap()).set(day)
+        s.query(TaskBitmap).delete(synchronize_session=False)
+        if bitmaps:
+            s.execute(sqlite_insert(TaskBitmap), [
+                {"task_id": task_id, "origin": b.origin, "bits": b.to_blob()} for task_id, b in bitmaps.items()])
+        s.info.setdefault(_BITMAPS_DIRTY, set()).add(None)
+
+    def rebuild_task_bitmaps(self) -> None:
+        """按任务记录重建全部完成位图（位图与记录不一致时修复用）"""
+        with self.session_scope() as s:
+            self._rebuild_task_bitmaps(s)
+
+    def get_task_bitmap(self, task_id: int) -> DayBitmap:
+        """任务的完成位图（缓存对象，只读）"""
+        with self.session_scope() as s:
+            return self._task_bitmap(s, task_id)
+
+    def get_task_bitmaps(self, task_ids: list[int]) -> dict[int, DayBitmap]:
+        """多个任务的完成位图 {task_id: DayBitmap}，未缓存的一次查出"""
+        with self.session_scope() as s:
+            dirty = s.info.get(_BITMAPS_DIRTY, ())
+            clean = None not in dirty
+            cache = self._entry.task_bitmaps
+            result = {}
+            if clean:
+                for t in task_ids:
+                    bitmap = cache.get(t) if t not in dirty else None
+                    if bitmap is not None:
+                        result[t] = bitmap
+            missing = [t for t in task_ids if t not in result]
+            if missing:
+                rows = {r.task_id: r for r in s.query(TaskBitmap).filter(TaskBitmap.task_id.in_(missing))}
+                for t in missing:
+                    row = rows.get(t)
+                    bitmap = DayBitmap.from_blob(row.origin, row.bits) if row else DayBitmap()
+                    if clean and t not in dirty:
+                        cache.put(t, bitmap, s.info[_BITMAP_VERSION])
+                    result[t] = bitmap
+            return result
+
+    def get_completion_rate(self, task_id: int, start_day: int, end_day: int) -> float:
+        """任务在 [start_day, end_day]（逻辑日）内的完成率"""
+        return self.get_task_bitmap(task_id).rate(start_day, end_day)
+
+    def get_completion_days(self, since_day: Optional[int] = None,
+                            streak_only: bool = False) -> list[tuple[int, int]]:
+        """[(task_id, 逻辑日)]：每个任务有未撤销记录的日子，按任务、日期升序；since_day 起（含）
+
+        streak_only 时只取开启了连续打卡的任务。
+        """
+        with self.session_scope() as s:
+            q = s.query(TaskRecord.task_id, TaskRecord.day).filter(TaskRecord.is_undo == False)
+            if streak_only:
+                q = q.join(Task, Task.id == TaskRecord.task_id).filter(Task.enable_streak == True)
+            if since_day is not None:
+                q = q.filter(TaskRecord.day >= since_day)
+            return [tuple(r) for r in q.distinct().order_by(TaskRecord.task_id, TaskRecord.day)]
 
     # ============ 境界系统 ============
 
@@ -368,16 +879,39 @@ class DatabaseManager:
             s.flush()
             return self._realm_to_dict(realm)
 
-    def get_active_realm(self, realm_type: str = "main") -> Optional[dict]:
-        """获取当前活跃境界"""
+    @staticmethod
+    def _realm_tree_query(s: Session):
+        """境界 + 技能 + 子任务一次性加载（selectin，各一条 SQL，不随技能数增长）"""
+        return s.query(Realm).options(selectinload(Realm.skills).selectinload(Skill.sub_tasks))
+
+    def get_active_realm(self, realm_type: str = "main", include_skills: bool = True) -> Optional[dict]:
+        """获取当前活跃境界（默认含技能树；只需要进度时 include_skills=False，只查一行）"""
         with self.session_scope() as s:
-            realm = s.query(Realm).filter(
+            q = self._realm_tree_query(s) if include_skills else s.query(Realm)
+            realm = q.filter(
                 Realm.status == "active",
                 Realm.realm_type == realm_type
             ).first()
             if not realm:
                 return None
-            return self._realm_to_dict(realm, include_skills=True, session=s)
+            return self._realm_to_dict(realm, include_skills=include_skills)
+
+    def get_active_realms(self, realm_type: str) -> list[dict]:
+        """获取某类型全部活跃境界（含技能树），按开始时间倒序"""
+        with self.session_scope() as s:
+            realms = self._realm_tree_query(s).filter(
+                Realm.status == "active",
+                Realm.realm_type == realm_type
+            ).order_by(Realm.started_at.desc()).all()
+            return [self._realm_to_dict(r, include_skills=True) for r in realms]
+
+    def get_realm_tree(self, realm_id: int) -> Optional[dict]:
+        """获取单个境界（含技能树）"""
+        with self.session_scope() as s:
+            realm = self._realm_tree_query(s).filter(Realm.id == realm_id).first()
+            if not realm:
+                return None
+            return self._realm_to_dict(realm, include_skills=True)
 
     def complete_realm(self, realm_id: int) -> Optional[dict]:
         """完成境界"""
@@ -393,16 +927,38 @@ class DatabaseManager:
     def create_skill(self, realm_id: int, name: str, description: str = None) -> dict:
         """创建技能（大任务）"""
         with self.session_scope() as s:
-            skill = Skill(realm_id=realm_id, name=name, description=description)
+            skill = Skill(realm_id=realm_id, name=name, description=description,
+                          total_sub_tasks=0, completed_sub_tasks=0)
             s.add(skill)
             s.flush()
+            self._shift_realm_counters(s, realm_id, skills=1)
             return self._skill_to_dict(skill)
 
+    def delete_skill(self, skill_id: int) -> bool:
+        """删除技能（含子任务）"""
+        from services.constants import skill_fraction
+        with self.session_scope() as s:
+            skill = s.query(Skill).filter(Skill.id == skill_id).first()
+            if not skill:
+                return False
+            self._shift_realm_counters(
+                s, skill.realm_id, skills=-1,
+                total=-(skill.total_sub_tasks or 0), completed=-(skill.completed_sub_tasks or 0),
+                progress=-skill_fraction(skill.total_sub_tasks or 0, skill.completed_sub_tasks or 0,
+                                         skill.is_completed),
+            )
+            s.delete(skill)
+            return True
+
     def create_sub_task(self, skill_id: int, name: str) -> dict:
         """创建子任务"""
         with self.session_scope() as s:
+            skill = s.query(Skill).filter(Skill.id == skill_id).first()
+            if not skill:
+                raise ValueError("技能不存在")
             sub = SubTask(skill_id=skill_id, name=name)
             s.add(sub)
+            self._sync_skill_counters(s, skill, total_delta=1)
             s.flush()
             return {"id": sub.id, "skill_id": sub.skill_id, "name": sub.name, "is_completed": False}
 
@@ -412,31 +968,126 @@ class DatabaseManager:
             sub = s.query(SubTask).filter(SubTask.id == sub_task_id).first()
             if not sub:
                 raise ValueError("子任务不存在")
+            newly_completed = not sub.is_completed
             sub.is_completed = True
             sub.completed_at = datetime.now()
 
             # 检查大任务下所有子任务是否完成
             skill = s.query(Skill).filter(Skill.id == sub.skill_id).first()
-            all_subs = s.query(SubTask).filter(SubTask.skill_id == skill.id).all()
-            completed_count = sum(1 for st in all_subs if st.is_completed)
-            skill_auto_completed = completed_count == len(all_subs)
-            if skill_auto_completed:
-                skill.is_completed = True
-                skill.completed_at = datetime.now()
+            completed_count = (skill.completed_sub_tasks or 0) + (1 if newly_completed else 0)
+            total = skill.total_sub_tasks or 0
+            skill_auto_completed = completed_count == total
+            self._sync_skill_counters(s, skill, completed_delta=1 if newly_completed else 0,
+                                      is_completed=True if skill_auto_completed else None)
 
             s.flush()
             return {
                 "sub_task_id": sub.id,
                 "skill_id": skill.id,
                 "skill_completed": skill_auto_completed,
-                "progress": completed_count / len(all_subs) if all_subs else 0,
+                "progress": completed_count / total if total else 0,
             }
 
+    def uncomplete_sub_task(self, sub_task_id: int) -> bool:
+        """取消完成子任务，同时取消大任务的完成状态"""
+        with self.session_scope() as s:
+            sub = s.query(SubTask).filter(SubTask.id == sub_task_id).first()
+            if not sub:
+                return False
+            was_completed = bool(sub.is_completed)
+            sub.is_completed = False
+            sub.completed_at = None
+            skill = s.query(Skill).filter(Skill.id == sub.skill_id).first()
+            if skill:
+                self._sync_skill_counters(s, skill, completed_delta=-1 if was_completed else 0,
+                                          is_completed=False)
+            return True
+
+    def delete_sub_task(self, sub_task_id: int) -> bool:
+        """删除子任务"""
+        with self.session_scope() as s:
+            sub = s.query(SubTask).filter(SubTask.id == sub_task_id).first()
+            if not sub:
+                return False
+            skill = s.query(Skill).filter(Skill.id == sub.skill_id).first()
+            if skill:
+                self._sync_skill_counters(s, skill, total_delta=-1,
+                                          completed_delta=-1 if sub.is_completed else 0)
+            s.delete(sub)
+            return True
+
+    # ---- 进度冗余计数 ----
+
+    @staticmethod
+    def _shift_realm_counters(s: Session, realm_id: int, skills: int = 0, total: int = 0,
+                              completed: int = 0, progress: float = 0.0) -> None:
+        """境界汇总计数增减（单条 UPDATE）"""
+        s.query(Realm).filter(Realm.id == realm_id).update({
+            Realm.total_skills: func.coalesce(Realm.total_skills, 0) + skills,
+            Realm.total_sub_tasks: func.coalesce(Realm.total_sub_tasks, 0) + total,
+            Realm.completed_sub_tasks: func.coalesce(Realm.completed_sub_tasks, 0) + completed,
+            Realm.progress_sum: func.coalesce(Realm.progress_sum, 0) + progress,
+        }, synchronize_session="fetch")
+
+    def _sync_skill_counters(self, s: Session, skill: Skill, total_delta: int = 0,
+                             completed_delta: int = 0, is_completed: Optional[bool] = None) -> None:
+        """子任务增删或完成状态变化时，在调用方事务内更新技能及所属境界的计数"""
+        from services.constants import skill_fraction
+        before = skill_fraction(skill.total_sub_tasks or 0, skill.completed_sub_tasks or 0, skill.is_completed)
+        skill.total_sub_tasks = (skill.total_sub_tasks or 0) + total_delta
+        skill.completed_sub_tasks = (skill.completed_sub_tasks or 0) + completed_delta
+        if is_completed is not None and is_completed != bool(skill.is_completed):
+            skill.is_completed = is_completed
+            skill.completed_at = datetime.now() if is_completed else None
+        after = skill_fraction(skill.total_sub_tasks, skill.completed_sub_tasks, skill.is_completed)
+        self._shift_realm_counters(s, skill.realm_id, total=total_delta,
+                                   completed=completed_delta, progress=after - before)
+
+    def reconcile_realm_counters(self, fix: bool = False) -> list[dict]:
+        """用子任务实际行核对技能/境界的冗余计数，返回不一致项；fix=True 时按实际值修正"""
+        from services.constants import skill_fraction
+        mismatches = []
+        with self.session_scope() as s:
+            sub_counts = {
+                skill_id: (total, done or 0)
+                for skill_id, total, done in s.query(
+                    SubTask.skill_id, func.count(SubTask.id),
+                    func.sum(case((SubTask.is_completed == True, 1), else_=0)),
+                ).group_by(SubTask.skill_id).all()
+            }
+            realm_actual: dict[int, list] = {}
+            for skill in s.query(Skill).all():
+                total, done = sub_counts.get(skill.id, (0, 0))
+                acc = realm_actual.setdefault(skill.realm_id, [0, 0, 0, 0.0])
+                acc[0] += 1
+                acc[1] += total
+                acc[2] += done
+                acc[3] += skill_fraction(total, done, skill.is_completed)
+                for field, actual in (("total_sub_tasks", total), ("completed_sub_tasks", done)):
+                    if (getattr(skill, field) or 0) != actual:
+                        mismatches.append({"table": "skills", "id": skill.id, "field": field,
+                                           "stored": getattr(skill, field), "actual": actual})
+                        if fix:
+                            setattr(skill, field, actual)
+
+            for realm in s.query(Realm).all():
+                actual = realm_actual.get(realm.id, [0, 0, 0, 0.0])
+                for field, value in zip(("total_skills", "total_sub_tasks", "completed_sub_tasks", "progress_sum"),
+                                        actual):
+                    stored = getattr(realm, field) or 0
+                    if abs(stored - value) > 1e-9:
+                        mismatches.append({"table": "realms", "id": realm.id, "field": field,
+                                           "stored": stored, "actual": value})
+                    if fix:
+                        setattr(realm, field, value)
+        return mismatches
+
     # ============ 灵石系统 ============
 
     def add_transaction(self, type: str, amount: float, category: str,
                         description: str = None, transaction_date: date = None) -> dict:
         """添加收支记录"""
+        from services.constants import epoch_day
         with self.session_scope() as s:
             txn = Transaction(
                 type=type,
@@ -445,21 +1096,144 @@ class DatabaseManager:
                 description=description,
                 transaction_date=transaction_date or date.today(),
             )
+            txn.day = epoch_day(txn.transaction_date)
             s.add(txn)
             s.flush()
-            return {
-                "id": txn.id, "type": txn.type, "amount": txn.amount,
-                "category": txn.category, "description": txn.description,
-                "transaction_date": str(txn.transaction_date),
-            }
+            self._apply_txn(s, txn, 1)
+            return self._txn_to_dict(txn)
+
+    def update_transaction(self, txn_id: int, **fields) -> Optional[dict]:
+        """修改收支记录（金额、分类、类型、日期、备注），同步月度汇总"""
+        allowed = {"type", "amount", "category", "description", "transaction_date"}
+        unknown = set(fields) - allowed
+        if unknown:
+            raise ValueError(f"不支持修改的字段: {', '.join(sorted(unknown))}")
+        from services.constants import epoch_day
+        with self.session_scope() as s:
+            txn = s.query(Transaction).filter(Transaction.id == txn_id).first()
+            if not txn:
+                return None
+            self._apply_txn(s, txn, -1)
+            for key, value in fields.items():
+                setattr(txn, key, value)
+            txn.day = epoch_day(txn.transaction_date)
+            s.flush()
+            self._apply_txn(s, txn, 1)
+            return self._txn_to_dict(txn)
+
+    def delete_transaction(self, txn_id: int) -> bool:
+        """删除收支记录，同步月度汇总"""
+        with self.session_scope() as s:
+            txn = s.query(Transaction).filter(Transaction.id == txn_id).first()
+            if not txn:
+                return False
+            self._apply_txn(s, txn, -1)
+            s.delete(txn)
+            return True
+
+    def _apply_txn(self, s: Session, txn: Transaction, sign: int) -> None:
+        """一笔收支计入（sign=1）或移出（sign=-1）月度汇总和余额累计，与调用方同一事务"""
+        self._bump_rollup(s, txn, sign)
+        self._bump_ledger(s, txn, sign)
+
+    @staticmethod
+    def _bump_rollup(s: Session, txn: Transaction, sign: int) -> None:
+        """把一笔收支计入（sign=1）或移出（sign=-1）所在月份的汇总行"""
+        if not txn.transaction_date:
+            return
+        month = txn.transaction_date.strftime("%Y-%m")
+        stmt = sqlite_insert(TransactionRollup).values(
+            month=month, type=txn.type, category=txn.category,
+            total=sign * txn.amount, count=sign,
+        )
+        s.execute(stmt.on_conflict_do_update(
+            index_elements=["month", "type", "category"],
+            set_={"total": TransactionRollup.total + stmt.excluded.total,
+                  "count": TransactionRollup.count + stmt.excluded.count},
+        ))
+        if sign < 0:
+            s.query(TransactionRollup).filter(
+                TransactionRollup.month == month, TransactionRollup.type == txn.type,
+                TransactionRollup.category == txn.category, TransactionRollup.count <= 0,
+            ).delete(synchronize_session=False)
+
+    def get_month_rollups(self, month: str, type: str = None, category: str = None) -> list[dict]:
+        """读取某月的收支汇总 [{type, category, total, count}]"""
+        with self.session_scope() as s:
+            q = s.query(TransactionRollup).filter(TransactionRollup.month == month)
+            if type:
+                q = q.filter(TransactionRollup.type == type)
+            if category:
+                q = q.filter(TransactionRollup.category == category)
+            return [{"type": r.type, "category": r.category, "total": float(r.total), "count": r.count}
+                    for r in q.all()]
+
+    @staticmethod
+    def _bump_ledger(s: Session, txn: Transaction, sign: int) -> None:
+        income = sign * txn.amount if txn.type == "income" else 0
+        expense = sign * txn.amount if txn.type == "expense" else 0
+        stmt = sqlite_insert(BalanceLedger).values(
+            id=1, income_total=income, expense_total=expense,
+            txn_count=sign, change_seq=1, updated_at=datetime.now(),
+        )
+        row = s.execute(stmt.on_conflict_do_update(
+            index_elements=["id"],
+            set_={"income_total": BalanceLedger.income_total + stmt.excluded.income_total,
+                  "expense_total": BalanceLedger.expense_total + stmt.excluded.expense_total,
+                  "txn_count": BalanceLedger.txn_count + stmt.excluded.txn_count,
+                  "change_seq": BalanceLedger.change_seq + 1,
+                  "updated_at": stmt.excluded.updated_at},
+        ).returning(BalanceLedger.change_seq, BalanceLedger.income_total,
+                    BalanceLedger.expense_total, BalanceLedger.txn_count)).first()
+        if row.change_seq % BALANCE_CHECKPOINT_EVERY == 0:
+            s.add(BalanceCheckpoint(change_seq=row.change_seq, income_total=row.income_total,
+                                    expense_total=row.expense_total, txn_count=row.txn_count))
 
     def get_balance(self) -> dict:
-        """获取灵石余额"""
+        """获取灵石余额（读累计表，单行）"""
         with self.session_scope() as s:
-            income = s.query(func.sum(Transaction.amount)).filter(Transaction.type == "income").scalar() or 0
-            expense = s.query(func.sum(Transaction.amount)).filter(Transaction.type == "expense").scalar() or 0
+            ledger = s.query(BalanceLedger).filter(BalanceLedger.id == 1).first()
+            income = ledger.income_total if ledger else 0
+            expense = ledger.expense_total if ledger else 0
             return {"income": float(income), "expense": float(expense), "balance": float(income - expense)}
 
+    def verify_balance(self, fix: bool = False) -> dict:
+        """全表重算收入/支出合计并与累计表核对
+
+        一致时写入一个 verified 检查点；不一致且 fix=True 时用重算值覆盖累计表。
+        返回 {"ok", "ledger", "actual", "last_verified_at"}。
+        """
+        with self.session_scope() as s:
+            income, expense, count = s.query(
+                func.coalesce(func.sum(case((Transaction.type == "income", Transaction.amount))), 0),
+                func.coalesce(func.sum(case((Transaction.type == "expense", Transaction.amount))), 0),
+                func.count(Transaction.id),
+            ).one()
+            actual = {"income": float(income), "expense": float(expense), "count": count}
+            ledger = s.query(BalanceLedger).filter(BalanceLedger.id == 1).first()
+            stored = {"income": float(ledger.income_total), "expense": float(ledger.expense_total),
+                      "count": ledger.txn_count} if ledger else {"income": 0.0, "expense": 0.0, "count": 0}
+            ok = (stored["count"] == actual["count"]
+                  and abs(stored["income"] - actual["income"]) < BALANCE_TOLERANCE
+                  and abs(stored["expense"] - actual["expense"]) < BALANCE_TOLERANCE)
+
+            if not ok and fix:
+                if not ledger:
+                    ledger = BalanceLedger(id=1, change_seq=0)
+                    s.add(ledger)
+                ledger.income_total = actual["income"]
+                ledger.expense_total = actual["expense"]
+                ledger.txn_count = actual["count"]
+                ledger.updated_at = datetime.now()
+            if ok or fix:
+                s.add(BalanceCheckpoint(change_seq=ledger.change_seq if ledger else 0,
+                                        income_total=actual["income"], expense_total=actual["expense"],
+                                        txn_count=actual["count"], verified=True))
+                s.flush()
+            last = s.query(func.max(BalanceCheckpoint.created_at)).filter(
+                BalanceCheckpoint.verified == True).scalar()
+            return {"ok": ok, "ledger": stored, "actual": actual, "last_verified_at": last}
+
     def get_transactions(self, start_date: date = None, end_date: date = None,
                          type: str = None, category: str = None,
                          limit: int = 50) -> list[dict]:
@@ -475,11 +1249,37 @@ class DatabaseManager:
             if category:
                 q = q.filter(Transaction.category == category)
             txns = q.order_by(Transaction.transaction_date.desc()).limit(limit).all()
-            return [{
-                "id": t.id, "type": t.type, "amount": float(t.amount),
-                "category": t.category, "description": t.description,
-                "transaction_date": str(t.transaction_date),
-            } for t in txns]
+            return [self._txn_to_dict(t) for t in txns]
+
+    def get_transaction_page(self, cursor: tuple = None, page_size: int = 50,
+                             start_date: date = None, end_date: date = None,
+                             type: str = None, category: str = None) -> dict:
+        """按 (transaction_date, id) 倒序的游标分页
+
+        cursor 传上一页返回的 next_cursor；不传则从最新一条开始。
+        用 (日期, id) < 游标 定位而不是 OFFSET，翻到多深都只读一页的行。
+        返回 {"items": [...], "next_cursor": (日期, id) 或 None}。
+        """
+        with self.session_scope() as s:
+            q = s.query(Transaction).filter(Transaction.transaction_date.isnot(None))
+            if start_date:
+                q = q.filter(Transaction.transaction_date >= start_date)
+            if end_date:
+                q = q.filter(Transaction.transaction_date <= end_date)
+            if type:
+                q = q.filter(Transaction.type == type)
+            if category:
+                q = q.filter(Transaction.category == category)
+            if cursor:
+                cursor_date, cursor_id = cursor
+                q = q.filter(tuple_(Transaction.transaction_date, Transaction.id) < (cursor_date, cursor_id))
+            rows = q.order_by(Transaction.transaction_date.desc(), Transaction.id.desc()).limit(page_size + 1).all()
+            has_more = len(rows) > page_size
+            rows = rows[:page_size]
+            return {
+                "items": [self._txn_to_dict(t) for t in rows],
+                "next_cursor": (rows[-1].transaction_date, rows[-1].id) if has_more else None,
+            }
 
     # ============ 负债 ============
 
@@ -552,9 +1352,10 @@ class DatabaseManager:
 
     def add_event(self, person_id: int, event_date: date, event_description: str, **kwargs) -> dict:
         """添加人际事件"""
+        from services.constants import epoch_day
         with self.session_scope() as s:
             event = RelationshipEvent(
-                person_id=person_id, event_date=event_date,
+                person_id=person_id, event_date=event_date, day=epoch_day(event_date),
                 event_description=event_description, **kwargs
             )
             s.add(event)
@@ -569,6 +1370,16 @@ class DatabaseManager:
             ).order_by(RelationshipEvent.event_date.desc()).limit(limit).all()
             return [self._event_to_dict(e) for e in events]
 
+    def get_event_activity(self, since_day: int) -> dict:
+        """since_day（epoch 天数）以来的互动次数和涉及的人数，只统计在册人物"""
+        with self.session_scope() as s:
+            events, people = s.query(
+                func.count(RelationshipEvent.id), func.count(func.distinct(RelationshipEvent.person_id))
+            ).join(Person, Person.id == RelationshipEvent.person_id).filter(
+                RelationshipEvent.day >= since_day, Person.is_active == True
+            ).one()
+            return {"events": events, "people": people}
+
     # ============ AI 配置 ============
 
     def get_active_ai_config(self) -> Optional[dict]:
@@ -629,8 +1440,40 @@ class DatabaseManager:
                     setattr(score, key, val)
             score.updated_at = datetime.now()
             s.flush()
+            self._refresh_candles(s, score_date, score_date)
             return self._daily_score_to_dict(score)
 
+    def get_daily_score_dates(self, start_date: date, end_date: date) -> set[date]:
+        """日期范围内已有评分的日期"""
+        with self.session_scope() as s:
+            rows = s.query(DailyScore.score_date).filter(
+                DailyScore.score_date >= start_date,
+                DailyScore.score_date <= end_date,
+            ).all()
+            return {r[0] for r in rows}
+
+    def upsert_daily_scores(self, rows: list[dict], chunk_size: int = 500) -> int:
+        """批量写入每日评分（按 score_date 冲突则覆盖 OHLC 和变动次数，保留备注），返回写入行数
+
+        rows: [{"score_date", "open_spirit", "close_spirit", "high_spirit", "low_spirit", "change_count"}]
+        """
+        if not rows:
+            return 0
+        now = datetime.now()
+        stmt = sqlite_insert(DailyScore)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DailyScore.score_date],
+            set_={col: stmt.excluded[col] for col in (
+                "open_spirit", "close_spirit", "high_spirit", "low_spirit", "change_count", "updated_at")},
+        )
+        with self.session_scope() as s:
+            # 同一条语句 executemany，分块避免一次性构造过多参数
+            for i in range(0, len(rows), chunk_size):
+                s.execute(stmt, [dict(r, created_at=now, updated_at=now) for r in rows[i:i + chunk_size]])
+            dates = [r["score_date"] for r in rows]
+            self._refresh_candles(s, min(dates), max(dates))
+        return len(rows)
+
     def delete_daily_score(self, score_id: int) -> bool:
         """删除每日评分"""
         with self.session_scope() as s:
@@ -638,8 +1481,73 @@ class DatabaseManager:
             if not score:
                 return False
             s.delete(score)
+            s.flush()
+            self._refresh_candles(s, score.score_date, score.score_date)
             return True
 
+    def score_generation(self) -> int:
+        """每日评分的版本号：任何一次写评分的提交都会让它变化"""
+        return self._entry.score_changes.generation
+
+    def scores_changed_since(self, generation: int) -> Optional[int]:
+        """generation 之后的提交改动过的最早一天（epoch 天数）；无法确定时返回 None"""
+        return self._entry.score_changes.changed_since(generation)
+
+    def _refresh_candles(self, s: Session, start_date: date, end_date: date) -> None:
+        """日线 [start_date, end_date] 有改动：重算覆盖它的各级K线（先删后插，没有日线的周期随之消失），
+        并记入评分变更日志"""
+        from services.constants import epoch_day, period_end, period_start
+        day = epoch_day(start_date)
+        s.info[_SCORES_DIRTY] = min(s.info.get(_SCORES_DIRTY, day), day)
+        for span, source in _CANDLE_SOURCES:
+            lo, hi = period_start(start_date, span), period_end(end_date, span)
+            if source is None:
+                rows = s.query(
+                    DailyScore.score_date, DailyScore.open_spirit, DailyScore.close_spirit,
+                    DailyScore.high_spirit, DailyScore.low_spirit, DailyScore.change_count, literal(1),
+                ).filter(DailyScore.score_date.between(lo, hi)).order_by(DailyScore.score_date)
+            else:
+                rows = s.query(
+                    ScoreCandle.period_start, ScoreCandle.open_spirit, ScoreCandle.close_spirit,
+                    ScoreCandle.high_spirit, ScoreCandle.low_spirit, ScoreCandle.change_count, ScoreCandle.day_count,
+                ).filter(ScoreCandle.span == source, ScoreCandle.period_start.between(lo, hi)
+                         ).order_by(ScoreCandle.period_start)
+            candles = {}
+            for day, open_, close, high, low, changes, days in rows:
+                key = period_start(day, span)
+                c = candles.get(key)
+                if c is None:
+                    candles[key] = {"span": span, "period_start": key, "open_spirit": open_, "close_spirit": close,
+                                    "high_spirit": high, "low_spirit": low,
+                                    "change_count": changes or 0, "day_count": days}
+                else:
+                    c["close_spirit"] = close
+                    c["high_spirit"] = max(c["high_spirit"], high)
+                    c["low_spirit"] = min(c["low_spirit"], low)
+                    c["change_count"] += changes or 0
+                    c["day_count"] += days
+            s.query(ScoreCandle).filter(
+                ScoreCandle.span == span, ScoreCandle.period_start.between(lo, hi)
+            ).delete(synchronize_session=False)
+            if candles:
+                s.execute(sqlite_insert(ScoreCandle), list(candles.values()))
+
+    def get_score_candles(self, span: str, start_date: date, end_date: date) -> list[dict]:
+        """覆盖日期范围的周/月/季/年K线，按周期先后排列"""
+        from services.constants import period_start
+        with self.session_scope() as s:
+            candles = s.query(ScoreCandle).filter(
+                ScoreCandle.span == span,
+                ScoreCandle.period_start >= period_start(start_date, span),
+                ScoreCandle.period_start <= end_date,
+            ).order_by(ScoreCandle.period_start).all()
+            return [{
+                "span": c.span, "period_start": c.period_start,
+                "open_spirit": c.open_spirit, "close_spirit": c.close_spirit,
+                "high_spirit": c.high_spirit, "low_spirit": c.low_spirit,
+                "change_count": c.change_count, "day_count": c.day_count,
+            } for c in candles]
+
     @staticmethod
     def _daily_score_to_dict(score: DailyScore) -> dict:
         return {
@@ -673,11 +1581,12 @@ class DatabaseManager:
             "id": record.id, "task_id": record.task_id, "task_name": record.task_name,
             "spirit_change": record.spirit_change, "blood_change": record.blood_change,
             "is_undo": record.is_undo, "is_makeup": record.is_makeup,
-            "completed_at": record.completed_at, "notes": record.notes,
+            "completed_at": record.completed_at, "day": record.day, "notes": record.notes,
         }
 
     @staticmethod
-    def _realm_to_dict(realm: Realm, include_skills: bool = False, session: Session = None) -> dict:
+    def _realm_to_dict(realm: Realm, include_skills: bool = False) -> dict:
+        from services.constants import realm_progress
         d = {
             "id": realm.id, "name": realm.name, "description": realm.description,
             "realm_type": realm.realm_type, "completion_rate": realm.completion_rate,
@@ -685,27 +1594,39 @@ class DatabaseManager:
             "order_index": realm.order_index,
             "started_at": realm.started_at, "completed_at": realm.completed_at,
         }
-        if include_skills and session:
-            skills = session.query(Skill).filter(Skill.realm_id == realm.id).order_by(Skill.order_index).all()
+        # 进度直接取冗余计数，不扫描子任务
+        d.update(realm_progress(realm.total_skills or 0, realm.total_sub_tasks or 0,
+                                realm.completed_sub_tasks or 0, realm.progress_sum or 0))
+        if include_skills:
             d["skills"] = []
-            for sk in skills:
+            for sk in sorted(realm.skills, key=lambda k: (k.order_index or 0, k.id)):
                 sk_dict = DatabaseManager._skill_to_dict(sk)
-                subs = session.query(SubTask).filter(SubTask.skill_id == sk.id).order_by(SubTask.order_index).all()
+                subs = sorted(sk.sub_tasks, key=lambda t: (t.order_index or 0, t.id))
                 sk_dict["sub_tasks"] = [
                     {"id": st.id, "name": st.name, "is_completed": st.is_completed, "order_index": st.order_index}
                     for st in subs
                 ]
-                completed = sum(1 for st in subs if st.is_completed)
-                sk_dict["progress"] = completed / len(subs) if subs else 0
                 d["skills"].append(sk_dict)
         return d
 
     @staticmethod
     def _skill_to_dict(skill: Skill) -> dict:
+        total = skill.total_sub_tasks or 0
+        completed = skill.completed_sub_tasks or 0
         return {
             "id": skill.id, "realm_id": skill.realm_id, "name": skill.name,
             "description": skill.description, "order_index": skill.order_index,
             "is_completed": skill.is_completed,
+            "total_sub_tasks": total, "completed_sub_tasks": completed,
+            "progress": completed / total if total else 0,
+        }
+
+    @staticmethod
+    def _txn_to_dict(txn: Transaction) -> dict:
+        return {
+            "id": txn.id, "type": txn.type, "amount": float(txn.amount),
+            "category": txn.category, "description": txn.description,
+            "transaction_date": str(txn.transaction_date),
         }
 
     @staticmethod
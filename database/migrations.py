@@ -0,0 +1,535 @@
+"""
+数据库版本迁移 — 以 PRAGMA user_version 记录 schema 版本
+每个迁移只在版本号低于它时执行一次；schema 已是最新时启动只需读一次 user_version。
+
+约定：
+- 迁移里的 DDL 一律写死（不引用 models.py），模型以后改动不会影响历史迁移
+- 新增版本只能追加到 MIGRATIONS 末尾，已发布的迁移不能修改
+- models.py 的改动必须配套一个迁移，tests/test_migrations.py 会比对两者得到的 schema
+"""
+
+# ============ v1: 基线 schema ============
+# 引入版本号之前的最终表结构。旧库（user_version=0）里已存在的表不受影响，缺的表补建。
+
+_BASELINE_DDL = [
+    """CREATE TABLE IF NOT EXISTS user_config (
+        id INTEGER NOT NULL,
+        birth_year INTEGER NOT NULL,
+        initial_blood INTEGER NOT NULL,
+        current_blood INTEGER NOT NULL,
+        current_spirit INTEGER NOT NULL,
+        target_money INTEGER NOT NULL,
+        tongyu_password VARCHAR(256),
+        dark_mode BOOLEAN,
+        created_at DATETIME,
+        updated_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        task_type VARCHAR(20) NOT NULL,
+        spirit_effect INTEGER NOT NULL,
+        blood_effect INTEGER NOT NULL,
+        emoji VARCHAR(10),
+        submission_type VARCHAR(20),
+        enable_streak BOOLEAN,
+        sort_order INTEGER,
+        is_active BOOLEAN,
+        created_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_task_active ON tasks (is_active)",
+    "CREATE INDEX IF NOT EXISTS idx_task_type ON tasks (task_type)",
+    """CREATE TABLE IF NOT EXISTS task_records (
+        id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        task_name VARCHAR(100) NOT NULL,
+        spirit_change INTEGER NOT NULL,
+        blood_change INTEGER NOT NULL,
+        is_undo BOOLEAN,
+        is_makeup BOOLEAN,
+        completed_at DATETIME,
+        notes TEXT,
+        PRIMARY KEY (id),
+        FOREIGN KEY(task_id) REFERENCES tasks (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_record_date ON task_records (completed_at)",
+    "CREATE INDEX IF NOT EXISTS idx_record_task ON task_records (task_id)",
+    """CREATE TABLE IF NOT EXISTS streak_records (
+        id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        current_streak INTEGER,
+        max_streak INTEGER,
+        last_completed_date DATE,
+        updated_at DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(task_id) REFERENCES tasks (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS realms (
+        id INTEGER NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        description TEXT,
+        realm_type VARCHAR(20),
+        completion_rate INTEGER,
+        reward_spirit INTEGER,
+        reward_description TEXT,
+        status VARCHAR(20),
+        order_index INTEGER,
+        started_at DATETIME,
+        completed_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_realm_status ON realms (status)",
+    "CREATE INDEX IF NOT EXISTS idx_realm_type ON realms (realm_type)",
+    """CREATE TABLE IF NOT EXISTS skills (
+        id INTEGER NOT NULL,
+        realm_id INTEGER NOT NULL,
+        name VARCHAR(200) NOT NULL,
+        description TEXT,
+        order_index INTEGER,
+        is_completed BOOLEAN,
+        completed_at DATETIME,
+        created_at DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(realm_id) REFERENCES realms (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS sub_tasks (
+        id INTEGER NOT NULL,
+        skill_id INTEGER NOT NULL,
+        name VARCHAR(200) NOT NULL,
+        order_index INTEGER,
+        is_completed BOOLEAN,
+        completed_at DATETIME,
+        created_at DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(skill_id) REFERENCES skills (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER NOT NULL,
+        type VARCHAR(20) NOT NULL,
+        amount FLOAT NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        description TEXT,
+        transaction_date DATE,
+        created_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_transaction_category ON transactions (category)",
+    "CREATE INDEX IF NOT EXISTS idx_transaction_date ON transactions (transaction_date)",
+    "CREATE INDEX IF NOT EXISTS idx_transaction_type ON transactions (type)",
+    """CREATE TABLE IF NOT EXISTS recurring_transactions (
+        id INTEGER NOT NULL,
+        type VARCHAR(20) NOT NULL,
+        amount FLOAT NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        description TEXT,
+        frequency VARCHAR(20),
+        day_of_month INTEGER,
+        is_active BOOLEAN,
+        last_applied_date DATE,
+        created_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS debts (
+        id INTEGER NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        total_amount FLOAT NOT NULL,
+        remaining_amount FLOAT NOT NULL,
+        monthly_payment FLOAT NOT NULL,
+        interest_rate FLOAT,
+        start_date DATE,
+        end_date DATE,
+        is_active BOOLEAN,
+        created_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS debt_repayments (
+        id INTEGER NOT NULL,
+        debt_id INTEGER NOT NULL,
+        amount FLOAT NOT NULL,
+        repayment_date DATE,
+        notes TEXT,
+        PRIMARY KEY (id),
+        FOREIGN KEY(debt_id) REFERENCES debts (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS budgets (
+        id INTEGER NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        amount FLOAT NOT NULL,
+        month VARCHAR(7) NOT NULL,
+        created_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_budget_month ON budgets (month)",
+    """CREATE TABLE IF NOT EXISTS milestones (
+        id INTEGER NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        target_amount FLOAT NOT NULL,
+        is_reached BOOLEAN,
+        reached_at DATETIME,
+        created_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS people (
+        id INTEGER NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        relationship_type VARCHAR(50) NOT NULL,
+        met_date DATE,
+        birthday DATE,
+        personality TEXT,
+        contact_info TEXT,
+        preferences TEXT,
+        notes TEXT,
+        ai_report TEXT,
+        avatar_emoji VARCHAR(10),
+        is_active BOOLEAN,
+        created_at DATETIME,
+        updated_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS personality_tags (
+        id INTEGER NOT NULL,
+        person_id INTEGER NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        tag_name VARCHAR(100) NOT NULL,
+        tag_value INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(person_id) REFERENCES people (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS relationship_events (
+        id INTEGER NOT NULL,
+        person_id INTEGER NOT NULL,
+        event_date DATE NOT NULL,
+        location VARCHAR(200),
+        event_description TEXT NOT NULL,
+        impression_tags TEXT,
+        their_emotion TEXT,
+        topics TEXT,
+        key_info TEXT,
+        my_feeling TEXT,
+        next_action TEXT,
+        is_completed BOOLEAN,
+        created_at DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(person_id) REFERENCES people (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_event_date ON relationship_events (event_date)",
+    "CREATE INDEX IF NOT EXISTS idx_event_person ON relationship_events (person_id)",
+    """CREATE TABLE IF NOT EXISTS daily_tasks (
+        id INTEGER NOT NULL,
+        name VARCHAR(200) NOT NULL,
+        category VARCHAR(20),
+        priority VARCHAR(10),
+        deadline DATETIME,
+        notes TEXT,
+        is_completed BOOLEAN,
+        completed_at DATETIME,
+        created_date DATE,
+        created_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_daily_task_category ON daily_tasks (category)",
+    "CREATE INDEX IF NOT EXISTS idx_daily_task_date ON daily_tasks (created_date)",
+    """CREATE TABLE IF NOT EXISTS daily_scores (
+        id INTEGER NOT NULL,
+        score_date DATE NOT NULL,
+        open_spirit INTEGER NOT NULL,
+        close_spirit INTEGER NOT NULL,
+        high_spirit INTEGER NOT NULL,
+        low_spirit INTEGER NOT NULL,
+        change_count INTEGER,
+        notes TEXT,
+        created_at DATETIME,
+        updated_at DATETIME,
+        PRIMARY KEY (id),
+        UNIQUE (score_date)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_daily_score_date ON daily_scores (score_date)",
+    """CREATE TABLE IF NOT EXISTS ai_config (
+        id INTEGER NOT NULL,
+        provider VARCHAR(50) NOT NULL,
+        api_key TEXT,
+        api_base VARCHAR(500),
+        model VARCHAR(100),
+        proxy VARCHAR(500),
+        is_active BOOLEAN,
+        created_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+]
+
+
+def _columns(cursor, table: str) -> set[str]:
+    return {row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _v1_baseline(cursor):
+    for ddl in _BASELINE_DDL:
+        cursor.execute(ddl)
+    # 更早的库里这两张表存在但缺字段（原 DatabaseManager._migrate 的逻辑，只会在旧库升级时执行一次）
+    if "personality" not in _columns(cursor, "people"):
+        cursor.execute("ALTER TABLE people ADD COLUMN personality TEXT")
+    if "is_completed" not in _columns(cursor, "relationship_events"):
+        cursor.execute("ALTER TABLE relationship_events ADD COLUMN is_completed BOOLEAN DEFAULT 0")
+
+
+# ============ v2: 境界/技能进度冗余计数 ============
+
+def _v2_realm_progress_counters(cursor):
+    cursor.execute("ALTER TABLE skills ADD COLUMN total_sub_tasks INTEGER DEFAULT 0")
+    cursor.execute("ALTER TABLE skills ADD COLUMN completed_sub_tasks INTEGER DEFAULT 0")
+    cursor.execute("ALTER TABLE realms ADD COLUMN total_skills INTEGER DEFAULT 0")
+    cursor.execute("ALTER TABLE realms ADD COLUMN total_sub_tasks INTEGER DEFAULT 0")
+    cursor.execute("ALTER TABLE realms ADD COLUMN completed_sub_tasks INTEGER DEFAULT 0")
+    cursor.execute("ALTER TABLE realms ADD COLUMN progress_sum FLOAT DEFAULT 0")
+    # 回填
+    cursor.execute("""UPDATE skills SET
+        total_sub_tasks = (SELECT COUNT(*) FROM sub_tasks WHERE sub_tasks.skill_id = skills.id),
+        completed_sub_tasks = (SELECT COUNT(*) FROM sub_tasks
+                               WHERE sub_tasks.skill_id = skills.id AND sub_tasks.is_completed = 1)""")
+    cursor.execute("""UPDATE realms SET
+        total_skills = (SELECT COUNT(*) FROM skills WHERE skills.realm_id = realms.id),
+        total_sub_tasks = (SELECT COALESCE(SUM(total_sub_tasks), 0) FROM skills WHERE skills.realm_id = realms.id),
+        completed_sub_tasks = (SELECT COALESCE(SUM(completed_sub_tasks), 0) FROM skills WHERE skills.realm_id = realms.id),
+        progress_sum = (SELECT COALESCE(SUM(CASE
+                            WHEN total_sub_tasks > 0 THEN CAST(completed_sub_tasks AS REAL) / total_sub_tasks
+                            WHEN is_completed = 1 THEN 1.0 ELSE 0 END), 0)
+                        FROM skills WHERE skills.realm_id = realms.id)""")
+
+
+# ============ v3: 收支月度汇总表 ============
+
+def _v3_transaction_rollups(cursor):
+    cursor.execute("""CREATE TABLE transaction_rollups (
+        id INTEGER NOT NULL,
+        month VARCHAR(7) NOT NULL,
+        type VARCHAR(20) NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        total FLOAT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (id)
+    )""")
+    cursor.execute("CREATE UNIQUE INDEX uq_rollup_month_type_category "
+                   "ON transaction_rollups (month, type, category)")
+    cursor.execute("""INSERT INTO transaction_rollups (month, type, category, total, count)
+        SELECT strftime('%Y-%m', transaction_date), type, category, SUM(amount), COUNT(*)
+        FROM transactions WHERE transaction_date IS NOT NULL
+        GROUP BY strftime('%Y-%m', transaction_date), type, category""")
+
+
+# ============ v4: 余额累计表与检查点 ============
+
+def _v4_balance_ledger(cursor):
+    cursor.execute("""CREATE TABLE balance_ledger (
+        id INTEGER NOT NULL,
+        income_total FLOAT NOT NULL,
+        expense_total FLOAT NOT NULL,
+        txn_count INTEGER NOT NULL,
+        change_seq INTEGER NOT NULL,
+        updated_at DATETIME,
+        PRIMARY KEY (id)
+    )""")
+    cursor.execute("""CREATE TABLE balance_checkpoints (
+        id INTEGER NOT NULL,
+        change_seq INTEGER NOT NULL,
+        income_total FLOAT NOT NULL,
+        expense_total FLOAT NOT NULL,
+        txn_count INTEGER NOT NULL,
+        verified BOOLEAN,
+        created_at DATETIME,
+        PRIMARY KEY (id)
+    )""")
+    cursor.execute("""INSERT INTO balance_ledger (id, income_total, expense_total, txn_count, change_seq, updated_at)
+        SELECT 1,
+               COALESCE(SUM(CASE WHEN type = 'income' THEN amount END), 0),
+               COALESCE(SUM(CASE WHEN type = 'expense' THEN amount END), 0),
+               COUNT(*), 0, datetime('now', 'localtime')
+        FROM transactions""")
+
+
+def _v5_task_record_composite_indexes(cursor):
+    # 单列索引换成贴合热点查询的复合索引；idx_record_task_live 的前缀仍可供 task_id 外键查找
+    cursor.execute("DROP INDEX IF EXISTS idx_record_task")
+    cursor.execute("DROP INDEX IF EXISTS idx_record_date")
+    cursor.execute("CREATE INDEX idx_record_task_live ON task_records (task_id, is_undo, completed_at)")
+    cursor.execute("CREATE INDEX idx_record_live_date ON task_records (is_undo, completed_at, task_id)")
+
+
+# SQLite 里 date 字符串 → epoch 天数（与 services.constants.epoch_day 一致）
+_SQL_EPOCH_DAY = "CAST(julianday(date({})) - 2440587.5 AS INTEGER)"
+
+
+def _v6_epoch_day_columns(cursor):
+    cursor.execute("ALTER TABLE user_config ADD COLUMN day_start_hour INTEGER NOT NULL DEFAULT 0")
+    for table, source in (("task_records", "completed_at"),
+                          ("transactions", "transaction_date"),
+                          ("relationship_events", "event_date")):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN day INTEGER")
+        # 已有库的 day_start_hour 都是 0，直接取日期部分
+        cursor.execute(f"UPDATE {table} SET day = {_SQL_EPOCH_DAY.format(source)} WHERE {source} IS NOT NULL")
+    cursor.execute("CREATE INDEX idx_record_live_day ON task_records (is_undo, day, spirit_change)")
+    cursor.execute("CREATE INDEX idx_transaction_day ON transactions (day)")
+    cursor.execute("CREATE INDEX idx_event_day ON relationship_events (day, person_id)")
+
+
+def _v7_daily_series_index(cursor):
+    # 按日汇总也要取 blood_change，索引带上它才能只读索引
+    cursor.execute("DROP INDEX idx_record_live_day")
+    cursor.execute("CREATE INDEX idx_record_live_day ON task_records (is_undo, day, spirit_change, blood_change)")
+
+
+def _v8_vital_snapshots(cursor):
+    cursor.execute("""CREATE TABLE vital_snapshots (
+        id INTEGER NOT NULL,
+        taken_at DATETIME NOT NULL,
+        record_id INTEGER NOT NULL,
+        spirit INTEGER NOT NULL,
+        blood INTEGER NOT NULL,
+        PRIMARY KEY (id)
+    )""")
+    cursor.execute("CREATE INDEX idx_vital_snapshot_time ON vital_snapshots (taken_at, record_id)")
+    # 以当前值作为第一个快照；更早的时刻从初始状态回放
+    cursor.execute("""INSERT INTO vital_snapshots (taken_at, record_id, spirit, blood)
+        SELECT strftime('%Y-%m-%d %H:%M:%f000', 'now', 'localtime'),
+               (SELECT COALESCE(MAX(id), 0) FROM task_records),
+               current_spirit, current_blood
+        FROM user_config ORDER BY id LIMIT 1""")
+
+
+# 日期 → 所在周期第一天（与 services.constants.period_start 一致）
+_SQL_PERIOD_START = {
+    "week": "date(score_date, '-6 days', 'weekday 1')",
+    "month": "strftime('%Y-%m-01', score_date)",
+    "quarter": "printf('%s-%02d-01', strftime('%Y', score_date), "
+               "(CAST(strftime('%m', score_date) AS INTEGER) - 1) / 3 * 3 + 1)",
+    "year": "strftime('%Y-01-01', score_date)",
+}
+
+
+def _v9_score_candles(cursor):
+    cursor.execute("""CREATE TABLE score_candles (
+        id INTEGER NOT NULL,
+        span VARCHAR(10) NOT NULL,
+        period_start DATE NOT NULL,
+        open_spirit INTEGER NOT NULL,
+        close_spirit INTEGER NOT NULL,
+        high_spirit INTEGER NOT NULL,
+        low_spirit INTEGER NOT NULL,
+        change_count INTEGER NOT NULL,
+        day_count INTEGER NOT NULL,
+        PRIMARY KEY (id)
+    )""")
+    cursor.execute("CREATE UNIQUE INDEX uq_candle_span_start ON score_candles (span, period_start)")
+    # 每个周期取第一天的开盘、最后一天的收盘
+    for span, period in _SQL_PERIOD_START.items():
+        cursor.execute(f"""INSERT INTO score_candles (span, period_start, open_spirit, close_spirit,
+                high_spirit, low_spirit, change_count, day_count)
+            SELECT '{span}', period,
+                   MAX(CASE WHEN first_rank = 1 THEN open_spirit END),
+                   MAX(CASE WHEN last_rank = 1 THEN close_spirit END),
+                   MAX(high_spirit), MIN(low_spirit), SUM(COALESCE(change_count, 0)), COUNT(*)
+            FROM (SELECT *,
+                         ROW_NUMBER() OVER (PARTITION BY period ORDER BY score_date) AS first_rank,
+                         ROW_NUMBER() OVER (PARTITION BY period ORDER BY score_date DESC) AS last_rank
+                  FROM (SELECT *, {period} AS period FROM daily_scores))
+            GROUP BY period""")
+
+
+def _v10_task_bitmaps(cursor):
+    cursor.execute("""CREATE TABLE task_bitmaps (
+        task_id INTEGER NOT NULL,
+        origin INTEGER NOT NULL,
+        bits BLOB NOT NULL,
+        PRIMARY KEY (task_id),
+        FOREIGN KEY(task_id) REFERENCES tasks (id)
+    )""")
+    # 起点取每个任务最早完成的一天，位串按小端字节存
+    bitmaps = {}
+    for task_id, day in cursor.execute(
+            "SELECT DISTINCT task_id, day FROM task_records WHERE is_undo = 0 AND day IS NOT NULL").fetchall():
+        bitmaps.setdefault(task_id, []).append(day)
+    rows = []
+    for task_id, days in bitmaps.items():
+        origin = min(days)
+        bits = 0
+        for day in days:
+            bits |= 1 << (day - origin)
+        rows.append((task_id, origin, bits.to_bytes((bits.bit_length() + 7) // 8, "little")))
+    cursor.executemany("INSERT INTO task_bitmaps (task_id, origin, bits) VALUES (?, ?, ?)", rows)
+
+
+def _v11_record_day_indexes(cursor):
+    # 今日次数 / 今日记录改按逻辑日查询：按任务查走 (task_id, is_undo, day)，
+    # 按日分组计数要取 task_id，按日汇总索引带上它
+    cursor.execute("DROP INDEX idx_record_task_live")
+    cursor.execute("CREATE INDEX idx_record_task_day ON task_records (task_id, is_undo, day)")
+    cursor.execute("DROP INDEX idx_record_live_day")
+    cursor.execute(
+        "CREATE INDEX idx_record_live_day ON task_records (is_undo, day, task_id, spirit_change, blood_change)")
+
+
+# (版本号, 说明, 迁移函数)；迁移函数接收 sqlite3 cursor，在同一个事务里执行
+MIGRATIONS = [
+    (1, "基线 schema", _v1_baseline),
+    (2, "境界/技能进度冗余计数", _v2_realm_progress_counters),
+    (3, "收支月度汇总表", _v3_transaction_rollups),
+    (4, "余额累计表与检查点", _v4_balance_ledger),
+    (5, "任务记录复合索引", _v5_task_record_composite_indexes),
+    (6, "任务记录/收支/人际事件的 epoch 天数列", _v6_epoch_day_columns),
+    (7, "按日汇总索引覆盖血量变化", _v7_daily_series_index),
+    (8, "心境/血量快照", _v8_vital_snapshots),
+    (9, "周/月/季/年K线", _v9_score_candles),
+    (10, "任务完成位图", _v10_task_bitmaps),
+    (11, "任务记录按逻辑日的索引", _v11_record_day_indexes),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(engine) -> int:
+    """读取 PRAGMA user_version"""
+    raw = engine.raw_connection()
+    try:
+        return raw.driver_connection.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        raw.close()
+
+
+def migrate(engine, target: int = LATEST_VERSION) -> int:
+    """把数据库升级到 target 版本，返回升级后的版本号
+
+    所有待执行的迁移和 user_version 的更新在同一个 BEGIN IMMEDIATE 事务里完成，
+    任何一步失败整体回滚；多个进程同时启动时只有一个会真正执行迁移。
+    """
+    raw = engine.raw_connection()
+    try:
+        conn = raw.driver_connection
+        cursor = conn.cursor()
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version > LATEST_VERSION:
+            raise RuntimeError(f"数据库版本 {version} 高于程序支持的版本 {LATEST_VERSION}，请升级应用")
+        if version >= target:
+            return version
+
+        old_isolation = conn.isolation_level
+        conn.isolation_level = None  # 手动控制事务，DDL 也纳入同一事务
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # 拿到写锁后重新读取，可能已被其他进程升级
+                version = cursor.execute("PRAGMA user_version").fetchone()[0]
+                for number, _desc, upgrade in MIGRATIONS:
+                    if version < number <= target:
+                        upgrade(cursor)
+                        version = number
+                cursor.execute(f"PRAGMA user_version = {version}")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        finally:
+            conn.isolation_level = old_isolation
+        return version
+    finally:
+        raw.close()
@@ -1,10 +1,11 @@
 """
 凡人修仙3w天 — 数据模型定义（唯一真相源）
 所有表结构在此定义，其他模块不得重复定义
+表结构变更必须同时在 database/migrations.py 追加一个版本迁移
 """
 from datetime import datetime, date
 from sqlalchemy import (
-    Column, Integer, String, Float, Boolean, Text, Date, DateTime,
+    Column, Integer, String, Float, Boolean, Text, Date, DateTime, LargeBinary,
     ForeignKey, Index, create_engine
 )
 from sqlalchemy.orm import declarative_base, relationship
@@ -26,6 +27,7 @@ class UserConfig(Base):
     target_money = Column(Integer, nullable=False, default=5_000_000)  # 目标灵石
     tongyu_password = Column(String(256), nullable=True)   # 统御系统密码（加密）
     dark_mode = Column(Boolean, default=False)
+    day_start_hour = Column(Integer, nullable=False, default=0)  # 一天从几点开始（统计分日用）
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
@@ -68,18 +70,24 @@ class TaskRecord(Base):
     is_undo = Column(Boolean, default=False)               # 是否已撤销
     is_makeup = Column(Boolean, default=False)              # 是否补记
     completed_at = Column(DateTime, default=datetime.now)
+    day = Column(Integer, nullable=True)                    # 逻辑日（epoch 天数，按 day_start_hour 折算）
     notes = Column(Text, nullable=True)
 
     task = relationship("Task", back_populates="records")
 
+    # 热点查询都带 is_undo = 0：
+    # 按任务查今日次数 / 某天是否还有记录走 (task_id, is_undo, day)，只读索引即可计数；
+    # 按时间区间查记录走 (is_undo, completed_at, task_id)
     __table_args__ = (
-        Index("idx_record_task", "task_id"),
-        Index("idx_record_date", "completed_at"),
+        Index("idx_record_task_day", "task_id", "is_undo", "day"),
+        Index("idx_record_live_date", "is_undo", "completed_at", "task_id"),
+        # 按日汇总心境 / 血量变化、按任务分组计数今日次数，只读索引
+        Index("idx_record_live_day", "is_undo", "day", "task_id", "spirit_change", "blood_change"),
     )
 
 
 class StreakRecord(Base):
-    """连续打卡记录"""
+    """连续打卡记录（旧版，已不再读写；连续打卡改由 services.streak_engine 从任务记录推导）"""
     __tablename__ = "streak_records"
 
     id = Column(Integer, primary_key=True)
@@ -90,6 +98,34 @@ class StreakRecord(Base):
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
+class VitalSnapshot(Base):
+    """心境/血量快照 — 任务记录是事件日志，快照记下某一时刻的真实值，回放从最近的快照开始
+
+    (taken_at, record_id) 之前（含）的记录已计入快照，之后的记录需要回放。
+    """
+    __tablename__ = "vital_snapshots"
+
+    id = Column(Integer, primary_key=True)
+    taken_at = Column(DateTime, nullable=False)
+    record_id = Column(Integer, nullable=False)             # 快照时已计入的最后一条任务记录
+    spirit = Column(Integer, nullable=False)
+    blood = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("idx_vital_snapshot_time", "taken_at", "record_id"),
+    )
+
+
+class TaskBitmap(Base):
+    """任务完成位图 — 第 i 位表示 origin + i 这个逻辑日有未撤销的记录（格式见 database/bitmaps.py），
+    随任务记录的增加、撤销同步维护"""
+    __tablename__ = "task_bitmaps"
+
+    task_id = Column(Integer, ForeignKey("tasks.id"), primary_key=True)
+    origin = Column(Integer, nullable=False)                # 第 0 位对应的逻辑日
+    bits = Column(LargeBinary, nullable=False)
+
+
 # ============ 境界系统 ============
 
 class Realm(Base):
@@ -107,6 +143,11 @@ class Realm(Base):
     order_index = Column(Integer, default=0)
     started_at = Column(DateTime, default=datetime.now)
     completed_at = Column(DateTime, nullable=True)
+    # 进度冗余计数，随技能/子任务的增删和完成在同一事务内维护
+    total_skills = Column(Integer, default=0)
+    total_sub_tasks = Column(Integer, default=0)
+    completed_sub_tasks = Column(Integer, default=0)
+    progress_sum = Column(Float, default=0)                # 各技能完成度（0~1）之和
 
     skills = relationship("Skill", back_populates="realm", cascade="all, delete-orphan")
 
@@ -128,6 +169,8 @@ class Skill(Base):
     is_completed = Column(Boolean, default=False)
     completed_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.now)
+    total_sub_tasks = Column(Integer, default=0)           # 子任务数（冗余计数）
+    completed_sub_tasks = Column(Integer, default=0)       # 已完成子任务数（冗余计数）
 
     realm = relationship("Realm", back_populates="skills")
     sub_tasks = relationship("SubTask", back_populates="skill", cascade="all, delete-orphan")
@@ -160,15 +203,58 @@ class Transaction(Base):
     category = Column(String(50), nullable=False)
     description = Column(Text, nullable=True)
     transaction_date = Column(Date, default=date.today)
+    day = Column(Integer, nullable=True)                    # transaction_date 的 epoch 天数
     created_at = Column(DateTime, default=datetime.now)
 
     __table_args__ = (
         Index("idx_transaction_type", "type"),
         Index("idx_transaction_date", "transaction_date"),
         Index("idx_transaction_category", "category"),
+        Index("idx_transaction_day", "day"),
+    )
+
+
+class TransactionRollup(Base):
+    """收支月度汇总表 — (月份, 类型, 分类) → 合计金额 / 笔数，随收支记录的增删改同步维护"""
+    __tablename__ = "transaction_rollups"
+
+    id = Column(Integer, primary_key=True)
+    month = Column(String(7), nullable=False)              # "2026-02" 格式
+    type = Column(String(20), nullable=False)              # income / expense
+    category = Column(String(50), nullable=False)
+    total = Column(Float, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("uq_rollup_month_type_category", "month", "type", "category", unique=True),
     )
 
 
+class BalanceLedger(Base):
+    """灵石余额累计表（单行）— 收入/支出合计随收支记录的增删改原子更新"""
+    __tablename__ = "balance_ledger"
+
+    id = Column(Integer, primary_key=True)                 # 固定为 1
+    income_total = Column(Float, nullable=False, default=0)
+    expense_total = Column(Float, nullable=False, default=0)
+    txn_count = Column(Integer, nullable=False, default=0)
+    change_seq = Column(Integer, nullable=False, default=0)  # 累计变更次数，每隔一段写一次检查点
+    updated_at = Column(DateTime, default=datetime.now)
+
+
+class BalanceCheckpoint(Base):
+    """余额检查点 — 定期保存累计值快照；verified 表示当时已与全表重算结果核对一致"""
+    __tablename__ = "balance_checkpoints"
+
+    id = Column(Integer, primary_key=True)
+    change_seq = Column(Integer, nullable=False)
+    income_total = Column(Float, nullable=False)
+    expense_total = Column(Float, nullable=False)
+    txn_count = Column(Integer, nullable=False)
+    verified = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+
 class RecurringTransaction(Base):
     """固定收支表（月工资、房租等）"""
     __tablename__ = "recurring_transactions"
@@ -297,6 +383,7 @@ class RelationshipEvent(Base):
     my_feeling = Column(Text, nullable=True)
     next_action = Column(Text, nullable=True)
     is_completed = Column(Boolean, default=False)          # 事件是否完成
+    day = Column(Integer, nullable=True)                   # event_date 的 epoch 天数
     created_at = Column(DateTime, default=datetime.now)
 
     person = relationship("Person", back_populates="events")
@@ -304,6 +391,7 @@ class RelationshipEvent(Base):
     __table_args__ = (
         Index("idx_event_person", "person_id"),
         Index("idx_event_date", "event_date"),
+        Index("idx_event_day", "day", "person_id"),
     )
 
 
@@ -352,6 +440,25 @@ class DailyScore(Base):
     )
 
 
+class ScoreCandle(Base):
+    """周/月/季/年K线 — 由每日评分逐级合成（周、月取日线，季取月线，年取季线），随日线写入同步维护"""
+    __tablename__ = "score_candles"
+
+    id = Column(Integer, primary_key=True)
+    span = Column(String(10), nullable=False)        # week / month / quarter / year
+    period_start = Column(Date, nullable=False)      # 周期第一天（周一 / 1 号 / 季首 / 1 月 1 日）
+    open_spirit = Column(Integer, nullable=False)    # 周期内第一个有数据的日子的开盘
+    close_spirit = Column(Integer, nullable=False)   # 周期内最后一个有数据的日子的收盘
+    high_spirit = Column(Integer, nullable=False)
+    low_spirit = Column(Integer, nullable=False)
+    change_count = Column(Integer, nullable=False)   # 周期内变动次数合计
+    day_count = Column(Integer, nullable=False)      # 周期内有日线的天数
+
+    __table_args__ = (
+        Index("uq_candle_span_start", "span", "period_start", unique=True),
+    )
+
+
 # ============ AI 配置 ============
 
 class AIConfig(Base):
@@ -0,0 +1,307 @@
+"""
+SQLite 存储层 — 存储配置（PRAGMA 组合）与进程级 engine 注册表
+mobile: Android/iOS 本地库；desktop: 桌面单用户；server: 8000 端口多会话 Web 部署
+"""
+import os
+import sqlite3
+import threading
+from collections import deque
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+DEFAULT_STORAGE_PROFILE = "desktop"
+
+# cache_size 为负数时单位是 KiB；mmap_size 单位是字节；busy_timeout 单位是毫秒
+STORAGE_PROFILES = {
+    "mobile": {
+        "busy_timeout": 3000,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -2048,            # 2 MB，手机内存紧张
+        "mmap_size": 16 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "desktop": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16384,           # 16 MB
+        "mmap_size": 128 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "server": {
+        "busy_timeout": 15000,          # 多个浏览器会话并发写，等待而不是报 database is locked
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -32768,           # 32 MB
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    # 不修改任何 PRAGMA，保持 SQLite 默认行为（排查问题 / 基准对比用）
+    "compat": {},
+}
+
+# busy_timeout 必须最先设置：切换 journal_mode 需要拿锁
+_PRAGMA_ORDER = ("busy_timeout", "journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store")
+
+
+def get_storage_profile(name: str) -> dict:
+    """获取存储配置，未知名称抛 ValueError"""
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f"未知的存储配置: {name}（可选: {', '.join(STORAGE_PROFILES)}）")
+    return STORAGE_PROFILES[name]
+
+
+def install_storage_profile(engine, name: str) -> None:
+    """在 engine 上注册 connect 钩子，每个新连接建立时应用对应 PRAGMA"""
+    settings = get_storage_profile(name)
+    pragmas = [(key, settings[key]) for key in _PRAGMA_ORDER if key in settings]
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_conn, _conn_record):
+        cursor = dbapi_conn.cursor()
+        try:
+            for key, value in pragmas:
+                cursor.execute(f"PRAGMA {key}={value}")
+        finally:
+            cursor.close()
+
+
+# ============ UserConfig 单行缓存 ============
+
+class ConfigCache:
+    """UserConfig 只有一行，整个进程共用一份缓存
+
+    本进程的写方法提交后调用 invalidate()；其他进程/连接的修改通过专用连接上的
+    PRAGMA data_version 发现（任何其他连接提交后该值都会变化）。
+    ":memory:" 库无法被其他连接修改，只靠 invalidate()。
+    """
+
+    _EMPTY = object()
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._row = self._EMPTY
+        self._version = None
+        self._watcher = None
+        if db_path != ":memory:":
+            self._watcher = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+
+    def _data_version(self):
+        if self._watcher is None:
+            return None
+        return self._watcher.execute("PRAGMA data_version").fetchone()[0]
+
+    def get(self, loader):
+        """返回缓存的行；数据库被改过或尚未加载时调用 loader() 重新读取"""
+        with self._lock:
+            # 先取版本再读行：读取期间若有新的提交，下次检查时版本不一致会再读一次
+            version = self._data_version()
+            if self._row is self._EMPTY or version != self._version:
+                self._row = loader()
+                self._version = version
+            return self._row
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._row = self._EMPTY
+
+    def close(self) -> None:
+        with self._lock:
+            self._row = self._EMPTY
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+
+
+# ============ 完成位图缓存 ============
+
+class BitmapCache:
+    """任务完成位图的进程级缓存 {task_id: DayBitmap}
+
+    每次失效都会让版本号加一。读者在开始读库之前记下版本号，回填时版本号已变就放弃：
+    别的会话在这期间提交并让缓存失效了，读到的可能是提交前的旧位图。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bitmaps = {}
+        self._version = 0
+
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+    def get(self, task_id: int):
+        with self._lock:
+            return self._bitmaps.get(task_id)
+
+    def put(self, task_id: int, bitmap, version: int) -> None:
+        with self._lock:
+            if version == self._version:
+                self._bitmaps[task_id] = bitmap
+
+    def invalidate(self, task_ids=None) -> None:
+        """让这些任务的缓存失效；None 表示全部"""
+        with self._lock:
+            self._version += 1
+            if task_ids is None:
+                self._bitmaps.clear()
+            else:
+                for task_id in task_ids:
+                    self._bitmaps.pop(task_id, None)
+
+
+# ============ 变更日志 ============
+
+class RecordChangeLog:
+    """提交版本号，以及每次提交影响到的最早一天（任务记录、每日评分各用一份）
+
+    统计缓存记下自己对应的版本号，过期时只需重算 changed_since() 之后的日子。
+    只是新增了记录的提交还会带上 [(task_id, 逻辑日)]，按天追加的缓存可以直接接上，不必重读。
+    只保留最近 keep 次提交，更早的版本查不到时返回 None（调用方整体重建）。
+    """
+
+    def __init__(self, keep: int = 1024):
+        self._lock = threading.Lock()
+        self._log = deque(maxlen=keep)
+        self.generation = 0
+
+    def record(self, from_day: int, appended: tuple = None) -> None:
+        """appended 为本次新增的 (task_id, 逻辑日)；None 表示有修改 / 删除 / 撤销等，不只是追加"""
+        with self._lock:
+            self.generation += 1
+            self._log.append((self.generation, from_day, appended))
+
+    def _since(self, generation: int):
+        if not self._log or self._log[0][0] > generation + 1:
+            return None
+        return [entry for entry in self._log if entry[0] > generation]
+
+    def changed_since(self, generation: int):
+        """generation 之后的提交里最早受影响的逻辑日；日志已被截断、无从得知时返回 None"""
+        with self._lock:
+            entries = self._since(generation)
+            return min((day for _, day, _ in entries), default=None) if entries is not None else None
+
+    def appended_since(self, generation: int):
+        """generation 之后的提交若都只是新增记录，返回按提交顺序的 [(task_id, 逻辑日)]，否则 None"""
+        with self._lock:
+            entries = self._since(generation)
+            if entries is None or any(appended is None for _, _, appended in entries):
+                return None
+            return [item for _, _, appended in entries for item in appended]
+
+
+# ============ 进程级 engine 注册表 ============
+
+class EngineEntry:
+    """同一数据库文件共享的 engine / session 工厂，带引用计数"""
+
+    def __init__(self, db_path: str, profile: str):
+        self.db_path = db_path
+        self.profile = profile
+        self.engine = create_engine(f"sqlite:///{db_path}", echo=False)
+        install_storage_profile(self.engine, profile)
+        self.session_factory = sessionmaker(bind=self.engine)
+        self.config_cache = ConfigCache(db_path)
+        self.record_changes = RecordChangeLog()
+        self.score_changes = RecordChangeLog()
+        # 任务完成位图缓存，写位图的事务提交后逐个失效
+        self.task_bitmaps = BitmapCache()
+        self.refcount = 0
+        self.schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def ensure_schema(self, init_fn) -> None:
+        """建表/迁移只在该文件第一次被打开时执行一次"""
+        if self.schema_ready:
+            return
+        with self._schema_lock:
+            if not self.schema_ready:
+                init_fn()
+                self.schema_ready = True
+
+    def dispose(self) -> None:
+        self.config_cache.close()
+        self.engine.dispose()
+
+
+class EngineRegistry:
+    """按数据库路径复用 engine，所有 Flet 会话共享同一个连接池
+
+    ":memory:" 每次都是独立的库，不参与共享。
+    """
+
+    def __init__(self):
+        self._entries: dict[str, EngineEntry] = {}
+        self._lock = threading.Lock()
+        # 被垃圾回收的 DatabaseManager 在这里排队，下次进锁时统一释放
+        # （GC 可能发生在持锁期间，回调里不能直接拿锁）
+        self._pending = deque()
+
+    @staticmethod
+    def _key(db_path: str) -> str:
+        return os.path.realpath(db_path)
+
+    def acquire(self, db_path: str, profile: str) -> EngineEntry:
+        """获取（必要时创建）路径对应的 engine，引用计数 +1"""
+        get_storage_profile(profile)
+        if db_path == ":memory:":
+            entry = EngineEntry(db_path, profile)
+            entry.refcount = 1
+            return entry
+        key = self._key(db_path)
+        with self._lock:
+            self._drain_pending()
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = EngineEntry(db_path, profile)
+                self._entries[key] = entry
+            elif entry.profile != profile:
+                raise ValueError(f"数据库 {db_path} 已以 {entry.profile} 配置打开，不能再以 {profile} 打开")
+            entry.refcount += 1
+            return entry
+
+    def release(self, entry: EngineEntry) -> None:
+        """引用计数 -1，归零时释放连接池"""
+        with self._lock:
+            self._pending.append(entry)
+            self._drain_pending()
+
+    def release_later(self, entry: EngineEntry) -> None:
+        """供 weakref.finalize 调用：不拿锁，只登记"""
+        self._pending.append(entry)
+
+    def _drain_pending(self) -> None:
+        """调用方须持有 self._lock"""
+        while self._pending:
+            entry = self._pending.popleft()
+            entry.refcount -= 1
+            if entry.refcount > 0:
+                continue
+            if entry.db_path != ":memory:":
+                key = self._key(entry.db_path)
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            entry.dispose()
+
+    def active_paths(self) -> list[str]:
+        with self._lock:
+            self._drain_pending()
+            return list(self._entries)
+
+    def dispose_all(self) -> None:
+        """进程退出时释放所有连接池"""
+        with self._lock:
+            self._pending.clear()
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            entry.dispose()
+
+
+engine_registry = EngineRegistry()
@@ -3,7 +3,7 @@
 """
 import flet as ft
 
-from utils.path_helper import get_database_path
+from utils.path_helper import get_database_path, get_storage_profile
 from database.db_manager import DatabaseManager
 from services.spirit_service import SpiritService
 from services.realm_service import RealmService
@@ -43,7 +43,9 @@ def main(page: ft.Page):
 
     # 初始化数据库
     db_path = get_database_path(page)
-    db = DatabaseManager(db_path)
+    db = DatabaseManager(db_path, profile=get_storage_profile(page))
+    # 会话过期时释放共享 engine 的引用，最后一个会话结束时连接池随之关闭
+    page.on_close = lambda e: db.close()
 
     # 初始化服务
     spirit_svc = SpiritService(db)
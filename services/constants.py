@@ -2,6 +2,7 @@
 凡人修仙3w天 — 常量定义（唯一真相源）
 所有模块引用此文件，不要在其他地方重复定义
 """
+import datetime as _dt
 
 # ============ 血量系统 ============
 DEFAULT_LIFESPAN_YEARS = 80  # 默认寿命
@@ -13,6 +14,11 @@ SPIRIT_MIN = -200
 SPIRIT_MAX = 640
 SPIRIT_DEFAULT = 0
 
+# ============ 日期分桶 ============
+# day 列存 1970-01-01 起的天数；任务记录按“一天从几点开始”折算（如 4 表示凌晨 4 点前算前一天）
+DEFAULT_DAY_START_HOUR = 0
+_EPOCH_ORDINAL = _dt.date(1970, 1, 1).toordinal()
+
 SPIRIT_LEVELS = [
     {"name": "心魔入体", "min": -200, "max": -80, "color": "#f44336", "desc": "极度负面状态"},
     {"name": "烦躁不堪", "min": -80, "max": -20, "color": "#ff5722", "desc": "严重负面状态"},
@@ -110,3 +116,88 @@ def get_spirit_progress(value: int) -> float:
 def clamp_spirit(value: int) -> int:
     """限制心境值在有效范围内"""
     return max(SPIRIT_MIN, min(SPIRIT_MAX, value))
+
+
+def skill_fraction(total_sub_tasks: int, completed_sub_tasks: int, is_completed: bool) -> float:
+    """单个技能完成度 0~1：有子任务按比例，无子任务按技能本身是否完成"""
+    if total_sub_tasks:
+        return completed_sub_tasks / total_sub_tasks
+    return 1.0 if is_completed else 0.0
+
+
+def realm_progress(total_skills: int, total_sub_tasks: int,
+                   completed_sub_tasks: int, progress_sum: float) -> dict:
+    """由境界的汇总计数得到进度
+
+    overall_progress: 子任务完成比例 0~100，用于展示
+    avg_progress: 各技能完成度的平均值 0~100，用于晋升判断
+    """
+    return {
+        "total_skills": total_skills,
+        "total_sub_tasks": total_sub_tasks,
+        "completed_sub_tasks": completed_sub_tasks,
+        "overall_progress": completed_sub_tasks / total_sub_tasks * 100 if total_sub_tasks > 0 else 0,
+        # 增量累加的浮点和可能有 1e-15 级误差，取整避免 99.9999…% 卡住晋升
+        "avg_progress": round(progress_sum / total_skills * 100, 6) if total_skills else 0,
+    }
+
+
+def epoch_day(d: _dt.date) -> int:
+    """日期 → 1970-01-01 起的天数"""
+    return d.toordinal() - _EPOCH_ORDINAL
+
+
+def day_to_date(day: int) -> _dt.date:
+    """epoch_day 的逆运算"""
+    return _dt.date.fromordinal(day + _EPOCH_ORDINAL)
+
+
+def local_day(moment: _dt.datetime, day_start_hour: int = DEFAULT_DAY_START_HOUR) -> int:
+    """时间点所属的“逻辑日”（epoch 天数），day_start_hour 点之前算前一天"""
+    return epoch_day((moment - _dt.timedelta(hours=day_start_hour)).date())
+
+
+# ============ K线周期 ============
+
+# 从细到粗；周一为一周的第一天
+CANDLE_SPANS = ("day", "week", "month", "quarter", "year")
+CANDLE_SPAN_NAMES = {"day": "日线", "week": "周线", "month": "月线", "quarter": "季线", "year": "年线"}
+KLINE_MAX_CANDLES = 400  # 一次最多返回的K线根数，超过就换更粗的周期
+
+
+def period_index(d: _dt.date, span: str) -> int:
+    """日期所在周期的连续编号，相邻周期相差 1"""
+    if span == "day":
+        return epoch_day(d)
+    if span == "week":
+        return (epoch_day(d) + 3) // 7  # 1970-01-01 是周四，偏移 3 天让周一对齐
+    if span == "month":
+        return d.year * 12 + d.month - 1
+    if span == "quarter":
+        return d.year * 4 + (d.month - 1) // 3
+    if span == "year":
+        return d.year
+    raise ValueError(f"未知的K线周期: {span}")
+
+
+def period_at(index: int, span: str) -> _dt.date:
+    """period_index 的逆运算，返回周期第一天"""
+    if span == "day":
+        return day_to_date(index)
+    if span == "week":
+        return day_to_date(index * 7 - 3)
+    if span == "month":
+        return _dt.date(index // 12, index % 12 + 1, 1)
+    if span == "quarter":
+        return _dt.date(index // 4, index % 4 * 3 + 1, 1)
+    if span == "year":
+        return _dt.date(index, 1, 1)
+    raise ValueError(f"未知的K线周期: {span}")
+
+
+def period_start(d: _dt.date, span: str) -> _dt.date:
+    return period_at(period_index(d, span), span)
+
+
+def period_end(d: _dt.date, span: str) -> _dt.date:
+    return period_at(period_index(d, span) + 1, span) - _dt.timedelta(days=1)
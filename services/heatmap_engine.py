@@ -0,0 +1,59 @@
+"""
+打卡热力图引擎
+职责：按任务完成位图生成一段日子里每天的完成数（单个任务 0/1，合并视图为完成的任务个数）；
+已算过的区间按任务记录变更日志判断是否仍然有效，翻看往年不重复计算
+"""
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from database.db_manager import DatabaseManager
+
+# 最多缓存多少个 (范围, 区间) 的结果
+HEATMAP_CACHE_SIZE = 64
+
+
+class HeatmapEngine:
+    """热力图数据
+
+    scope 为任务 id，或 None 表示所有正面任务合并。缓存的结果记下当时的记录版本号；
+    之后的改动若都晚于区间末尾（例如今天打卡之于往年），结果仍然有效，不必重算。
+    """
+
+    def __init__(self, db: DatabaseManager):
+        self.db = db
+        self._lock = threading.Lock()
+        self._cache: OrderedDict = OrderedDict()
+
+    def counts(self, scope: Optional[int], start_day: int, end_day: int) -> list[int]:
+        """[start_day, end_day] 每天一项的完成数"""
+        if scope is None:
+            task_ids = tuple(sorted(t["id"] for t in self.db.get_tasks_by_type("positive")))
+        else:
+            task_ids = (scope,)
+        # 合并视图的任务集合也是键的一部分：新建 / 删除任务后不会用到旧结果
+        key = (task_ids, start_day, end_day)
+        generation = self.db.record_generation()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                cached_generation, counts = cached
+                if cached_generation == generation or self._still_valid(cached_generation, end_day):
+                    self._cache[key] = (generation, counts)
+                    self._cache.move_to_end(key)
+                    return counts
+
+        counts = [0] * (end_day - start_day + 1)
+        for bitmap in self.db.get_task_bitmaps(list(task_ids)).values():
+            for day in bitmap.days(start_day, end_day):
+                counts[day - start_day] += 1
+        with self._lock:
+            self._cache[key] = (generation, counts)
+            self._cache.move_to_end(key)
+            while len(self._cache) > HEATMAP_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return counts
+
+    def _still_valid(self, generation: int, end_day: int) -> bool:
+        changed_from = self.db.records_changed_since(generation)
+        return changed_from is not None and changed_from > end_day
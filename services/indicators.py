@@ -0,0 +1,219 @@
+"""
+心境技术指标
+职责：在逐日收盘心境序列上计算 SMA / EMA / 布林带 / RSI / MACD / 回撤；
+每个指标都保存完整的输出数组，序列尾部变化时只从变化处往后重算
+"""
+import math
+import re
+from typing import Optional
+
+
+def forward_fill(values: list) -> list:
+    """None 用前一个值填充（开头的 None 保留）"""
+    filled, last = [], None
+    for v in values:
+        if v is not None:
+            last = v
+        filled.append(last)
+    return filled
+
+
+class Indicator:
+    """增量指标基类
+
+    outputs 是 {输出名: 与输入等长的数组}。update(values, start) 丢弃 start 之后的结果，
+    再用 start 之前保存的状态逐个往后算：今天的收盘变化时 start 即最后一天，开销与窗口无关。
+    """
+
+    name = ""
+    fields: tuple = ("value",)
+
+    def __init__(self):
+        self.outputs = {f: [] for f in self.fields}
+
+    def update(self, values: list, start: int = 0) -> None:
+        start = max(0, min(start, len(self.outputs[self.fields[0]])))
+        self._truncate(start)
+        for i in range(start, len(values)):
+            self._step(values, i)
+
+    def _truncate(self, start: int) -> None:
+        for out in self.outputs.values():
+            del out[start:]
+
+    def _step(self, values: list, i: int) -> None:
+        raise NotImplementedError
+
+
+class SMA(Indicator):
+    """简单移动平均，用前缀和求窗口合计"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.name = f"sma{window}"
+        self._prefix = [0]
+        super().__init__()
+
+    def _truncate(self, start: int) -> None:
+        super()._truncate(start)
+        del self._prefix[start + 1:]
+
+    def _step(self, values, i):
+        self._prefix.append(self._prefix[-1] + values[i])
+        w = self.window
+        self.outputs["value"].append((self._prefix[i + 1] - self._prefix[i + 1 - w]) / w if i + 1 >= w else None)
+
+
+class EMA(Indicator):
+    """指数移动平均，α = 2 / (span + 1)，以第一个值为起点"""
+
+    def __init__(self, span: int):
+        self.span = span
+        self.alpha = 2 / (span + 1)
+        self.name = f"ema{span}"
+        super().__init__()
+
+    def _step(self, values, i):
+        out = self.outputs["value"]
+        out.append(values[i] if i == 0 else out[-1] + self.alpha * (values[i] - out[-1]))
+
+
+class Bollinger(Indicator):
+    """布林带：window 日均线 ± k 倍标准差（总体标准差），前缀和 / 平方前缀和求窗口统计"""
+
+    fields = ("mid", "upper", "lower")
+
+    def __init__(self, window: int = 20, k: float = 2.0):
+        self.window = window
+        self.k = k
+        self.name = f"boll{window}"
+        self._prefix = [0]
+        self._prefix_sq = [0]
+        super().__init__()
+
+    def _truncate(self, start: int) -> None:
+        super()._truncate(start)
+        del self._prefix[start + 1:]
+        del self._prefix_sq[start + 1:]
+
+    def _step(self, values, i):
+        v = values[i]
+        self._prefix.append(self._prefix[-1] + v)
+        self._prefix_sq.append(self._prefix_sq[-1] + v * v)
+        w = self.window
+        if i + 1 < w:
+            mid = upper = lower = None
+        else:
+            total = self._prefix[i + 1] - self._prefix[i + 1 - w]
+            total_sq = self._prefix_sq[i + 1] - self._prefix_sq[i + 1 - w]
+            mid = total / w
+            std = math.sqrt(max(total_sq / w - mid * mid, 0))
+            upper, lower = mid + self.k * std, mid - self.k * std
+        self.outputs["mid"].append(mid)
+        self.outputs["upper"].append(upper)
+        self.outputs["lower"].append(lower)
+
+
+class RSI(Indicator):
+    """相对强弱指数（Wilder 平滑）；前 period 天不足以计算时为 None，全程无波动记 50"""
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.name = f"rsi{period}"
+        self._gain = []
+        self._loss = []
+        super().__init__()
+
+    def _truncate(self, start: int) -> None:
+        super()._truncate(start)
+        del self._gain[start:]
+        del self._loss[start:]
+
+    def _step(self, values, i):
+        n = self.period
+        if i < n:
+            gain = loss = None
+        elif i == n:
+            deltas = [values[j] - values[j - 1] for j in range(1, n + 1)]
+            gain = sum(d for d in deltas if d > 0) / n
+            loss = -sum(d for d in deltas if d < 0) / n
+        else:
+            delta = values[i] - values[i - 1]
+            gain = (self._gain[-1] * (n - 1) + max(delta, 0)) / n
+            loss = (self._loss[-1] * (n - 1) + max(-delta, 0)) / n
+        self._gain.append(gain)
+        self._loss.append(loss)
+        if gain is None:
+            value = None
+        elif gain + loss == 0:
+            value = 50.0
+        else:
+            value = 100 * gain / (gain + loss)
+        self.outputs["value"].append(value)
+
+
+class MACD(Indicator):
+    """MACD：快慢 EMA 之差（DIF）、其 signal 日 EMA（DEA）和柱（DIF - DEA）"""
+
+    fields = ("macd", "signal", "hist")
+
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        self.name = "macd"
+        self._fast, self._slow, self._signal = EMA(fast), EMA(slow), EMA(signal)
+        super().__init__()
+        self.outputs["signal"] = self._signal.outputs["value"]
+
+    def update(self, values: list, start: int = 0) -> None:
+        start = max(0, min(start, len(self.outputs["macd"])))
+        self._fast.update(values, start)
+        self._slow.update(values, start)
+        dif, hist = self.outputs["macd"], self.outputs["hist"]
+        del dif[start:]
+        dif.extend(f - s for f, s in zip(self._fast.outputs["value"][start:], self._slow.outputs["value"][start:]))
+        self._signal.update(dif, start)
+        del hist[start:]
+        hist.extend(d - s for d, s in zip(dif[start:], self.outputs["signal"][start:]))
+
+
+class Drawdown(Indicator):
+    """回撤：当前值距此前最高点的差（心境可以为负，用差值而不是百分比），以及迄今最大回撤"""
+
+    name = "drawdown"
+    fields = ("value", "peak", "max")
+
+    def _step(self, values, i):
+        peak = values[i] if i == 0 else max(self.outputs["peak"][-1], values[i])
+        value = values[i] - peak
+        self.outputs["peak"].append(peak)
+        self.outputs["value"].append(value)
+        self.outputs["max"].append(value if i == 0 else min(self.outputs["max"][-1], value))
+
+
+_NAME_RE = re.compile(r"^([a-z]+)(\d*)$")
+_FACTORIES = {
+    "sma": lambda n: SMA(n or 7),
+    "ema": lambda n: EMA(n or 12),
+    "boll": lambda n: Bollinger(n or 20),
+    "rsi": lambda n: RSI(n or 14),
+    "macd": lambda n: MACD(),
+    "drawdown": lambda n: Drawdown(),
+}
+
+
+def make_indicator(name: str) -> Indicator:
+    """按名称创建指标：sma7 / ema12 / boll20 / rsi14 / macd / drawdown（数字省略时用常用默认值）"""
+    match = _NAME_RE.match(name)
+    if not match or match.group(1) not in _FACTORIES:
+        raise ValueError(f"未知的指标: {name}")
+    number = int(match.group(2)) if match.group(2) else None
+    if number is not None and number < 1:
+        raise ValueError(f"指标窗口必须为正数: {name}")
+    indicator = _FACTORIES[match.group(1)](number)
+    indicator.name = name
+    return indicator
+
+
+def last_value(indicator: Indicator, field: str = None) -> Optional[float]:
+    """指标最新一天的值（没有数据时为 None）"""
+    out = indicator.outputs[field or indicator.fields[0]]
+    return out[-1] if out else None
@@ -1,11 +1,18 @@
 """
 K线人生图 Service 层
 职责：自动从心境系统生成K线数据（开盘/收盘/最高/最低）
+打卡时实时更新当天数据；撤销、境界奖励等其他变动在读取前按任务记录回放修复
 """
+import threading
 from datetime import date, timedelta
 from typing import Optional
 
 from database.db_manager import DatabaseManager
+from services.constants import (
+    CANDLE_SPANS, KLINE_MAX_CANDLES, day_to_date, epoch_day, period_index,
+)
+from services.indicators import forward_fill, make_indicator
+from services.vitals_replay import VitalsReplay
 
 
 class KlineService:
@@ -13,6 +20,19 @@ class KlineService:
 
     def __init__(self, db: DatabaseManager):
         self.db = db
+        self.replay = VitalsReplay(db)
+        # 已同步到的任务记录版本号；None 表示沿用库里现有数据，从下一次变动开始跟踪
+        self._synced_generation = None
+        # 指标用的逐日收盘序列：_closes[i] 是 _close_origin + i 那天的收盘（没有评分的日子沿用前一天）
+        self._lock = threading.Lock()
+        self._closes = []
+        self._close_origin = None
+        self._score_generation = None
+        self._indicators = {}
+
+    def _today(self) -> date:
+        """当前逻辑日（按 day_start_hour），与回放重建写入的日期一致"""
+        return day_to_date(self.db.current_day())
 
     def on_spirit_change(self, old_spirit: int, new_spirit: int) -> None:
         """心境值变动时调用，自动更新今日K线数据
@@ -21,7 +41,7 @@ class KlineService:
             old_spirit: 变动前的心境值
             new_spirit: 变动后的心境值
         """
-        today = date.today()
+        today = self._today()
         existing = self.db.get_daily_score(today)
 
         if not existing:
@@ -50,7 +70,7 @@ class KlineService:
         Args:
             current_spirit: 当前心境值
         """
-        today = date.today()
+        today = self._today()
         existing = self.db.get_daily_score(today)
         if not existing:
             self.db.upsert_daily_score(
@@ -62,38 +82,159 @@ class KlineService:
                 change_count=0,
             )
 
+    # === 回放重建 ===
+
+    def rebuild(self, start_date: date = None, end_date: date = None) -> dict:
+        """按任务记录（含境界奖励等快照）回放，重新生成区间内每天的 OHLC 和变动次数
+
+        默认从最早的任务记录到今天。一次回放、批量 upsert；
+        区间内有变动的日子写入，原本有数据但已无变动（如唯一一次打卡被撤销）的日子改为平盘。
+        返回 {"days": 回放天数, "written": 写入行数}。
+        """
+        end_day = epoch_day(end_date) if end_date else self.db.current_day()
+        if start_date:
+            start_day = epoch_day(start_date)
+        else:
+            first = self.db.get_first_record_day()
+            start_day = min(first, end_day) if first is not None else end_day
+        if start_day > end_day:
+            return {"days": 0, "written": 0}
+
+        existing = self.db.get_daily_score_dates(day_to_date(start_day), day_to_date(end_day))
+        rows = []
+        for bar in self.replay.replay(start_day, end_day):
+            score_date = day_to_date(bar["day"])
+            if bar["changes"] or score_date in existing:
+                rows.append({
+                    "score_date": score_date,
+                    "open_spirit": bar["open"],
+                    "close_spirit": bar["close"],
+                    "high_spirit": bar["high"],
+                    "low_spirit": bar["low"],
+                    "change_count": bar["changes"],
+                })
+        written = self.db.upsert_daily_scores(rows)
+        return {"days": end_day - start_day + 1, "written": written}
+
+    def repair(self) -> dict:
+        """增量修复：只重算上次同步之后被改动过的日子（撤销、境界奖励、历史补记/修改）"""
+        generation = self.db.record_generation()
+        if self._synced_generation is None or generation == self._synced_generation:
+            self._synced_generation = generation
+            return {"days": 0, "written": 0}
+        changed_from = self.db.records_changed_since(self._synced_generation)
+        first = self.db.get_first_record_day()
+        # 某一天的变动会影响之后每天的数值（心境是累积量），所以一直修到今天；
+        # 无法确定改动范围或改动早于最早记录时整体重建
+        if changed_from is None or first is None or changed_from < first:
+            result = self.rebuild()
+        else:
+            result = self.rebuild(day_to_date(changed_from))
+        self._synced_generation = generation
+        return result
+
     def get_today_score(self) -> Optional[dict]:
         """获取今天的评分"""
-        return self.db.get_daily_score(date.today())
+        self.repair()
+        return self.db.get_daily_score(self._today())
 
     def get_scores(self, days: int = 30) -> list[dict]:
         """获取最近N天的评分列表"""
-        end = date.today()
+        self.repair()
+        end = self._today()
         start = end - timedelta(days=days - 1)
         return self.db.get_daily_scores(start, end)
 
-    def get_weekly_avg(self) -> list[dict]:
-        """计算7日均线数据，返回最近30天每天的7日均值"""
-        scores = self.get_scores(days=37)  # 多取7天用于计算
-        # 构建日期->收盘价映射
-        score_map = {}
-        for s in scores:
-            close = s.get("close_spirit")
-            if close is not None:
-                score_map[s["score_date"]] = close
-
-        result = []
-        end = date.today()
-        for i in range(30):
-            d = end - timedelta(days=29 - i)
-            vals = []
-            for j in range(7):
-                dd = d - timedelta(days=j)
-                if dd in score_map:
-                    vals.append(score_map[dd])
-            avg = sum(vals) / len(vals) if vals else None
-            result.append({"date": d, "avg": round(avg, 1) if avg is not None else None})
-        return result
+    @staticmethod
+    def pick_span(start_date: date, end_date: date, max_candles: int = KLINE_MAX_CANDLES) -> str:
+        """能把区间画进 max_candles 根以内的最细周期；一生的跨度也画得下（年线）"""
+        for span in CANDLE_SPANS:
+            if period_index(end_date, span) - period_index(start_date, span) + 1 <= max_candles:
+                return span
+        return CANDLE_SPANS[-1]
+
+    def get_candles(self, days: int = 30, max_candles: int = KLINE_MAX_CANDLES) -> dict:
+        """最近 days 天的K线，周期按跨度自动选择
+
+        返回 {"span", "start", "end", "candles"}；每根K线带 period_start（日线即当天），
+        以及 open/close/high/low_spirit、change_count。
+        """
+        self.repair()
+        end = self._today()
+        start = end - timedelta(days=days - 1)
+        span = self.pick_span(start, end, max_candles)
+        if span == "day":
+            candles = [dict(s, period_start=s["score_date"], span="day", day_count=1)
+                       for s in self.db.get_daily_scores(start, end)]
+        else:
+            candles = self.db.get_score_candles(span, start, end)
+        return {"span": span, "start": start, "end": end, "candles": candles}
+
+    # === 技术指标 ===
+
+    def get_indicators(self, names: list[str], days: int = 365) -> dict:
+        """最近 days 天的收盘序列及指标（名称见 services.indicators.make_indicator）
+
+        返回 {"dates", "close", 名称: {输出名: 数组}}，数组与 dates 对齐，算不出的位置为 None。
+        指标按全部历史增量维护：只有改动过的日子之后才会重算。
+        """
+        self.repair()
+        with self._lock:
+            self._sync_closes()
+            for name in names:
+                if name not in self._indicators:
+                    indicator = make_indicator(name)
+                    indicator.update(self._closes)
+                    self._indicators[name] = indicator
+            if self._close_origin is None:
+                return {"dates": [], "close": [], **{n: {f: [] for f in self._indicators[n].outputs} for n in names}}
+            size = len(self._closes)
+            lo = max(0, size - days)
+            result = {
+                "dates": [day_to_date(self._close_origin + i) for i in range(lo, size)],
+                "close": self._closes[lo:],
+            }
+            for name in names:
+                result[name] = {f: out[lo:] for f, out in self._indicators[name].outputs.items()}
+            return result
+
+    def _sync_closes(self) -> None:
+        """让收盘序列跟上每日评分的改动，并从最早改动的那天起更新已有指标"""
+        generation = self.db.score_generation()
+        today = self.db.current_day()
+        if self._score_generation is None:
+            changed_from = None
+        elif generation != self._score_generation:
+            changed_from = self.db.scores_changed_since(self._score_generation)
+            if changed_from is not None and self._close_origin is not None and changed_from <= self._close_origin:
+                changed_from = None
+        elif self._close_origin is not None and self._close_origin + len(self._closes) <= today:
+            changed_from = self._close_origin + len(self._closes)  # 跨天：补上新的日子
+        else:
+            return
+
+        if changed_from is None or self._close_origin is None:
+            scores = self.db.get_daily_scores(date.min, self._today())
+            self._close_origin = epoch_day(scores[0]["score_date"]) if scores else None
+            self._closes = []
+            start = 0
+        else:
+            start = min(changed_from - self._close_origin, len(self._closes))
+            scores = self.db.get_daily_scores(day_to_date(self._close_origin + start), self._today())
+            del self._closes[start:]
+        self._score_generation = generation
+        if self._close_origin is None:
+            self._indicators.clear()
+            return
+
+        tail = [None] * (today - self._close_origin - start + 1)
+        for score in scores:
+            tail[epoch_day(score["score_date"]) - self._close_origin - start] = score["close_spirit"]
+        if start and tail[0] is None:
+            tail[0] = self._closes[-1]
+        self._closes += forward_fill(tail)
+        for indicator in self._indicators.values():
+            indicator.update(self._closes, start)
 
     def delete_score(self, score_id: int) -> bool:
         """删除评分"""
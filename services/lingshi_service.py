@@ -2,7 +2,7 @@
 灵石系统 Service 层
 职责：收支记录、预算、负债、统计
 """
-from datetime import date, datetime, timedelta
+from datetime import date, datetime
 from typing import Optional
 
 from database.db_manager import DatabaseManager
@@ -42,14 +42,24 @@ class LingshiService:
 
     def delete_transaction(self, txn_id: int) -> dict:
         """删除收支记录"""
-        with self.db.session_scope() as s:
-            from database.models import Transaction
-            txn = s.query(Transaction).filter(Transaction.id == txn_id).first()
-            if not txn:
-                return {"success": False, "message": "记录不存在"}
-            s.delete(txn)
+        if not self.db.delete_transaction(txn_id):
+            return {"success": False, "message": "记录不存在"}
         return {"success": True, "message": "已删除"}
 
+    def update_transaction(self, txn_id: int, amount: float = None, category: str = None,
+                           description: str = None, transaction_date: date = None) -> dict:
+        """修改收支记录（可改金额、分类、备注、日期）"""
+        if amount is not None and amount <= 0:
+            return {"success": False, "message": "金额必须大于0"}
+        fields = {k: v for k, v in {
+            "amount": amount, "category": category,
+            "description": description, "transaction_date": transaction_date,
+        }.items() if v is not None}
+        txn = self.db.update_transaction(txn_id, **fields)
+        if not txn:
+            return {"success": False, "message": "记录不存在"}
+        return {"success": True, "transaction": txn, "message": "已修改"}
+
     # === 查询 ===
 
     def get_balance(self) -> dict:
@@ -62,6 +72,12 @@ class LingshiService:
         """查询收支记录"""
         return self.db.get_transactions(start_date, end_date, type, category, limit)
 
+    def get_transaction_page(self, cursor: tuple = None, page_size: int = 30,
+                             type: str = None, category: str = None,
+                             start_date: date = None, end_date: date = None) -> dict:
+        """分页浏览收支记录（新到旧），cursor 为上一页的 next_cursor"""
+        return self.db.get_transaction_page(cursor, page_size, start_date, end_date, type, category)
+
     def get_today_transactions(self) -> list[dict]:
         """获取今日收支"""
         today = date.today()
@@ -84,21 +100,8 @@ class LingshiService:
             month = date.today().strftime("%Y-%m")
 
         budgets = self.db.get_budgets(month)
-        # 获取本月支出
-        year, mon = month.split("-")
-        start = date(int(year), int(mon), 1)
-        if int(mon) == 12:
-            end = date(int(year) + 1, 1, 1) - timedelta(days=1)
-        else:
-            end = date(int(year), int(mon) + 1, 1) - timedelta(days=1)
-
-        expenses = self.db.get_transactions(start_date=start, end_date=end, type="expense", limit=9999)
-
-        # 按分类汇总支出
-        category_spent = {}
-        for e in expenses:
-            cat = e["category"]
-            category_spent[cat] = category_spent.get(cat, 0) + e["amount"]
+        # 本月各分类支出（读月度汇总表）
+        category_spent = {r["category"]: r["total"] for r in self.db.get_month_rollups(month, type="expense")}
 
         total_spent = sum(category_spent.values())
 
@@ -203,26 +206,17 @@ class LingshiService:
         if not month:
             month = date.today().strftime("%Y-%m")
 
-        year, mon = month.split("-")
-        start = date(int(year), int(mon), 1)
-        if int(mon) == 12:
-            end = date(int(year) + 1, 1, 1) - timedelta(days=1)
-        else:
-            end = date(int(year), int(mon) + 1, 1) - timedelta(days=1)
-
-        txns = self.db.get_transactions(start_date=start, end_date=end, limit=9999)
-
-        income_total = sum(t["amount"] for t in txns if t["type"] == "income")
-        expense_total = sum(t["amount"] for t in txns if t["type"] == "expense")
-
-        # 按分类汇总
+        # 按分类汇总（读月度汇总表）
         income_by_cat = {}
         expense_by_cat = {}
-        for t in txns:
-            if t["type"] == "income":
-                income_by_cat[t["category"]] = income_by_cat.get(t["category"], 0) + t["amount"]
+        for r in self.db.get_month_rollups(month):
+            if r["type"] == "income":
+                income_by_cat[r["category"]] = r["total"]
             else:
-                expense_by_cat[t["category"]] = expense_by_cat.get(t["category"], 0) + t["amount"]
+                expense_by_cat[r["category"]] = r["total"]
+
+        income_total = sum(income_by_cat.values())
+        expense_total = sum(expense_by_cat.values())
 
         return {
             "month": month,
@@ -315,15 +309,8 @@ class LingshiService:
         if not budget:
             return None
 
-        year, mon = month.split("-")
-        start = date(int(year), int(mon), 1)
-        if int(mon) == 12:
-            end = date(int(year) + 1, 1, 1) - timedelta(days=1)
-        else:
-            end = date(int(year), int(mon) + 1, 1) - timedelta(days=1)
-
-        expenses = self.db.get_transactions(start_date=start, end_date=end, type="expense", category=category, limit=9999)
-        spent = sum(e["amount"] for e in expenses)
+        rollups = self.db.get_month_rollups(month, type="expense", category=category)
+        spent = rollups[0]["total"] if rollups else 0
 
         if spent > budget["amount"]:
             return f"{category}预算已超支 {spent - budget['amount']:.2f} 灵石"
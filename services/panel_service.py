@@ -2,13 +2,14 @@
 个人面板 Service 层
 职责：血量倒计时、仪表盘数据聚合
 """
-from datetime import datetime, date, timedelta
+from datetime import datetime
 from typing import Optional
 
 from database.db_manager import DatabaseManager
+from services.stats_engine import SpiritStatsEngine
 from services.constants import (
     DEFAULT_LIFESPAN_YEARS, BLOOD_TICK_MINUTES, BLOOD_TICK_AMOUNT,
-    get_spirit_level, get_spirit_progress
+    get_spirit_level, get_spirit_progress, day_to_date
 )
 
 
@@ -17,6 +18,7 @@ class PanelService:
 
     def __init__(self, db: DatabaseManager):
         self.db = db
+        self.stats = SpiritStatsEngine(db)
 
     def get_blood_status(self) -> Optional[dict]:
         """获取血量状态（实时计算）"""
@@ -72,26 +74,17 @@ class PanelService:
         spirit_progress = get_spirit_progress(spirit_value)
 
         # 今日数据
-        today_records = self.db.get_today_records()
-        today_spirit = sum(r["spirit_change"] for r in today_records)
-        today_blood = sum(r["blood_change"] for r in today_records)
-        today_positive = sum(1 for r in today_records if r["spirit_change"] > 0)
-        today_demon = sum(1 for r in today_records if r["spirit_change"] < 0)
+        today = self.stats.window(0)
 
         # 灵石余额
         balance = self.db.get_balance()
 
         # 境界进度
-        realm = self.db.get_active_realm("main")
+        realm = self.db.get_active_realm("main", include_skills=False)
         realm_info = None
         if realm:
-            total_subs = 0
-            completed_subs = 0
-            for sk in realm.get("skills", []):
-                for st in sk.get("sub_tasks", []):
-                    total_subs += 1
-                    if st["is_completed"]:
-                        completed_subs += 1
+            total_subs = realm["total_sub_tasks"]
+            completed_subs = realm["completed_sub_tasks"]
             realm_info = {
                 "name": realm["name"],
                 "progress": completed_subs / total_subs if total_subs > 0 else 0,
@@ -108,11 +101,11 @@ class PanelService:
                 "progress": spirit_progress,
             },
             "today": {
-                "total_tasks": len(today_records),
-                "positive_count": today_positive,
-                "demon_count": today_demon,
-                "spirit_change": today_spirit,
-                "blood_change": today_blood,
+                "total_tasks": today["count"],
+                "positive_count": today["positive_count"],
+                "demon_count": today["demon_count"],
+                "spirit_change": today["net"],
+                "blood_change": today["blood"],
             },
             "lingshi": {
                 "balance": balance["balance"],
@@ -124,25 +117,8 @@ class PanelService:
 
     def get_weekly_trend(self) -> list[dict]:
         """获取7日心境趋势"""
-        end = date.today()
-        start = end - timedelta(days=6)
-        records = self.db.get_records_in_range(start, end)
-
-        daily = {}
-        for i in range(7):
-            d = start + timedelta(days=i)
-            daily[str(d)] = {"positive": 0, "demon": 0, "net": 0}
-
-        for r in records:
-            day_key = str(r["completed_at"].date()) if isinstance(r["completed_at"], datetime) else str(r["completed_at"])[:10]
-            if day_key in daily:
-                if r["spirit_change"] > 0:
-                    daily[day_key]["positive"] += r["spirit_change"]
-                else:
-                    daily[day_key]["demon"] += abs(r["spirit_change"])
-                daily[day_key]["net"] += r["spirit_change"]
-
         return [
-            {"date": k[5:], "positive": v["positive"], "demon": v["demon"], "net": v["net"]}
-            for k, v in sorted(daily.items())
+            {"date": day_to_date(d["day"]).strftime("%m-%d"),
+             "positive": d["positive"], "demon": d["demon"], "net": d["net"]}
+            for d in self.stats.daily(7)
         ]
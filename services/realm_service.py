@@ -43,14 +43,8 @@ class RealmService:
         return self.db.get_active_realm(REALM_TYPE_DUNGEON)
 
     def get_active_dungeons(self) -> list[dict]:
-        """获取所有活跃副本"""
-        with self.db.session_scope() as s:
-            from database.models import Realm
-            realms = s.query(Realm).filter(
-                Realm.realm_type == REALM_TYPE_DUNGEON,
-                Realm.status == "active",
-            ).order_by(Realm.started_at.desc()).all()
-            return [self.db._realm_to_dict(r) for r in realms]
+        """获取所有活跃副本（含技能树）"""
+        return self.db.get_active_realms(REALM_TYPE_DUNGEON)
 
     def get_completed_realms(self, realm_type: str = None) -> list[dict]:
         """获取已完成的境界列表，可按类型过滤"""
@@ -71,12 +65,8 @@ class RealmService:
 
     def delete_skill(self, skill_id: int) -> dict:
         """删除技能"""
-        with self.db.session_scope() as s:
-            from database.models import Skill
-            skill = s.query(Skill).filter(Skill.id == skill_id).first()
-            if not skill:
-                return {"success": False, "message": "技能不存在"}
-            s.delete(skill)
+        if not self.db.delete_skill(skill_id):
+            return {"success": False, "message": "技能不存在"}
         return {"success": True, "message": "已删除"}
 
     # === 子任务管理 ===
@@ -88,12 +78,13 @@ class RealmService:
 
     def complete_sub_task(self, sub_task_id: int) -> dict:
         """完成子任务，自动检查大任务和境界进度"""
-        result = self.db.complete_sub_task(sub_task_id)
+        with self.db.unit_of_work():
+            result = self.db.complete_sub_task(sub_task_id)
 
-        # 如果大任务完成了，检查境界是否可以晋升
-        realm_ready = False
-        if result["skill_completed"]:
-            realm_ready = self._check_realm_completion(result["skill_id"])
+            # 如果大任务完成了，检查境界是否可以晋升
+            realm_ready = False
+            if result["skill_completed"]:
+                realm_ready = self._check_realm_completion(result["skill_id"])
 
         return {
             "success": True,
@@ -104,29 +95,15 @@ class RealmService:
         }
 
     def uncomplete_sub_task(self, sub_task_id: int) -> dict:
-        """取消完成子任务"""
-        with self.db.session_scope() as s:
-            from database.models import SubTask, Skill
-            sub = s.query(SubTask).filter(SubTask.id == sub_task_id).first()
-            if not sub:
-                return {"success": False, "message": "子任务不存在"}
-            sub.is_completed = False
-            sub.completed_at = None
-            # 同时取消大任务的完成状态
-            skill = s.query(Skill).filter(Skill.id == sub.skill_id).first()
-            if skill and skill.is_completed:
-                skill.is_completed = False
-                skill.completed_at = None
+        """取消完成子任务（同时取消大任务的完成状态）"""
+        if not self.db.uncomplete_sub_task(sub_task_id):
+            return {"success": False, "message": "子任务不存在"}
         return {"success": True, "message": "已取消完成"}
 
     def delete_sub_task(self, sub_task_id: int) -> dict:
         """删除子任务"""
-        with self.db.session_scope() as s:
-            from database.models import SubTask
-            sub = s.query(SubTask).filter(SubTask.id == sub_task_id).first()
-            if not sub:
-                return {"success": False, "message": "子任务不存在"}
-            s.delete(sub)
+        if not self.db.delete_sub_task(sub_task_id):
+            return {"success": False, "message": "子任务不存在"}
         return {"success": True, "message": "已删除"}
 
     def delete_realm(self, realm_id: int) -> dict:
@@ -149,29 +126,20 @@ class RealmService:
 
     def advance_realm(self, realm_id: int) -> dict:
         """境界晋升"""
-        with self.db.session_scope() as s:
-            from database.models import Realm, Skill, SubTask
+        with self.db.unit_of_work() as s:
+            from database.models import Realm
             realm = s.query(Realm).filter(Realm.id == realm_id).first()
             if not realm:
                 return {"success": False, "message": "境界不存在"}
             if realm.status != "active":
                 return {"success": False, "message": "境界非活跃状态"}
 
-            # 计算完成度
-            skills = s.query(Skill).filter(Skill.realm_id == realm_id).all()
-            if not skills:
+            # 完成度取冗余计数
+            progress = self.db._realm_to_dict(realm)
+            if not progress["total_skills"]:
                 return {"success": False, "message": "境界下没有技能"}
 
-            total_progress = 0
-            for sk in skills:
-                subs = s.query(SubTask).filter(SubTask.skill_id == sk.id).all()
-                if subs:
-                    completed = sum(1 for st in subs if st.is_completed)
-                    total_progress += completed / len(subs)
-                else:
-                    total_progress += 1.0 if sk.is_completed else 0
-
-            avg_progress = total_progress / len(skills) * 100
+            avg_progress = progress["avg_progress"]
 
             if avg_progress < realm.completion_rate:
                 return {
@@ -186,13 +154,9 @@ class RealmService:
 
             # 发放奖励
             reward_msg = ""
-            if realm.reward_spirit > 0:
-                from services.constants import clamp_spirit
-                from database.models import UserConfig
-                config = s.query(UserConfig).first()
-                if config:
-                    config.current_spirit = clamp_spirit(config.current_spirit + realm.reward_spirit)
-                    reward_msg = f"，心境+{realm.reward_spirit}"
+            if realm.reward_spirit > 0 and self.db.get_user_config():
+                self.db.update_spirit(realm.reward_spirit)
+                reward_msg = f"，心境+{realm.reward_spirit}"
 
             # 根据 realm_type 区分提示文案
             if realm.realm_type == REALM_TYPE_DUNGEON:
@@ -210,68 +174,44 @@ class RealmService:
 
     def get_realm_progress(self, realm_id: int) -> dict:
         """获取境界详细进度"""
-        with self.db.session_scope() as s:
-            from database.models import Realm, Skill, SubTask
-            realm = s.query(Realm).filter(Realm.id == realm_id).first()
-            if not realm:
-                return {"error": "境界不存在"}
+        realm = self.db.get_realm_tree(realm_id)
+        if not realm:
+            return {"error": "境界不存在"}
+        return self.summarize_realm(realm)
+
+    @staticmethod
+    def summarize_realm(realm: dict) -> dict:
+        """由已加载的境界技能树整理详细进度（计数取冗余字段，不查库）"""
+        skill_list = [{
+            "id": sk["id"], "name": sk["name"],
+            "is_completed": sk["is_completed"],
+            "total": sk["total_sub_tasks"], "completed": sk["completed_sub_tasks"],
+            "progress": sk["progress"],
+            "sub_tasks": [
+                {"id": st["id"], "name": st["name"], "is_completed": st["is_completed"]}
+                for st in sk["sub_tasks"]
+            ],
+        } for sk in realm["skills"]]
 
-            skills = s.query(Skill).filter(Skill.realm_id == realm_id).order_by(Skill.order_index).all()
-            skill_list = []
-            total_subs = 0
-            completed_subs = 0
-
-            for sk in skills:
-                subs = s.query(SubTask).filter(SubTask.skill_id == sk.id).order_by(SubTask.order_index).all()
-                sub_completed = sum(1 for st in subs if st.is_completed)
-                total_subs += len(subs)
-                completed_subs += sub_completed
-
-                skill_list.append({
-                    "id": sk.id, "name": sk.name,
-                    "is_completed": sk.is_completed,
-                    "total": len(subs), "completed": sub_completed,
-                    "progress": sub_completed / len(subs) if subs else 0,
-                    "sub_tasks": [
-                        {"id": st.id, "name": st.name, "is_completed": st.is_completed}
-                        for st in subs
-                    ],
-                })
-
-            return {
-                "realm_name": realm.name,
-                "realm_type": realm.realm_type,
-                "status": realm.status,
-                "completion_rate": realm.completion_rate,
-                "total_skills": len(skills),
-                "total_sub_tasks": total_subs,
-                "completed_sub_tasks": completed_subs,
-                "overall_progress": completed_subs / total_subs * 100 if total_subs > 0 else 0,
-                "skills": skill_list,
-            }
+        return {
+            "realm_name": realm["name"],
+            "realm_type": realm["realm_type"],
+            "status": realm["status"],
+            "completion_rate": realm["completion_rate"],
+            "total_skills": realm["total_skills"],
+            "total_sub_tasks": realm["total_sub_tasks"],
+            "completed_sub_tasks": realm["completed_sub_tasks"],
+            "overall_progress": realm["overall_progress"],
+            "skills": skill_list,
+        }
 
     # === 内部方法 ===
 
     def _check_realm_completion(self, skill_id: int) -> bool:
-        """检查技能所属境界是否满足晋升条件"""
+        """检查技能所属境界是否满足晋升条件（读境界的冗余计数，一条查询）"""
         with self.db.session_scope() as s:
-            from database.models import Skill, SubTask, Realm
-            skill = s.query(Skill).filter(Skill.id == skill_id).first()
-            if not skill:
-                return False
-            realm = s.query(Realm).filter(Realm.id == skill.realm_id).first()
+            from database.models import Skill, Realm
+            realm = s.query(Realm).join(Skill, Skill.realm_id == Realm.id).filter(Skill.id == skill_id).first()
             if not realm or realm.status != "active":
                 return False
-
-            skills = s.query(Skill).filter(Skill.realm_id == realm.id).all()
-            total_progress = 0
-            for sk in skills:
-                subs = s.query(SubTask).filter(SubTask.skill_id == sk.id).all()
-                if subs:
-                    completed = sum(1 for st in subs if st.is_completed)
-                    total_progress += completed / len(subs)
-                else:
-                    total_progress += 1.0 if sk.is_completed else 0
-
-            avg = total_progress / len(skills) * 100 if skills else 0
-            return avg >= realm.completion_rate
+            return self.db._realm_to_dict(realm)["avg_progress"] >= realm.completion_rate
@@ -2,13 +2,17 @@
 心境系统 Service 层
 职责：正面任务/心魔任务的业务逻辑
 """
-from datetime import datetime, date, timedelta
+from datetime import date, datetime
 from typing import Optional
 
 from database.db_manager import DatabaseManager
+from services.heatmap_engine import HeatmapEngine
+from services.stats_engine import SpiritStatsEngine
+from services.streak_engine import StreakEngine
+from services.vitals_replay import VitalsReplay
 from services.constants import (
     SPIRIT_MIN, SPIRIT_MAX, SPIRIT_LEVELS,
-    get_spirit_level, get_spirit_progress, clamp_spirit
+    get_spirit_level, get_spirit_progress, clamp_spirit, day_to_date, epoch_day, local_day
 )
 
 
@@ -17,6 +21,10 @@ class SpiritService:
 
     def __init__(self, db: DatabaseManager):
         self.db = db
+        self.stats = SpiritStatsEngine(db)
+        self.replay = VitalsReplay(db)
+        self.streaks = StreakEngine(db)
+        self.heatmap = HeatmapEngine(db)
         self.kline_svc = None  # 由 main.py 注入 KlineService 引用
 
     def _notify_kline(self, old_spirit: int, new_spirit: int):
@@ -34,6 +42,20 @@ class SpiritService:
         """获取心魔任务"""
         return self.db.get_tasks_by_type("demon")
 
+    def get_task_board(self, task_type: str) -> list[dict]:
+        """任务列表页数据：每个任务附带今日完成次数、是否已完成、连续打卡
+
+        今日次数和连续打卡各一条批量查询，不随任务数增加。
+        """
+        tasks = self.db.get_tasks_by_type(task_type)
+        counts = self.db.get_today_task_counts()
+        streaks = self.streaks.get_all() if any(t["enable_streak"] for t in tasks) else {}
+        for task in tasks:
+            task["today_count"] = counts.get(task["id"], 0)
+            task["completed"] = task["submission_type"] == "daily_checkin" and task["today_count"] > 0
+            task["streak"] = streaks.get(task["id"]) if task["enable_streak"] else None
+        return tasks
+
     def create_positive_task(self, name: str, spirit_effect: int,
                              blood_effect: int = 0, emoji: str = "⭐",
                              submission_type: str = "daily_checkin",
@@ -68,16 +90,30 @@ class SpiritService:
         self.db.reorder_tasks(task_ids)
 
     # === 任务完成 ===
+    # 每次点击的读取、记录、K线、连续打卡都在同一个 unit of work 里，只提交一次
 
     def complete_daily_task(self, task_id: int) -> dict:
         """完成每日打卡任务（每天只能一次）"""
+        try:
+            with self.db.unit_of_work():
+                result, task = self._complete_daily_task(task_id)
+                if result["success"] and task["enable_streak"]:
+                    # 本次记录尚未提交，按刚写入的那天算；提交后连续打卡引擎从变更日志接上
+                    result["streak"] = self.streaks.get(task_id, pending_day=result["record"]["day"])
+        except Exception:
+            # 事务内读过未提交的记录，回滚后不能再用
+            self.streaks.invalidate()
+            raise
+        return result
+
+    def _complete_daily_task(self, task_id: int) -> tuple[dict, Optional[dict]]:
         task = self.db.get_task(task_id)
         if not task:
-            return {"success": False, "message": "任务不存在"}
+            return {"success": False, "message": "任务不存在"}, task
         if task["submission_type"] != "daily_checkin":
-            return {"success": False, "message": "非每日打卡任务"}
+            return {"success": False, "message": "非每日打卡任务"}, task
         if self.db.is_task_completed_today(task_id):
-            return {"success": False, "message": "今日已完成该任务"}
+            return {"success": False, "message": "今日已完成该任务"}, task
 
         # 记录变动前的心境值
         config = self.db.get_user_config()
@@ -91,20 +127,19 @@ class SpiritService:
         # 通知K线服务
         self._notify_kline(old_spirit, record["new_spirit"])
 
-        # 更新连续打卡
-        streak = None
-        if task["enable_streak"]:
-            streak = self.db.update_streak(task_id)
-
         return {
             "success": True,
             "record": record,
-            "streak": streak,
+            "streak": None,
             "message": f"完成「{task['name']}」心境{task['spirit_effect']:+d}",
-        }
+        }, task
 
     def complete_repeatable_task(self, task_id: int) -> dict:
         """完成可重复任务"""
+        with self.db.unit_of_work():
+            return self._complete_repeatable_task(task_id)
+
+    def _complete_repeatable_task(self, task_id: int) -> dict:
         task = self.db.get_task(task_id)
         if not task:
             return {"success": False, "message": "任务不存在"}
@@ -129,6 +164,10 @@ class SpiritService:
 
     def record_demon(self, task_id: int) -> dict:
         """记录心魔事件（不可撤销）"""
+        with self.db.unit_of_work():
+            return self._record_demon(task_id)
+
+    def _record_demon(self, task_id: int) -> dict:
         task = self.db.get_task(task_id)
         if not task:
             return {"success": False, "message": "任务不存在"}
@@ -153,6 +192,38 @@ class SpiritService:
             "message": f"心魔「{task['name']}」心境{task['spirit_effect']:+d}",
         }
 
+    def backfill_tasks(self, entries: list[tuple[int, date]]) -> dict:
+        """补记：一次写入多条过去的完成 [(task_id, 日期)]
+
+        任务不存在、日期在未来、每日打卡任务当天已完成（含本批重复）的条目跳过。
+        当前心境/血量按钳制规则回放重算；连续打卡、K 线、统计在下次读取时从最早的补记日起增量刷新。
+        """
+        today = self.db.current_day()
+        with self.db.unit_of_work():
+            tasks = {task_id: self.db.get_task(task_id) for task_id in {t for t, _ in entries}}
+            bitmaps = self.db.get_task_bitmaps([t for t, task in tasks.items() if task])
+            rows, skipped, seen = [], [], set()
+            for task_id, d in entries:
+                task, day = tasks[task_id], epoch_day(d)
+                once = task is not None and task["submission_type"] == "daily_checkin"
+                if task is None or day > today or (once and ((task_id, day) in seen or bitmaps[task_id].has(day))):
+                    skipped.append((task_id, d))
+                    continue
+                seen.add((task_id, day))
+                rows.append({"task_id": task_id, "task_name": task["name"], "day": day,
+                             "spirit_change": task["spirit_effect"], "blood_change": task["blood_effect"]})
+            if not rows:
+                return {"success": False, "message": "没有可补记的记录", "skipped": skipped}
+            result = self.db.add_makeup_records(rows)
+        return {
+            "success": True,
+            "records": result["records"],
+            "skipped": skipped,
+            "new_spirit": result["new_spirit"],
+            "new_blood": result["new_blood"],
+            "message": f"补记 {len(rows)} 条" + (f"，跳过 {len(skipped)} 条" if skipped else ""),
+        }
+
     def undo_task(self, record_id: int) -> dict:
         """撤销任务（仅限当天的非心魔任务）"""
         result = self.db.undo_task_record(record_id)
@@ -160,8 +231,73 @@ class SpiritService:
             return {"success": False, "message": "无法撤销（非当天或已撤销）"}
         return {"success": True, "result": result, "message": "已撤销"}
 
+    # === 历史记录修改 ===
+    # 任意一天的记录都能改 / 删，下游只从改动的时刻往后重算
+
+    def edit_task_record(self, record_id: int, spirit_change: int = None, blood_change: int = None,
+                         completed_at: datetime = None, notes: str = None) -> dict:
+        """修改一条历史记录（心境/血量变化、完成时间、备注）"""
+        fields = {k: v for k, v in {
+            "spirit_change": spirit_change, "blood_change": blood_change,
+            "completed_at": completed_at, "notes": notes,
+        }.items() if v is not None}
+        with self.db.unit_of_work():
+            record = self.db.get_task_record(record_id)
+            if not record:
+                return {"success": False, "message": "记录不存在"}
+            task = self.db.get_task(record["task_id"])
+            if task and spirit_change is not None:
+                if task["task_type"] == "positive" and spirit_change < 0:
+                    return {"success": False, "message": "正面任务心境值不能为负"}
+                if task["task_type"] == "demon" and spirit_change > 0:
+                    return {"success": False, "message": "心魔任务心境值不能为正"}
+            if completed_at is not None:
+                if completed_at > datetime.now():
+                    return {"success": False, "message": "完成时间不能晚于现在"}
+                config = self.db.get_user_config()
+                day = local_day(completed_at, config["day_start_hour"] if config else 0)
+                if (task and task["submission_type"] == "daily_checkin" and day != record["day"]
+                        and self.db.get_task_bitmap(task["id"]).has(day)):
+                    return {"success": False, "message": "该日已完成该任务"}
+            if not fields:
+                return {"success": False, "message": "没有要修改的内容"}
+            updated = self.db.update_task_record(record_id, **fields)
+        return {"success": True, "record": updated, "message": "已修改"}
+
+    def delete_task_record(self, record_id: int) -> dict:
+        """删除一条历史记录"""
+        result = self.db.delete_task_record(record_id)
+        if not result:
+            return {"success": False, "message": "记录不存在"}
+        return {"success": True, "result": result, "message": "已删除"}
+
     # === 状态查询 ===
 
+    def get_heatmap(self, task_id: int = None, year: int = None) -> dict:
+        """打卡热力图数据
+
+        task_id 为 None 时合并所有正面任务（每天的值是完成的任务数）；
+        year 为 None 时是截至今天的最近 365 天，否则是该自然年。
+        返回 {"start", "end", "counts"（逐日）, "max", "active_days"}。
+        """
+        if year is None:
+            end = self.db.current_day()
+            start = end - 364
+        else:
+            start, end = epoch_day(date(year, 1, 1)), epoch_day(date(year, 12, 31))
+        counts = self.heatmap.counts(task_id, start, end)
+        return {
+            "start": day_to_date(start),
+            "end": day_to_date(end),
+            "counts": counts,
+            "max": max(counts, default=0),
+            "active_days": sum(1 for c in counts if c),
+        }
+
+    def get_streak(self, task_id: int) -> Optional[dict]:
+        """连续打卡状态（只读，由任务记录推导）；从未完成过时为 None"""
+        return self.streaks.get(task_id)
+
     def get_spirit_status(self) -> Optional[dict]:
         """获取当前心境状态"""
         config = self.db.get_user_config()
@@ -187,77 +323,54 @@ class SpiritService:
 
     def get_today_summary(self) -> dict:
         """获取今日心境摘要"""
-        records = self.db.get_today_records()
-        positive_count = sum(1 for r in records if r["spirit_change"] > 0)
-        demon_count = sum(1 for r in records if r["spirit_change"] < 0)
-        total_spirit = sum(r["spirit_change"] for r in records)
-        total_blood = sum(r["blood_change"] for r in records)
-
+        today = self.stats.window(0)
         return {
-            "positive_count": positive_count,
-            "demon_count": demon_count,
-            "total_spirit_change": total_spirit,
-            "total_blood_change": total_blood,
-            "total_records": len(records),
-            "records": records,
+            "positive_count": today["positive_count"],
+            "demon_count": today["demon_count"],
+            "total_spirit_change": today["net"],
+            "total_blood_change": today["blood"],
+            "total_records": today["count"],
         }
 
     def get_statistics(self, days: int = 7) -> dict:
-        """获取统计数据"""
-        end = date.today()
-        start = end - timedelta(days=days)
-        records = self.db.get_records_in_range(start, end)
-
-        positive_total = sum(r["spirit_change"] for r in records if r["spirit_change"] > 0)
-        demon_total = sum(abs(r["spirit_change"]) for r in records if r["spirit_change"] < 0)
-        positive_count = sum(1 for r in records if r["spirit_change"] > 0)
-        demon_count = sum(1 for r in records if r["spirit_change"] < 0)
-
+        """获取统计数据（最近 days 天 + 今天）"""
+        stats = self.stats.window(days)
         return {
             "days": days,
-            "positive_total": positive_total,
-            "demon_total": demon_total,
-            "positive_count": positive_count,
-            "demon_count": demon_count,
-            "net_spirit": positive_total - demon_total,
+            "positive_total": stats["positive"],
+            "demon_total": stats["demon"],
+            "positive_count": stats["positive_count"],
+            "demon_count": stats["demon_count"],
+            "net_spirit": stats["net"],
+        }
+
+    def get_range_statistics(self, start_date: date, end_date: date) -> dict:
+        """任意日期区间（含两端）的统计，一年、十年都只是一次前缀和相减"""
+        stats = self.stats.range(epoch_day(start_date), epoch_day(end_date))
+        return {
+            "start_date": str(start_date),
+            "end_date": str(end_date),
+            "positive_total": stats["positive"],
+            "demon_total": stats["demon"],
+            "positive_count": stats["positive_count"],
+            "demon_count": stats["demon_count"],
+            "net_spirit": stats["net"],
+            "blood_change": stats["blood"],
         }
 
     def get_spirit_trend(self, days: int = 30) -> list[dict]:
-        """获取心境变化趋势（每日净变化）"""
-        end = date.today()
-        start = end - timedelta(days=days - 1)
-        records = self.db.get_records_in_range(start, end)
-
-        # 按日期分组
-        daily = {}
-        for i in range(days):
-            d = start + timedelta(days=i)
-            daily[str(d)] = 0
-
-        for r in records:
-            day_key = str(r["completed_at"].date()) if isinstance(r["completed_at"], datetime) else str(r["completed_at"])[:10]
-            if day_key in daily:
-                daily[day_key] += r["spirit_change"]
-
-        # 计算累计值（从当前值反推）
-        config = self.db.get_user_config()
-        current = config["current_spirit"] if config else 0
-
-        trend = []
-        sorted_days = sorted(daily.keys())
-        # 从最后一天反推
-        cumulative = current
-        values = []
-        for d in reversed(sorted_days):
-            values.append((d, cumulative))
-            cumulative -= daily[d]
-        values.reverse()
-
-        for d, v in values:
-            trend.append({
-                "date": d[5:],  # MM-DD
-                "value": v,
-                "change": daily[d],
-            })
-
-        return trend
+        """获取心境变化趋势（每日收盘值与净变化）"""
+        daily = self.stats.daily(days)
+        closes = self.replay.replay(daily[0]["day"], daily[-1]["day"])
+        return [
+            {"date": day_to_date(d["day"]).strftime("%m-%d"), "value": c["close"], "change": d["net"]}
+            for d, c in zip(daily, closes)
+        ]
+
+    def get_spirit_at(self, moment: datetime) -> dict:
+        """某一时刻的心境/血量 {"spirit", "blood"}（从最近的快照回放）"""
+        return self.replay.state_at(moment)
+
+    def get_task_trigger_counts(self, days: int = 30, limit: int = 15) -> list[dict]:
+        """最近 days 天 + 今天各任务的触发次数排行（正面、心魔、日常都算）"""
+        return self.stats.top_tasks(days, limit)
@@ -0,0 +1,127 @@
+"""
+心境统计引擎
+职责：按日前缀和序列回答任意日期区间的心境 / 血量统计（O(1)），以及任务触发排行；
+缓存到下一次写任务记录为止，写入后只重算受影响的那几天
+"""
+import threading
+from typing import Optional
+
+from database.db_manager import DatabaseManager
+
+SERIES_FIELDS = ("positive", "demon", "positive_count", "demon_count", "count", "blood")
+
+
+class DailySeries:
+    """逐日汇总的前缀和
+
+    _prefix[f][i] 是字段 f 在 [origin, origin + i) 这些天的合计，区间求和只做一次减法。
+    序列覆盖最早一条记录到今天；记录变化后从受影响的最早一天开始重算，之前的前缀保持不变。
+    """
+
+    def __init__(self, db: DatabaseManager):
+        self.db = db
+        self._lock = threading.Lock()
+        self._generation = None
+        self.origin = 0
+        self.last_day = -1
+        self._prefix = {f: [0] for f in SERIES_FIELDS}
+
+    def _sync(self) -> None:
+        generation = self.db.record_generation()
+        today = self.db.current_day()
+        if self._generation is None:
+            self._rebuild(None, today)
+        elif generation != self._generation:
+            changed_from = self.db.records_changed_since(self._generation)
+            if changed_from is None or changed_from < self.origin:
+                self._rebuild(None, today)
+            else:
+                self._rebuild(min(changed_from, self.last_day + 1), today)
+        elif today > self.last_day:
+            # 跨过逻辑日：补上空白的日子
+            self._rebuild(self.last_day + 1, today)
+        self._generation = generation
+
+    def _rebuild(self, from_day: Optional[int], today: int) -> None:
+        """从 from_day 起重新汇总到今天；from_day 为 None 时整体重建"""
+        daily = self.db.get_daily_spirit(from_day, today)
+        if from_day is None:
+            self.origin = min(daily, default=today)
+            from_day = self.origin
+            for values in self._prefix.values():
+                del values[1:]
+        else:
+            for values in self._prefix.values():
+                del values[from_day - self.origin + 1:]
+        for day in range(from_day, today + 1):
+            stats = daily.get(day)
+            for f, values in self._prefix.items():
+                values.append(values[-1] + (stats[f] if stats else 0))
+        self.last_day = today
+
+    def _index(self, day: int) -> int:
+        return min(max(day - self.origin, 0), self.last_day - self.origin + 1)
+
+    def totals(self, start_day: int, end_day: int) -> dict:
+        """[start_day, end_day] 区间合计，附带 net（净心境）"""
+        with self._lock:
+            self._sync()
+            lo, hi = self._index(start_day), self._index(end_day + 1)
+            stats = {f: values[hi] - values[lo] if hi > lo else 0 for f, values in self._prefix.items()}
+        stats["net"] = stats["positive"] - stats["demon"]
+        return stats
+
+    def days(self, start_day: int, end_day: int) -> list[dict]:
+        """[start_day, end_day] 每天一项 {"day", 各字段, "net"}，没有记录的日子全为 0"""
+        with self._lock:
+            self._sync()
+            result = []
+            for day in range(start_day, end_day + 1):
+                lo, hi = self._index(day), self._index(day + 1)
+                stats = {f: values[hi] - values[lo] for f, values in self._prefix.items()}
+                stats["net"] = stats["positive"] - stats["demon"]
+                stats["day"] = day
+                result.append(stats)
+            return result
+
+
+class SpiritStatsEngine:
+    """心境统计引擎
+
+    窗口 w 表示最近 w 天再加上今天（0 即今天），与 get_statistics(days) 的口径一致。
+    """
+
+    def __init__(self, db: DatabaseManager):
+        self.db = db
+        self.series = DailySeries(db)
+        self._lock = threading.Lock()
+        self._top_key = None
+        self._top = None
+
+    def window(self, days: int) -> dict:
+        """最近 days 天 + 今天的合计"""
+        end = self.db.current_day()
+        return self.series.totals(end - days, end)
+
+    def range(self, start_day: int, end_day: int) -> dict:
+        """任意逻辑日区间的合计"""
+        return self.series.totals(start_day, end_day)
+
+    def daily(self, days: int) -> list[dict]:
+        """最近 days 天（含今天）逐日明细"""
+        end = self.db.current_day()
+        return self.series.days(end - days + 1, end)
+
+    def top_tasks(self, days: int = 30, limit: int = 15) -> list[dict]:
+        """最近 days 天 + 今天触发次数最多的任务 [{"name", "count", "spirit"}]"""
+        key = (self.db.record_generation(), self.db.current_day(), days)
+        with self._lock:
+            if key != self._top_key:
+                tasks = self.db.get_spirit_window_stats(key[1], [days])
+                ranked = [
+                    {"name": name, "count": w[days]["count"], "spirit": w[days]["positive"] - w[days]["demon"]}
+                    for name, w in tasks.items()
+                ]
+                ranked.sort(key=lambda t: (-t["count"], t["name"]))
+                self._top, self._top_key = ranked, key
+            return self._top[:limit]
@@ -0,0 +1,179 @@
+"""
+连续打卡引擎
+职责：从任务记录推导开启连续打卡的任务的当前连续天数、最长连续天数和近期完成率；
+完成日按游程编码存成 [起始日, 结束日] 两个数组，写入记录后只重读受影响的那几天
+"""
+import threading
+from array import array
+from typing import Optional
+
+from database.db_manager import DatabaseManager
+from services.constants import day_to_date
+
+# 完成率统计的窗口（天，含今天）
+STREAK_RATE_WINDOWS = (7, 30)
+
+
+class CompletionRuns:
+    """单个任务的完成日游程：starts[i]..ends[i] 是第 i 段连续完成的日子（epoch 天数，升序）"""
+
+    __slots__ = ("starts", "ends", "longest")
+
+    def __init__(self):
+        self.starts = array("q")
+        self.ends = array("q")
+        self.longest = 0
+
+    def append(self, day: int) -> None:
+        """按升序追加一个完成日（重复的日子忽略）"""
+        if self.ends and day <= self.ends[-1]:
+            return
+        if self.ends and day == self.ends[-1] + 1:
+            self.ends[-1] = day
+        else:
+            self.starts.append(day)
+            self.ends.append(day)
+        self.longest = max(self.longest, self.ends[-1] - self.starts[-1] + 1)
+
+    def truncate(self, from_day: int) -> None:
+        """丢掉 from_day 及之后的完成日"""
+        n = len(self.starts)
+        while n and self.starts[n - 1] >= from_day:
+            n -= 1
+        del self.starts[n:]
+        del self.ends[n:]
+        if n and self.ends[-1] >= from_day:
+            self.ends[-1] = from_day - 1
+        self.longest = max((e - s + 1 for s, e in zip(self.starts, self.ends)), default=0)
+
+    def copy(self) -> "CompletionRuns":
+        runs = CompletionRuns()
+        runs.starts, runs.ends, runs.longest = array("q", self.starts), array("q", self.ends), self.longest
+        return runs
+
+    def current(self, today: int) -> int:
+        """当前连续天数：今天或昨天完成过才算没断"""
+        if not self.ends or self.ends[-1] < today - 1:
+            return 0
+        return self.ends[-1] - self.starts[-1] + 1
+
+    def count_since(self, first_day: int) -> int:
+        """first_day 及之后的完成天数（从最后一段往前数，只走到窗口开头）"""
+        total, i = 0, len(self.starts) - 1
+        while i >= 0 and self.ends[i] >= first_day:
+            total += self.ends[i] - max(self.starts[i], first_day) + 1
+            i -= 1
+        return total
+
+
+class StreakEngine:
+    """开启了连续打卡（enable_streak）的任务的连续打卡状态
+
+    只读：结果完全由任务记录（不含已撤销的）推导，撤销、补录都会反映出来。
+    其间的提交若只是新增了记录（打卡），直接把那一天接到游程末尾；有修改、删除、撤销、
+    补记时按变更日志只重读受影响的最早一天之后的完成日。rebuild() 从头推导。
+    """
+
+    def __init__(self, db: DatabaseManager):
+        self.db = db
+        self._lock = threading.Lock()
+        self._generation = None
+        self._runs: dict[int, CompletionRuns] = {}
+        # {task_id: 是否开启连续打卡}；创建任务时就定下，不会再变
+        self._tracked: dict[int, bool] = {}
+
+    def rebuild(self) -> None:
+        with self._lock:
+            self._generation = self.db.record_generation()
+            self._load(None)
+
+    def invalidate(self) -> None:
+        """丢掉缓存，下次读取时从头推导（打卡事务回滚时调用）"""
+        with self._lock:
+            self._generation = None
+
+    def _sync(self) -> None:
+        generation = self.db.record_generation()
+        if self._generation is None:
+            self._load(None)
+        elif generation != self._generation:
+            appended = self.db.records_appended_since(self._generation)
+            if appended is None or not self._append(appended):
+                self._load(self.db.records_changed_since(self._generation))
+        self._generation = generation
+
+    def _append(self, appended: list[tuple[int, int]]) -> bool:
+        """把新增的完成日接到游程末尾；有早于末尾的日子（需要插到中间）时返回 False"""
+        items = [(task_id, day) for task_id, day in appended if self._is_tracked(task_id)]
+        for task_id, day in items:
+            runs = self._runs.get(task_id)
+            if runs and runs.ends and day < runs.ends[-1]:
+                return False
+        for task_id, day in items:
+            runs = self._runs.get(task_id)
+            if runs is None:
+                runs = self._runs[task_id] = CompletionRuns()
+            runs.append(day)
+        return True
+
+    def _is_tracked(self, task_id: int) -> bool:
+        tracked = self._tracked.get(task_id)
+        if tracked is None:
+            task = self.db.get_task(task_id)
+            tracked = self._tracked[task_id] = bool(task and task["enable_streak"])
+        return tracked
+
+    def _load(self, from_day: Optional[int]) -> None:
+        """从 from_day 起重读完成日；None 时整体重建"""
+        if from_day is None:
+            self._runs = {}
+        else:
+            for runs in self._runs.values():
+                runs.truncate(from_day)
+        for task_id, day in self.db.get_completion_days(from_day, streak_only=True):
+            runs = self._runs.get(task_id)
+            if runs is None:
+                runs = self._runs[task_id] = CompletionRuns()
+                self._tracked[task_id] = True
+            runs.append(day)
+
+    def get(self, task_id: int, pending_day: int = None) -> Optional[dict]:
+        """单个任务的连续打卡状态；从未完成过时为 None
+
+        pending_day 为本事务刚写入、尚未提交的完成日：结果按已加上这一天计算，缓存本身不改，
+        提交后由变更日志接上。调用方须确认该任务开启了连续打卡。
+        """
+        today = self.db.current_day()
+        with self._lock:
+            self._sync()
+            runs = self._runs.get(task_id)
+            if pending_day is not None:
+                self._tracked[task_id] = True
+                runs = runs.copy() if runs else CompletionRuns()
+                runs.append(pending_day)
+            return self._to_dict(task_id, runs, today) if runs and runs.ends else None
+
+    def get_all(self) -> dict[int, dict]:
+        """{task_id: 连续打卡状态}，只含完成过的任务"""
+        today = self.db.current_day()
+        with self._lock:
+            self._sync()
+            return {task_id: self._to_dict(task_id, runs, today)
+                    for task_id, runs in self._runs.items() if runs.ends}
+
+    @staticmethod
+    def _to_dict(task_id: int, runs: CompletionRuns, today: int) -> dict:
+        # 完成率的分母不早于第一次完成的那天，新任务不会被拉低
+        first = runs.starts[0]
+        rates = {}
+        for w in STREAK_RATE_WINDOWS:
+            window_start = max(today - w + 1, first)
+            span = today - window_start + 1
+            rates[w] = runs.count_since(window_start) / span if span > 0 else 0.0
+        return {
+            "task_id": task_id,
+            "current_streak": runs.current(today),
+            "max_streak": runs.longest,
+            "last_completed_date": day_to_date(runs.ends[-1]),
+            "rates": rates,
+        }
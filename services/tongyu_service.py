@@ -7,7 +7,7 @@ from datetime import date, datetime, timedelta
 from typing import Optional
 
 from database.db_manager import DatabaseManager
-from services.constants import RELATIONSHIP_TYPES, PERSONALITY_DIMENSIONS, IMPRESSION_TAGS, EMOTION_TAGS
+from services.constants import RELATIONSHIP_TYPES, PERSONALITY_DIMENSIONS, IMPRESSION_TAGS, EMOTION_TAGS, epoch_day
 
 
 class TongyuService:
@@ -251,24 +251,13 @@ class TongyuService:
             by_type[t] = by_type.get(t, 0) + 1
 
         # 本月互动次数
-        today = date.today()
-        month_start = today.replace(day=1)
-        total_events = 0
-        active_people = set()
-
-        for p in people:
-            events = self.db.get_events(p["id"], limit=100)
-            for e in events:
-                event_date = date.fromisoformat(e["event_date"]) if isinstance(e["event_date"], str) else e["event_date"]
-                if event_date >= month_start:
-                    total_events += 1
-                    active_people.add(p["id"])
+        activity = self.db.get_event_activity(epoch_day(date.today().replace(day=1)))
 
         return {
             "total_people": len(people),
             "by_type": by_type,
-            "monthly_interactions": total_events,
-            "active_this_month": len(active_people),
+            "monthly_interactions": activity["events"],
+            "active_this_month": activity["people"],
             "neglected": len(self.get_neglected_people()),
         }
 
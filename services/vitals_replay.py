@@ -0,0 +1,86 @@
+"""
+心境/血量回放
+职责：把任务记录当作事件日志，从最近的快照出发逐条回放（每一步都按上下限钳制），
+得到任意时刻的心境/血量，或一段日子里每天的开/高/低/收
+"""
+from datetime import datetime, time, timedelta
+
+from database.db_manager import DatabaseManager
+from services.constants import clamp_spirit, day_to_date
+
+_TICK = timedelta(microseconds=1)
+
+
+def _apply(spirit: int, blood: int, spirit_change: int, blood_change: int) -> tuple[int, int]:
+    """单个事件的效果，与 DatabaseManager._shift_vitals 的钳制规则一致"""
+    return clamp_spirit(spirit + spirit_change), max(blood + blood_change, 0)
+
+
+class VitalsReplay:
+    """心境/血量回放引擎
+
+    快照记录的是当时的真实值（含境界奖励等不经任务记录的变化、撤销造成的钳制差异），
+    回放途中遇到快照就以快照为准重新校准。
+    """
+
+    def __init__(self, db: DatabaseManager):
+        self.db = db
+
+    def state_at(self, moment: datetime) -> dict:
+        """moment 时刻（含）的 {"spirit", "blood"}"""
+        anchor = self.db.get_vital_anchor(moment)
+        spirit, blood = anchor["spirit"], anchor["blood"]
+        for _, _, spirit_change, blood_change in self.db.get_vital_events(anchor, moment):
+            spirit, blood = _apply(spirit, blood, spirit_change, blood_change)
+        return {"spirit": spirit, "blood": blood}
+
+    def day_start(self, day: int) -> datetime:
+        """逻辑日 day 的起始时刻（按 day_start_hour）"""
+        config = self.db.get_user_config()
+        hour = config["day_start_hour"] if config else 0
+        return datetime.combine(day_to_date(day), time(hour))
+
+    def replay(self, start_day: int, end_day: int) -> list[dict]:
+        """[start_day, end_day] 每个逻辑日一项 {"day", "open", "high", "low", "close", "blood", "changes"}
+
+        只查一次起点快照、一次区间内的事件和快照，然后单遍扫描；
+        open 为当天开始时的心境，close / blood 为当天结束时的值，changes 为心境实际变动的次数。
+        """
+        if end_day < start_day:
+            return []
+        boundaries = [self.day_start(d) for d in range(start_day, end_day + 2)]
+        range_start, range_end = boundaries[0] - _TICK, boundaries[-1] - _TICK
+
+        anchor = self.db.get_vital_anchor(range_start)
+        # (时间, 记录 id, 类别, ...)：同一位置上事件排在快照之前，快照已包含该事件
+        stream = [(t, rid, 0, ds, db) for t, rid, ds, db in self.db.get_vital_events(anchor, range_end)]
+        stream += [(v["taken_at"], v["record_id"], 1, v["spirit"], v["blood"])
+                   for v in self.db.get_vital_snapshots(anchor["taken_at"] or datetime.min, range_end)]
+        stream.sort(key=lambda item: item[:3])
+
+        spirit, blood = anchor["spirit"], anchor["blood"]
+        result, i = [], 0
+        for offset, day in enumerate(range(start_day, end_day + 1)):
+            # 逻辑日开始前的事件（起点快照之后、区间之前）先并入开盘值
+            while i < len(stream) and stream[i][0] < boundaries[offset]:
+                spirit, blood = self._step(spirit, blood, stream[i])
+                i += 1
+            open_spirit = high = low = spirit
+            changes = 0
+            while i < len(stream) and stream[i][0] < boundaries[offset + 1]:
+                before = spirit
+                spirit, blood = self._step(spirit, blood, stream[i])
+                if spirit != before:
+                    changes += 1
+                    high, low = max(high, spirit), min(low, spirit)
+                i += 1
+            result.append({"day": day, "open": open_spirit, "high": high, "low": low,
+                           "close": spirit, "blood": blood, "changes": changes})
+        return result
+
+    @staticmethod
+    def _step(spirit: int, blood: int, item: tuple) -> tuple[int, int]:
+        _, _, kind, a, b = item
+        if kind == 1:
+            return a, b
+        return _apply(spirit, blood, a, b)
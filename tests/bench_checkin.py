@@ -0,0 +1,56 @@
+"""
+打卡路径基准 — 测量 SpiritService.complete_daily_task 单次耗时和事务数
+用法: python tests/bench_checkin.py [打卡次数] [profile]
+"""
+import sys, os, time, tempfile, statistics
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+
+from database.db_manager import DatabaseManager
+from services.spirit_service import SpiritService
+from services.kline_service import KlineService
+
+
+def bench_checkin(taps: int, profile: str) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "bench.db"), profile=profile)
+        db.init_user_config(1998)
+        spirit = SpiritService(db)
+        spirit.kline_svc = KlineService(db)
+        tasks = [spirit.create_positive_task(f"习惯{i}", spirit_effect=1, enable_streak=True)
+                 for i in range(taps)]
+
+        commits = []
+        event.listen(db.engine, "commit", lambda conn: commits.append(1))
+
+        latencies = []
+        for task in tasks:
+            start = time.perf_counter()
+            result = spirit.complete_daily_task(task["id"])
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert result["success"]
+        db.close()
+    # 记录、K线、连续打卡都在同一个 unit of work 里
+    assert len(commits) == taps, f"每次打卡应只提交一次，实际 {len(commits) / taps:.1f} 次"
+
+    latencies.sort()
+    return {
+        "mean": statistics.mean(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "commits_per_tap": len(commits) / taps,
+    }
+
+
+def main():
+    taps = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    profile = sys.argv[2] if len(sys.argv) > 2 else "desktop"
+    r = bench_checkin(taps, profile)
+    print(f"打卡 {taps} 次（profile={profile}）")
+    print(f"mean {r['mean']:.3f} ms  p50 {r['p50']:.3f} ms  p95 {r['p95']:.3f} ms  "
+          f"commit/次 {r['commits_per_tap']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+存储配置基准 — 对比各 profile 下单次写入（打卡）的延迟
+用法: python tests/bench_storage.py [写入次数]
+"""
+import sys, os, time, tempfile, statistics
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db_manager import DatabaseManager
+from database.storage import STORAGE_PROFILES
+
+
+def bench_profile(profile: str, writes: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "bench.db"), profile=profile)
+        db.init_user_config(1998)
+        task = db.create_task("冥想", "positive", spirit_effect=1, submission_type="repeatable")
+
+        latencies = []
+        for _ in range(writes):
+            start = time.perf_counter()
+            db.add_task_record(task["id"], task["name"], spirit_change=1, blood_change=0)
+            latencies.append((time.perf_counter() - start) * 1000)
+        db.close()
+
+    latencies.sort()
+    return {
+        "profile": profile,
+        "mean": statistics.mean(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95)],
+    }
+
+
+def main():
+    writes = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print(f"每个 profile 写入 {writes} 次（单位 ms/次）")
+    print(f"{'profile':<10}{'mean':>10}{'p50':>10}{'p95':>10}")
+    for profile in STORAGE_PROFILES:
+        r = bench_profile(profile, writes)
+        print(f"{r['profile']:<10}{r['mean']:>10.3f}{r['p50']:>10.3f}{r['p95']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -63,10 +63,109 @@ class TestUserConfig:
         new_val = db.update_blood(-999_999_999)
         assert new_val == 0
 
+    def test_update_requires_config(self):
+        empty = DatabaseManager(":memory:")
+        with pytest.raises(ValueError):
+            empty.update_spirit(1)
+        with pytest.raises(ValueError):
+            empty.update_blood(1)
+
+    def test_update_visible_in_same_unit_of_work(self, db):
+        with db.unit_of_work():
+            assert db.get_user_config()["current_spirit"] == 0
+            db.update_spirit(5)
+            assert db.get_user_config()["current_spirit"] == 5
+
+    def test_config_cached_between_writes(self, tmp_path):
+        from sqlalchemy import event
+        db = DatabaseManager(str(tmp_path / "app.db"))
+        db.init_user_config(1998)
+        db.get_user_config()
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, *args: statements.append(sql))
+        for _ in range(5):
+            assert db.get_user_config()["birth_year"] == 1998
+        assert statements == []
+        # 返回的是副本，调用方修改不影响缓存
+        db.get_user_config()["current_spirit"] = 999
+        assert db.get_user_config()["current_spirit"] == 0
+        db.close()
+
+    def test_config_cache_refreshed_by_writes(self, db):
+        db.get_user_config()
+        db.update_spirit(7)
+        db.update_target_money(42)
+        config = db.get_user_config()
+        assert config["current_spirit"] == 7
+        assert config["target_money"] == 42
+
+    def test_config_cache_sees_other_connections(self, tmp_path):
+        import sqlite3
+        path = str(tmp_path / "app.db")
+        db = DatabaseManager(path)
+        db.init_user_config(1998)
+        assert db.get_user_config()["current_spirit"] == 0
+        other = sqlite3.connect(path)
+        other.execute("UPDATE user_config SET current_spirit = 33")
+        other.commit()
+        other.close()
+        assert db.get_user_config()["current_spirit"] == 33
+        db.close()
+
+    def test_rolled_back_write_not_cached(self, db):
+        with pytest.raises(RuntimeError):
+            with db.unit_of_work():
+                db.update_spirit(9)
+                assert db.get_user_config()["current_spirit"] == 9
+                raise RuntimeError("boom")
+        assert db.get_user_config()["current_spirit"] == 0
+
+    def test_concurrent_taps_lose_no_updates(self, tmp_path):
+        """多个会话同时打卡：每一次增减都必须落库"""
+        from concurrent.futures import ThreadPoolExecutor
+        path = str(tmp_path / "app.db")
+        setup = DatabaseManager(path, profile="server")
+        setup.init_user_config(1998)
+        start_blood = setup.get_user_config()["current_blood"]
+        task = setup.create_task("冥想", "positive", spirit_effect=1, blood_effect=1,
+                                 submission_type="repeatable")
+        sessions = [DatabaseManager(path, profile="server") for _ in range(8)]
+        taps = 400
+
+        def tap(i):
+            db = sessions[i % len(sessions)]
+            if i % 4 == 3:
+                db.update_spirit(1)
+                db.update_blood(1)
+            else:
+                db.add_task_record(task["id"], task["name"], spirit_change=1, blood_change=1)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(tap, range(taps)))
+
+        config = setup.get_user_config()
+        assert config["current_spirit"] == taps
+        assert config["current_blood"] == start_blood + taps
+        for db in sessions:
+            db.close()
+        setup.close()
+
 
 class TestTasks:
     """任务 CRUD 测试"""
 
+    def test_today_task_counts(self, db):
+        a = db.create_task("冥想", "positive", spirit_effect=1, submission_type="repeatable")
+        b = db.create_task("刷手机", "demon", spirit_effect=-3, submission_type="repeatable")
+        db.create_task("早起", "positive", spirit_effect=1)
+        for _ in range(3):
+            db.add_task_record(a["id"], a["name"], spirit_change=1, blood_change=0)
+        rec = db.add_task_record(b["id"], b["name"], spirit_change=-3, blood_change=0)
+        db.add_task_record(b["id"], b["name"], spirit_change=-3, blood_change=0)
+        db.undo_task_record(rec["id"])
+        assert db.get_today_task_counts() == {a["id"]: 3, b["id"]: 1}
+
     def test_create_positive_task(self, db):
         task = db.create_task("早起", "positive", spirit_effect=1, emoji="🌅")
         assert task["name"] == "早起"
@@ -152,20 +251,212 @@ class TestTaskRecords:
         assert records[0]["task_name"] == "早起"
 
 
-class TestStreak:
-    """连续打卡测试"""
-
-    def test_first_streak(self, db):
-        task = db.create_task("冥想", "positive", spirit_effect=1, enable_streak=True)
-        streak = db.update_streak(task["id"])
-        assert streak["current_streak"] == 1
-        assert streak["max_streak"] == 1
+    @pytest.mark.parametrize("query,covering", [
+        ("get_today_records", False),
+        ("get_task_today_count", True),
+        ("get_today_task_counts", True),
+        ("get_records_in_range", False),
+    ])
+    def test_hot_record_queries_use_index(self, db, query, covering):
+        from sqlalchemy import event
+        task = db.create_task("早起", "positive", spirit_effect=1)
+        for _ in range(3):
+            db.add_task_record(task["id"], "早起", 1, 0)
+        args = {
+            "get_task_today_count": (task["id"],),
+            "get_records_in_range": (date.today() - timedelta(days=7), date.today()),
+        }.get(query, ())
+
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, params, *a: statements.append((sql, params)))
+        getattr(db, query)(*args)
+        sql, params = statements[-1]
+        with db.engine.connect() as conn:
+            plan = [r[3] for r in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, params)]
+        record_steps = [p for p in plan if "task_records" in p]
+        assert record_steps and all(p.startswith("SEARCH") for p in record_steps), plan
+        assert all("COVERING INDEX" in p for p in record_steps) == covering, plan
+        assert not any("ORDER BY" in p for p in plan), plan
+
+    def test_completion_bitmap_follows_records(self, db):
+        from sqlalchemy import event
+        daily = db.create_task("早起", "positive", spirit_effect=1)
+        repeat = db.create_task("喝水", "positive", spirit_effect=1, submission_type="repeatable")
+        assert db.is_task_completed_today(daily["id"]) is False
+        first = db.add_task_record(daily["id"], "早起", 1, 0)
+        a = db.add_task_record(repeat["id"], "喝水", 1, 0)
+        b = db.add_task_record(repeat["id"], "喝水", 1, 0)
+        assert db.is_task_completed_today(daily["id"]) is True
+
+        # 缓存命中时不查库
+        statements = []
+        event.listen(db.engine, "before_cursor_execute", lambda conn, cur, sql, *args: statements.append(sql))
+        assert db.is_task_completed_today(daily["id"]) is True
+        assert statements == []
+
+        # 可重复任务撤销一条后仍算完成，全部撤销才清掉
+        db.undo_task_record(a["id"])
+        assert db.is_task_completed_today(repeat["id"]) is True
+        db.undo_task_record(b["id"])
+        db.undo_task_record(first["id"])
+        assert not db.is_task_completed_today(repeat["id"]) and not db.is_task_completed_today(daily["id"])
+
+    def test_update_and_delete_task_record(self, db):
+        task = db.create_task("喝水", "positive", spirit_effect=1, submission_type="repeatable")
+        a = db.add_task_record(task["id"], "喝水", 1, 0)
+        b = db.add_task_record(task["id"], "喝水", 1, 0)
+        with pytest.raises(ValueError):
+            db.update_task_record(a["id"], task_id=2)
+        assert db.update_task_record(999, notes="x") is None
+
+        last_week = datetime.now() - timedelta(days=7)
+        updated = db.update_task_record(a["id"], completed_at=last_week, spirit_change=4, notes="补")
+        assert (updated["day"], updated["notes"], updated["new_spirit"]) == (db.current_day() - 7, "补", 5)
+        assert db.get_task_bitmap(task["id"]).days(0, db.current_day()) == [db.current_day() - 7, db.current_day()]
+
+        assert db.delete_task_record(b["id"])["new_spirit"] == 4
+        assert db.get_task_record(b["id"]) is None
+        assert not db.is_task_completed_today(task["id"])
+        assert db.get_user_config()["current_spirit"] == 4
+
+    def test_bitmap_cache_skips_reads_older_than_commit(self, db):
+        task = db.create_task("早起", "positive", spirit_effect=1)
+        cache = db._entry.task_bitmaps
+        with db.session_scope() as reader:
+            # 读者会话开始后别的会话提交了打卡：读者读到的位图不回填缓存
+            db.add_task_record(task["id"], "早起", 1, 0)
+            db._task_bitmap(reader, task["id"])
+            assert cache.get(task["id"]) is None
+        assert db.is_task_completed_today(task["id"])
+        assert cache.get(task["id"]).has(db.current_day())
+
+    def test_record_change_log_tracks_appends(self, db):
+        task = db.create_task("喝水", "positive", spirit_effect=1, submission_type="repeatable")
+        today = db.current_day()
+        start = db.record_generation()
+        a = db.add_task_record(task["id"], "喝水", 1, 0)
+        db.update_spirit(3)  # 记录本身没变
+        db.add_task_record(task["id"], "喝水", 1, 0)
+        assert db.records_appended_since(start) == [(task["id"], today)] * 2
+        middle = db.record_generation()
+        db.undo_task_record(a["id"])
+        assert db.records_appended_since(start) is None
+        assert db.records_appended_since(middle) is None
+        assert db.records_changed_since(middle) == today
+
+    def test_reset_all_data_clears_caches(self, db):
+        task = db.create_task("早起", "positive", spirit_effect=1)
+        db.add_task_record(task["id"], "早起", 1, 0)
+        assert db.is_task_completed_today(task["id"]) and db.get_user_config()
+        db.reset_all_data()
+        assert db.get_user_config() is None
+        fresh = db.create_task("冥想", "positive", spirit_effect=1)
+        assert fresh["id"] == task["id"]
+        assert not db.is_task_completed_today(fresh["id"])
+
+    def test_day_bitmap(self):
+        from database.bitmaps import DayBitmap
+        bitmap = DayBitmap()
+        for day in (100, 101, 102, 105, 106, 90):   # 90 比起点早，需要整体平移
+            bitmap.set(day)
+        assert bitmap.origin == 90 and (bitmap.first(), bitmap.last()) == (90, 106)
+        assert bitmap.days(0, 200) == [90, 100, 101, 102, 105, 106]
+        assert bitmap.count(95, 105) == 4 and bitmap.count(107, 200) == 0 and bitmap.count(0, 89) == 0
+        assert bitmap.rate(100, 109) == 0.5
+        assert (bitmap.streak_ending(102), bitmap.streak_ending(106), bitmap.streak_ending(104)) == (3, 2, 0)
+        bitmap.clear(101)
+        assert bitmap.streak_ending(102) == 1 and not bitmap.has(101)
+
+        restored = DayBitmap.from_blob(bitmap.origin, bitmap.to_blob())
+        assert restored.days(0, 200) == bitmap.days(0, 200)
+        # 80 年每天都完成也只占约 3.6 KB
+        full = DayBitmap()
+        for day in range(80 * 365):
+            full.set(day)
+        assert len(full.to_blob()) == 3650
+        assert full.count(365, 2 * 365 - 1) == 365
+
+    def test_record_day_follows_day_start_hour(self, db):
+        from database.models import TaskRecord
+        from services.constants import epoch_day
+        task = db.create_task("熬夜", "demon", spirit_effect=-2)
+        record = db.add_task_record(task["id"], "熬夜", -2, 0)
+        assert db.get_daily_spirit(db.current_day(), db.current_day())[db.current_day()]["demon"] == 2
+
+        late_night = datetime.combine(date.today() - timedelta(days=1), datetime.min.time()).replace(hour=2)
+        with db.session_scope() as s:
+            s.query(TaskRecord).filter(TaskRecord.id == record["id"]).update({TaskRecord.completed_at: late_night})
+        db.update_day_start_hour(0)
+        yesterday = epoch_day(date.today() - timedelta(days=1))
+        assert list(db.get_daily_spirit(yesterday - 5, yesterday + 5)) == [yesterday]
+
+        # 凌晨 4 点换日：昨天凌晨 2 点算前天
+        db.update_day_start_hour(4)
+        assert db.get_user_config()["day_start_hour"] == 4
+        assert list(db.get_daily_spirit(yesterday - 5, yesterday + 5)) == [yesterday - 1]
+        assert db.get_task_bitmap(task["id"]).days(yesterday - 5, yesterday + 5) == [yesterday - 1]
+
+        with pytest.raises(ValueError):
+            db.update_day_start_hour(24)
+
+    def test_today_queries_use_logical_day(self, db):
+        from database.models import TaskRecord
+        from services.constants import day_to_date
+        db.update_day_start_hour(23)
+        task = db.create_task("早起", "positive", spirit_effect=1)
+        record = db.add_task_record(task["id"], "早起", 1, 0)
+        # 23 点换日：日历上“昨天 23:30”属于当前逻辑日
+        today = db.current_day()
+        late = datetime.combine(day_to_date(today), datetime.min.time()).replace(hour=23, minute=30)
+        with db.session_scope() as s:
+            s.query(TaskRecord).filter(TaskRecord.id == record["id"]).update(
+                {TaskRecord.completed_at: late, TaskRecord.day: today})
+        assert [r["id"] for r in db.get_today_records()] == [record["id"]]
+        assert db.get_task_today_count(task["id"]) == 1
+        assert db.get_today_task_counts() == {task["id"]: 1}
+        assert db.undo_task_record(record["id"]) is not None
+
+    def test_daily_spirit_and_window_stats(self, db):
+        read = db.create_task("读书", "positive", spirit_effect=3)
+        phone = db.create_task("刷手机", "demon", spirit_effect=-2)
+        db.add_task_record(read["id"], "读书", 3, 0)
+        db.add_task_record(read["id"], "读书", 3, 0)
+        db.add_task_record(phone["id"], "刷手机", -2, 0)
+        undone = db.add_task_record(phone["id"], "刷手机", -2, 0)
+        db.undo_task_record(undone["id"])
+
+        today = db.current_day()
+        assert db.get_daily_spirit(today - 6, today) == {today: {
+            "positive": 6, "demon": 2, "net": 4, "positive_count": 2, "demon_count": 1, "count": 3, "blood": 0}}
+        assert db.get_daily_spirit(today - 6, today - 1) == {}
+
+        stats = db.get_spirit_window_stats(today, [0, 30])
+        assert stats["读书"][30] == {"positive": 6, "demon": 0, "positive_count": 2,
+                                   "demon_count": 0, "count": 2, "blood": 0}
+        assert stats["刷手机"][0]["demon"] == 2 and stats["刷手机"][0]["count"] == 1
 
-    def test_consecutive_streak(self, db):
-        task = db.create_task("冥想", "positive", spirit_effect=1, enable_streak=True)
-        db.update_streak(task["id"])
-        streak = db.get_streak(task["id"])
-        assert streak["current_streak"] == 1
+class TestStreak:
+    """连续打卡的数据来源：每个任务有记录的日子"""
+
+    def test_completion_days(self, db):
+        from sqlalchemy import text
+        a = db.create_task("冥想", "positive", spirit_effect=1, enable_streak=True)
+        b = db.create_task("跑步", "positive", spirit_effect=1, enable_streak=True)
+        today = db.current_day()
+        db.add_task_record(b["id"], "跑步", 1, 0)
+        db.add_task_record(a["id"], "冥想", 1, 0)
+        db.add_task_record(a["id"], "冥想", 1, 0)
+        undone = db.add_task_record(b["id"], "跑步", 1, 0)
+        db.undo_task_record(undone["id"])
+        with db.session_scope() as s:
+            s.execute(text("UPDATE task_records SET day = day - 3 WHERE id = 1"))
+        assert db.get_completion_days() == [(a["id"], today), (b["id"], today - 3)]
+        assert db.get_completion_days(today) == [(a["id"], today)]
+        plain = db.create_task("喝水", "positive", spirit_effect=1)
+        db.add_task_record(plain["id"], "喝水", 1, 0)
+        assert (plain["id"], today) in db.get_completion_days(today)
+        assert db.get_completion_days(today, streak_only=True) == [(a["id"], today)]
 
 
 class TestRealm:
@@ -218,6 +509,62 @@ class TestRealm:
         active = db.get_active_realm()
         assert active is None
 
+    def test_progress_counters_maintained(self, db):
+        import random
+        rng = random.Random(7)
+        realm = db.create_realm("练气期")
+        skills = [db.create_skill(realm["id"], f"技能{i}")["id"] for i in range(5)]
+        subs = []
+        for _ in range(200):
+            op = rng.random()
+            if op < 0.35 or not subs:
+                subs.append(db.create_sub_task(rng.choice(skills), "子任务")["id"])
+            elif op < 0.65:
+                db.complete_sub_task(rng.choice(subs))
+            elif op < 0.85:
+                db.uncomplete_sub_task(rng.choice(subs))
+            else:
+                db.delete_sub_task(subs.pop(rng.randrange(len(subs))))
+        db.delete_skill(skills[0])
+        assert db.reconcile_realm_counters() == []
+
+        tree = db.get_active_realm()
+        actual_total = sum(len(sk["sub_tasks"]) for sk in tree["skills"])
+        actual_done = sum(st["is_completed"] for sk in tree["skills"] for st in sk["sub_tasks"])
+        assert tree["total_skills"] == 4
+        assert tree["total_sub_tasks"] == actual_total
+        assert tree["completed_sub_tasks"] == actual_done
+        for sk in tree["skills"]:
+            assert sk["total_sub_tasks"] == len(sk["sub_tasks"])
+
+    def test_progress_read_is_single_row(self, db):
+        from sqlalchemy import event
+        realm = db.create_realm("练气期")
+        for i in range(20):
+            sk = db.create_skill(realm["id"], f"技能{i}")
+            db.create_sub_task(sk["id"], "子任务")
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, *args: statements.append(sql))
+        summary = db.get_active_realm(include_skills=False)
+        assert summary["total_sub_tasks"] == 20
+        assert len(statements) == 1
+        assert "FROM sub_tasks" not in statements[0]
+
+    def test_reconcile_detects_and_fixes_drift(self, db):
+        from database.models import Realm, Skill
+        realm = db.create_realm("练气期")
+        sk = db.create_skill(realm["id"], "数学")
+        db.complete_sub_task(db.create_sub_task(sk["id"], "函数")["id"])
+        with db.session_scope() as s:
+            s.query(Skill).filter(Skill.id == sk["id"]).update({Skill.completed_sub_tasks: 0})
+            s.query(Realm).filter(Realm.id == realm["id"]).update({Realm.progress_sum: 0.0})
+        found = {(m["table"], m["field"]) for m in db.reconcile_realm_counters()}
+        assert found == {("skills", "completed_sub_tasks"), ("realms", "progress_sum")}
+        db.reconcile_realm_counters(fix=True)
+        assert db.reconcile_realm_counters() == []
+        assert db.get_active_realm()["avg_progress"] == 100
+
 
 class TestLingshi:
     """灵石系统测试"""
@@ -247,6 +594,65 @@ class TestLingshi:
         txns = db.get_transactions()
         assert len(txns) == 2
 
+    def test_transaction_pages_cover_all_rows_once(self, db):
+        # 同一天多条记录，游标必须带上 id 才不会在页边界重复或漏掉
+        expected = []
+        for i in range(23):
+            txn = db.add_transaction("expense" if i % 3 else "income", i + 1, "餐饮" if i % 2 else "交通",
+                                     transaction_date=date(2026, 3, 1) + timedelta(days=i // 4))
+            expected.append((txn["transaction_date"], txn["id"]))
+        expected.sort(reverse=True)
+
+        seen, cursor, pages = [], None, 0
+        while True:
+            page = db.get_transaction_page(cursor, page_size=5)
+            assert len(page["items"]) <= 5
+            seen += [(t["transaction_date"], t["id"]) for t in page["items"]]
+            pages += 1
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert seen == expected
+        assert pages == 5
+
+    def test_transaction_page_filters(self, db):
+        for i in range(12):
+            db.add_transaction("expense" if i % 2 else "income", 10, "餐饮" if i % 4 == 1 else "其他",
+                               transaction_date=date(2026, 4, 1 + i))
+        page = db.get_transaction_page(page_size=2, type="expense", category="餐饮")
+        assert [t["transaction_date"] for t in page["items"]] == ["2026-04-10", "2026-04-06"]
+        page = db.get_transaction_page(page["next_cursor"], page_size=2, type="expense", category="餐饮")
+        assert [t["transaction_date"] for t in page["items"]] == ["2026-04-02"]
+        assert page["next_cursor"] is None
+
+        page = db.get_transaction_page(page_size=50, start_date=date(2026, 4, 3), end_date=date(2026, 4, 5))
+        assert [t["transaction_date"] for t in page["items"]] == ["2026-04-05", "2026-04-04", "2026-04-03"]
+
+    def test_deep_transaction_page_reads_one_page(self, db):
+        from sqlalchemy import event
+        for i in range(200):
+            db.add_transaction("expense", 1, "餐饮", transaction_date=date(2026, 1, 1) + timedelta(days=i // 10))
+        cursor = None
+        for _ in range(15):
+            cursor = db.get_transaction_page(cursor, page_size=10)["next_cursor"]
+
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, params, *args: statements.append((sql, params)))
+        page = db.get_transaction_page(cursor, page_size=10)
+        assert len(page["items"]) == 10
+        sql, params = statements[-1]
+        assert "OFFSET" not in sql or params[-1] == 0
+        assert params[-2] == 11  # LIMIT page_size + 1
+
+    def test_transaction_day_column(self, db):
+        from database.models import Transaction
+        from services.constants import epoch_day
+        txn = db.add_transaction("expense", 20, "餐饮", transaction_date=date(2026, 3, 31))
+        db.update_transaction(txn["id"], transaction_date=date(2026, 4, 2))
+        with db.session_scope() as s:
+            assert s.query(Transaction.day).scalar() == epoch_day(date(2026, 4, 2))
+
     def test_budget(self, db):
         db.set_budget("餐饮", 2000, "2026-02")
         db.set_budget("交通", 500, "2026-02")
@@ -260,6 +666,63 @@ class TestLingshi:
         debts = db.get_debts()
         assert len(debts) == 1
 
+    def test_balance_ledger_follows_writes(self, db):
+        import random
+        rng = random.Random(11)
+        ids = []
+        for _ in range(300):
+            if rng.random() < 0.7 or not ids:
+                txn = db.add_transaction(rng.choice(["income", "expense"]), rng.randint(1, 10_000) / 100, "其他")
+                ids.append(txn["id"])
+            elif rng.random() < 0.5:
+                db.update_transaction(rng.choice(ids), type=rng.choice(["income", "expense"]),
+                                      amount=rng.randint(1, 10_000) / 100)
+            else:
+                db.delete_transaction(ids.pop(rng.randrange(len(ids))))
+        report = db.verify_balance()
+        assert report["ok"] is True
+        assert report["last_verified_at"] is not None
+        balance = db.get_balance()
+        assert balance["income"] == pytest.approx(report["actual"]["income"])
+        assert balance["expense"] == pytest.approx(report["actual"]["expense"])
+
+    def test_balance_read_is_single_row(self, db):
+        from sqlalchemy import event
+        for _ in range(50):
+            db.add_transaction("income", 100, "工资")
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, *args: statements.append(sql))
+        assert db.get_balance()["balance"] == 5000
+        assert len(statements) == 1
+        assert "FROM transactions" not in statements[0]
+
+    def test_balance_checkpoints_written_periodically(self, db):
+        from database.db_manager import BALANCE_CHECKPOINT_EVERY
+        from database.models import BalanceCheckpoint
+        for _ in range(BALANCE_CHECKPOINT_EVERY * 2 + 1):
+            db.add_transaction("expense", 1, "餐饮")
+        with db.session_scope() as s:
+            seqs = [c.change_seq for c in s.query(BalanceCheckpoint).order_by(BalanceCheckpoint.id)]
+        assert seqs == [BALANCE_CHECKPOINT_EVERY, BALANCE_CHECKPOINT_EVERY * 2]
+
+    def test_verify_balance_detects_and_fixes_drift(self, db):
+        from database.models import BalanceLedger
+        db.add_transaction("income", 500, "工资")
+        db.add_transaction("expense", 120, "餐饮")
+        with db.session_scope() as s:
+            s.query(BalanceLedger).update({BalanceLedger.expense_total: 100})
+        report = db.verify_balance()
+        assert report["ok"] is False
+        assert report["ledger"]["expense"] == 100
+        assert report["actual"]["expense"] == 120
+        assert report["last_verified_at"] is None
+        assert db.get_balance()["balance"] == 400  # 未修正
+
+        assert db.verify_balance(fix=True)["ok"] is False
+        assert db.get_balance()["balance"] == 380
+        assert db.verify_balance()["ok"] is True
+
 
 class TestTongyu:
     """统御系统测试"""
@@ -314,3 +777,144 @@ class TestAIConfig:
         db.save_ai_config("qianwen", api_key="sk-2")
         config = db.get_active_ai_config()
         assert config["provider"] == "qianwen"
+
+
+class TestStorageProfile:
+    """存储配置（PRAGMA）测试"""
+
+    @staticmethod
+    def _pragma(db, name):
+        from sqlalchemy import text
+        with db.engine.connect() as conn:
+            return conn.execute(text(f"PRAGMA {name}")).scalar()
+
+    @pytest.mark.parametrize("profile", ["mobile", "desktop", "server"])
+    def test_profile_applied(self, tmp_path, profile):
+        from database.storage import STORAGE_PROFILES
+        manager = DatabaseManager(str(tmp_path / "app.db"), profile=profile)
+        expected = STORAGE_PROFILES[profile]
+        assert self._pragma(manager, "journal_mode") == "wal"
+        assert self._pragma(manager, "synchronous") == 1  # NORMAL
+        assert self._pragma(manager, "busy_timeout") == expected["busy_timeout"]
+        assert self._pragma(manager, "cache_size") == expected["cache_size"]
+        assert self._pragma(manager, "temp_store") == 2  # MEMORY
+
+    def test_compat_keeps_sqlite_defaults(self, tmp_path):
+        manager = DatabaseManager(str(tmp_path / "app.db"), profile="compat")
+        assert self._pragma(manager, "journal_mode") == "delete"
+        assert self._pragma(manager, "synchronous") == 2  # FULL
+
+    def test_unknown_profile(self, tmp_path):
+        with pytest.raises(ValueError):
+            DatabaseManager(str(tmp_path / "app.db"), profile="turbo")
+
+    def test_checkpoint_before_backup(self, tmp_path):
+        manager = DatabaseManager(str(tmp_path / "app.db"), profile="desktop")
+        manager.init_user_config(1998)
+        manager.checkpoint()
+        # 只拷贝主库文件（不带 -wal），数据必须完整
+        import shutil
+        shutil.copy2(tmp_path / "app.db", tmp_path / "backup.db")
+        copy = DatabaseManager(str(tmp_path / "backup.db"), profile="compat")
+        assert copy.get_user_config()["birth_year"] == 1998
+
+
+class TestEngineRegistry:
+    """进程级 engine 共享测试"""
+
+    def test_same_path_shares_engine(self, tmp_path):
+        path = str(tmp_path / "app.db")
+        a = DatabaseManager(path)
+        b = DatabaseManager(path)
+        assert a.engine is b.engine
+        assert a.SessionFactory is b.SessionFactory
+        a.init_user_config(1998)
+        assert b.get_user_config()["birth_year"] == 1998
+
+    def test_memory_not_shared(self):
+        a = DatabaseManager(":memory:")
+        b = DatabaseManager(":memory:")
+        assert a.engine is not b.engine
+
+    def test_schema_initialized_once(self, tmp_path, monkeypatch):
+        calls = []
+        original = DatabaseManager._init_schema
+        monkeypatch.setattr(DatabaseManager, "_init_schema",
+                            lambda self: (calls.append(1), original(self)))
+        path = str(tmp_path / "app.db")
+        managers = [DatabaseManager(path) for _ in range(5)]
+        assert len(calls) == 1
+        assert len({id(m.engine) for m in managers}) == 1
+
+    def test_refcount_and_dispose(self, tmp_path):
+        from database.storage import engine_registry
+        import os
+        path = str(tmp_path / "app.db")
+        key = os.path.realpath(path)
+        a = DatabaseManager(path)
+        b = DatabaseManager(path)
+        a.close()
+        a.close()  # 重复调用无副作用
+        assert key in engine_registry.active_paths()
+        b.close()
+        assert key not in engine_registry.active_paths()
+        # 释放后重新打开得到新的 engine
+        c = DatabaseManager(path)
+        assert c.engine is not a.engine
+
+    def test_profile_mismatch(self, tmp_path):
+        path = str(tmp_path / "app.db")
+        keep = DatabaseManager(path, profile="server")
+        with pytest.raises(ValueError):
+            DatabaseManager(path, profile="mobile")
+        keep.close()
+
+
+class TestUnitOfWork:
+    """一次操作一个 session、一次提交"""
+
+    def test_methods_join_outer_session(self, db):
+        task = db.create_task("早起", "positive", spirit_effect=3)
+        with db.unit_of_work() as s:
+            with db.session_scope() as inner:
+                assert inner is s
+            db.add_task_record(task["id"], task["name"], spirit_change=3, blood_change=0)
+            # 未提交前同一事务内可见
+            assert db.get_user_config()["current_spirit"] == 3
+            assert db.is_task_completed_today(task["id"])
+        assert db.get_user_config()["current_spirit"] == 3
+
+    def test_single_commit(self, tmp_path):
+        from sqlalchemy import event
+        db = DatabaseManager(str(tmp_path / "app.db"))
+        db.init_user_config(1998)
+        task = db.create_task("冥想", "positive", spirit_effect=1, enable_streak=True)
+        commits = []
+        event.listen(db.engine, "commit", lambda conn: commits.append(1))
+        with db.unit_of_work():
+            db.get_user_config()
+            db.add_task_record(task["id"], task["name"], spirit_change=1, blood_change=0)
+            db.update_spirit(1)
+        assert len(commits) == 1
+        db.close()
+
+    def test_exception_rolls_back_everything(self, db):
+        task = db.create_task("早起", "positive", spirit_effect=3)
+        with pytest.raises(RuntimeError):
+            with db.unit_of_work():
+                db.add_task_record(task["id"], task["name"], spirit_change=3, blood_change=0)
+                db.update_spirit(1)
+                raise RuntimeError("boom")
+        assert db.get_user_config()["current_spirit"] == 0
+        assert db.get_today_records() == []
+        assert db.get_completion_days() == []
+
+    def test_nested_unit_of_work(self, db):
+        with db.unit_of_work() as outer:
+            with db.unit_of_work() as inner:
+                assert inner is outer
+            db.update_spirit(2)
+        assert db.get_user_config()["current_spirit"] == 2
+        # 退出后恢复为独立 session
+        with db.session_scope() as s:
+            assert s is not outer
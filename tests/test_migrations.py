@@ -0,0 +1,306 @@
+"""
+数据库迁移测试 — 从每个历史 schema 升级到最新版本，结果必须与 models.py 一致
+"""
+import sys
+import os
+import re
+import sqlite3
+import pytest
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from database.db_manager import DatabaseManager
+from database.models import Base
+from database.migrations import (
+    MIGRATIONS, LATEST_VERSION, _BASELINE_DDL, migrate, get_schema_version,
+)
+
+
+def _engine(path):
+    return create_engine(f"sqlite:///{path}", poolclass=StaticPool)
+
+
+def _schema(path) -> dict:
+    """{table: {"columns": {name: (type, notnull, pk)}, "indexes": {name: (unique, cols)}}}"""
+    conn = sqlite3.connect(path)
+    try:
+        result = {}
+        tables = [r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+        for t in tables:
+            cols = {r[1]: (r[2].upper(), r[3], r[5]) for r in conn.execute(f"PRAGMA table_info({t})")}
+            indexes = {}
+            for r in conn.execute(f"PRAGMA index_list({t})"):
+                if r[1].startswith("sqlite_autoindex"):
+                    continue
+                idx_cols = tuple(c[2] for c in conn.execute(f"PRAGMA index_info({r[1]})"))
+                indexes[r[1]] = (r[2], idx_cols)
+            result[t] = {"columns": cols, "indexes": indexes}
+        return result
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def models_schema(tmp_path):
+    """models.py 直接建表得到的 schema（最新版本应与之一致）"""
+    path = str(tmp_path / "models.db")
+    engine = _engine(path)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    return _schema(path)
+
+
+def _legacy_pre_personality(cursor):
+    """最早的库：people 没有 personality，relationship_events 没有 is_completed"""
+    for ddl in _BASELINE_DDL:
+        ddl = re.sub(r"\s*personality TEXT,", "", ddl)
+        ddl = re.sub(r"\s*is_completed BOOLEAN,(?=\s*created_at DATETIME,\s*PRIMARY KEY \(id\),\s*FOREIGN KEY\(person_id\))", "", ddl)
+        cursor.execute(ddl)
+
+
+def _legacy_unversioned(cursor):
+    """引入版本号之前的库：表结构完整，但 user_version = 0"""
+    for ddl in _BASELINE_DDL:
+        cursor.execute(ddl)
+
+
+def _seed(path):
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO user_config (birth_year, initial_blood, current_blood, current_spirit, target_money) "
+                 "VALUES (1998, 100, 100, 7, 5000000)")
+    conn.execute("INSERT INTO people (name, relationship_type, is_active) VALUES ('张三', '朋友', 1)")
+    conn.commit()
+    conn.close()
+
+
+def _historical_builders():
+    builders = [("legacy_pre_personality", _legacy_pre_personality),
+                ("legacy_unversioned", _legacy_unversioned)]
+    for number, desc, _ in MIGRATIONS[:-1]:
+        builders.append((f"v{number}", number))
+    return builders
+
+
+@pytest.mark.parametrize("name,builder", _historical_builders(), ids=lambda v: v if isinstance(v, str) else None)
+def test_upgrade_from_historical_schema(tmp_path, models_schema, name, builder):
+    path = str(tmp_path / "old.db")
+    if isinstance(builder, int):
+        engine = _engine(path)
+        assert migrate(engine, target=builder) == builder
+        engine.dispose()
+    else:
+        conn = sqlite3.connect(path)
+        builder(conn.cursor())
+        conn.commit()
+        conn.close()
+    _seed(path)
+
+    engine = _engine(path)
+    assert migrate(engine) == LATEST_VERSION
+    assert get_schema_version(engine) == LATEST_VERSION
+    engine.dispose()
+
+    assert _schema(path) == models_schema
+
+    # 数据保留，且能被 DatabaseManager 正常读写
+    db = DatabaseManager(path)
+    assert db.get_user_config()["current_spirit"] == 7
+    person = db.get_people()[0]
+    db.add_event(person["id"], date.today(), "吃饭")
+    assert db.get_events(person["id"])[0]["is_completed"] is False
+    db.close()
+
+
+def test_realm_counters_backfilled(tmp_path):
+    path = str(tmp_path / "v1.db")
+    engine = _engine(path)
+    migrate(engine, target=1)
+    engine.dispose()
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO realms (id, name, status, realm_type, completion_rate) VALUES (1, '练气期', 'active', 'main', 100)")
+    conn.execute("INSERT INTO skills (id, realm_id, name, is_completed) VALUES (1, 1, '数学', 0), (2, 1, '英语', 1)")
+    conn.execute("INSERT INTO sub_tasks (skill_id, name, is_completed) VALUES (1, 'a', 1), (1, 'b', 0), (1, 'c', 1)")
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager(path)
+    assert db.reconcile_realm_counters() == []
+    realm = db.get_active_realm(include_skills=False)
+    assert (realm["total_skills"], realm["total_sub_tasks"], realm["completed_sub_tasks"]) == (2, 3, 2)
+    # 数学 2/3，英语无子任务但已完成记 1
+    assert realm["avg_progress"] == pytest.approx((2 / 3 + 1) / 2 * 100)
+    db.close()
+
+
+def test_transaction_rollups_and_balance_backfilled(tmp_path):
+    path = str(tmp_path / "v2.db")
+    engine = _engine(path)
+    migrate(engine, target=2)
+    engine.dispose()
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO transactions (type, amount, category, transaction_date) VALUES (?, ?, ?, ?)", [
+        ("expense", 30.5, "餐饮", "2026-02-01"), ("expense", 19.5, "餐饮", "2026-02-28"),
+        ("expense", 8, "交通", "2026-03-01"), ("income", 9000, "工资", "2026-02-10"),
+    ])
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager(path)
+    assert db.get_balance() == {"income": 9000.0, "expense": 58.0, "balance": 8942.0}
+    assert db.verify_balance()["ok"] is True
+    feb = {(r["type"], r["category"]): (r["total"], r["count"]) for r in db.get_month_rollups("2026-02")}
+    assert feb == {("expense", "餐饮"): (50.0, 2), ("income", "工资"): (9000.0, 1)}
+    assert db.get_month_rollups("2026-03", type="expense") == [
+        {"type": "expense", "category": "交通", "total": 8.0, "count": 1}]
+    db.close()
+
+
+def test_epoch_day_columns_backfilled(tmp_path):
+    from services.constants import epoch_day
+    path = str(tmp_path / "v5.db")
+    engine = _engine(path)
+    migrate(engine, target=5)
+    engine.dispose()
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO user_config (birth_year, initial_blood, current_blood, current_spirit, target_money) "
+                 "VALUES (1998, 100, 100, 0, 5000000)")
+    conn.execute("INSERT INTO tasks (id, name, task_type, spirit_effect, blood_effect) VALUES (1, '早起', 'positive', 2, 0)")
+    conn.executemany("INSERT INTO task_records (task_id, task_name, spirit_change, blood_change, is_undo, completed_at) "
+                     "VALUES (1, '早起', ?, 0, 0, ?)", [(2, "2026-03-01 23:59:59.999999"), (3, "2026-03-02 00:00:00")])
+    conn.execute("INSERT INTO transactions (type, amount, category, transaction_date) VALUES ('expense', 5, '餐饮', '2026-03-02')")
+    conn.execute("INSERT INTO people (id, name, relationship_type, is_active) VALUES (1, '张三', '朋友', 1)")
+    conn.execute("INSERT INTO relationship_events (person_id, event_date, event_description) VALUES (1, '2026-03-05', '吃饭')")
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager(path)
+    mar1 = epoch_day(date(2026, 3, 1))
+    assert {d: v["net"] for d, v in db.get_daily_spirit(mar1 - 1, mar1 + 1).items()} == {mar1: 2, mar1 + 1: 3}
+    assert db.get_user_config()["day_start_hour"] == 0
+    assert db.get_event_activity(epoch_day(date(2026, 3, 5))) == {"events": 1, "people": 1}
+    assert db.get_event_activity(epoch_day(date(2026, 3, 6))) == {"events": 0, "people": 0}
+    with db.session_scope() as s:
+        assert s.execute(text("SELECT day FROM transactions")).scalar() == mar1 + 1
+    db.close()
+
+
+def test_vital_snapshot_seeded_from_current_values(tmp_path):
+    path = str(tmp_path / "v7.db")
+    engine = _engine(path)
+    migrate(engine, target=7)
+    engine.dispose()
+    _seed(path)
+
+    db = DatabaseManager(path)
+    from services.vitals_replay import VitalsReplay
+    from datetime import datetime
+    assert VitalsReplay(db).state_at(datetime.now()) == {"spirit": 7, "blood": 100}
+    db.close()
+
+
+def test_score_candles_backfilled(tmp_path):
+    from datetime import timedelta
+    path = str(tmp_path / "v8.db")
+    engine = _engine(path)
+    migrate(engine, target=8)
+    engine.dispose()
+    conn = sqlite3.connect(path)
+    # 2025-12-29（周一）起 40 天，跨周、跨月、跨季、跨年
+    start = date(2025, 12, 29)
+    conn.executemany("INSERT INTO daily_scores (score_date, open_spirit, close_spirit, high_spirit, low_spirit, change_count) "
+                     "VALUES (?, ?, ?, ?, ?, ?)",
+                     [((start + timedelta(days=i)).isoformat(), i, i + 3, i + 5, i - 2, i % 4) for i in range(0, 40, 3)])
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager(path)
+    migrated = {span: db.get_score_candles(span, start, date(2026, 12, 31))
+                for span in ("week", "month", "quarter", "year")}
+    # 与运行时逐级合成的结果一致
+    with db.session_scope() as s:
+        db._refresh_candles(s, start, start + timedelta(days=40))
+    for span, candles in migrated.items():
+        assert candles == db.get_score_candles(span, start, date(2026, 12, 31))
+    assert [c["period_start"] for c in migrated["year"]] == [date(2025, 1, 1), date(2026, 1, 1)]
+    assert migrated["week"][0] == {
+        "span": "week", "period_start": start, "open_spirit": 0, "close_spirit": 9,
+        "high_spirit": 11, "low_spirit": -2, "change_count": 0 + 3 + 2, "day_count": 3}
+    db.close()
+
+
+def test_task_bitmaps_backfilled(tmp_path):
+    path = str(tmp_path / "v9.db")
+    engine = _engine(path)
+    migrate(engine, target=9)
+    engine.dispose()
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO tasks (id, name, task_type, spirit_effect, blood_effect) VALUES (1, '早起', 'positive', 1, 0)")
+    conn.executemany("INSERT INTO task_records (task_id, task_name, spirit_change, blood_change, is_undo, day) "
+                     "VALUES (1, '早起', 1, 0, ?, ?)", [(0, 20000), (0, 20003), (1, 20004), (0, 20003)])
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager(path)
+    bitmap = db.get_task_bitmap(1)
+    assert bitmap.days(0, 30000) == [20000, 20003]
+    assert db.get_completion_rate(1, 20000, 20003) == 0.5
+    assert not db.get_task_bitmap(2)
+    db.close()
+
+
+def test_fresh_database_matches_models(tmp_path, models_schema):
+    path = str(tmp_path / "fresh.db")
+    db = DatabaseManager(path)
+    assert get_schema_version(db.engine) == LATEST_VERSION
+    db.close()
+    assert _schema(path) == models_schema
+
+
+def test_current_schema_only_reads_version(tmp_path):
+    path = str(tmp_path / "app.db")
+    engine = _engine(path)
+    migrate(engine)
+
+    statements = []
+    raw = engine.raw_connection()
+    raw.driver_connection.set_trace_callback(statements.append)
+    raw.close()
+    assert migrate(engine) == LATEST_VERSION
+    assert statements == ["PRAGMA user_version"]
+    engine.dispose()
+
+
+def test_failed_migration_rolls_back(tmp_path, monkeypatch):
+    from database import migrations
+
+    def broken(cursor):
+        cursor.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", MIGRATIONS + [(LATEST_VERSION + 1, "broken", broken)])
+    monkeypatch.setattr(migrations, "LATEST_VERSION", LATEST_VERSION + 1)
+    path = str(tmp_path / "app.db")
+    engine = _engine(path)
+    with pytest.raises(RuntimeError):
+        migrations.migrate(engine, target=LATEST_VERSION + 1)
+    engine.dispose()
+
+    # 整个事务回滚：连基线表都不存在，版本号仍为 0
+    schema = _schema(path)
+    assert "half_done" not in schema
+    assert "user_config" not in schema
+    assert get_schema_version(_engine(path)) == 0
+
+
+def test_newer_database_rejected(tmp_path):
+    path = str(tmp_path / "future.db")
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA user_version = {LATEST_VERSION + 1}")
+    conn.close()
+    with pytest.raises(RuntimeError):
+        migrate(_engine(path))
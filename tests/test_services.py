@@ -120,12 +120,458 @@ class TestSpiritService:
         assert stats["positive_total"] == 5
         assert stats["positive_count"] == 1
 
+    def test_stats_engine_queries_once_for_all_windows(self, spirit, db):
+        from sqlalchemy import event
+        good = spirit.create_positive_task("早起", spirit_effect=5, blood_effect=2)
+        bad = spirit.create_demon_task("刷手机", spirit_effect=3)
+        spirit.complete_daily_task(good["id"])
+        spirit.record_demon(bad["id"])
+        spirit.record_demon(bad["id"])
+
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, *args: statements.append(sql))
+        summary = spirit.get_today_summary()
+        week = spirit.get_statistics(7)
+        month = spirit.get_statistics(30)
+        top = spirit.get_task_trigger_counts(30)
+        # 一条按日汇总（前缀和序列），一条按任务排行；之后的窗口都从缓存切片
+        assert len([sql for sql in statements if "task_records" in sql]) == 2
+        spirit.get_statistics(365)
+        assert len([sql for sql in statements if "task_records" in sql]) == 2
+
+        assert summary == {"positive_count": 1, "demon_count": 2, "total_spirit_change": -1,
+                           "total_blood_change": 2, "total_records": 3}
+        assert week["net_spirit"] == month["net_spirit"] == -1
+        assert top == [{"name": "刷手机", "count": 2, "spirit": -6}, {"name": "早起", "count": 1, "spirit": 5}]
+
+    def test_stats_cached_until_record_write(self, spirit, db):
+        from sqlalchemy import event
+        task = spirit.create_demon_task("刷手机", spirit_effect=3)
+        first = spirit.record_demon(task["id"])
+        assert spirit.get_today_summary()["demon_count"] == 1
+
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, *args: statements.append(sql))
+        spirit.get_statistics(7)
+        db.add_transaction("expense", 10, "餐饮")  # 非任务记录的写入不影响缓存
+        spirit.get_today_summary()
+        assert not any("task_records" in sql for sql in statements)
+
+        spirit.record_demon(task["id"])
+        assert spirit.get_today_summary()["demon_count"] == 2
+        spirit.undo_task(first["record"]["id"])
+        assert spirit.get_today_summary()["demon_count"] == 1
+        # 其他服务实例的写入同样让缓存失效
+        other = SpiritService(db)
+        other.record_demon(task["id"])
+        assert spirit.get_statistics(7)["demon_count"] == 2
+
+    @staticmethod
+    def _insert_history(db, rows):
+        """直接写入历史任务记录 [(day, spirit_change, blood_change)]"""
+        from database.models import TaskRecord
+        task = db.create_task("历史", "positive", spirit_effect=1)
+        with db.session_scope() as s:
+            s.add_all([TaskRecord(task_id=task["id"], task_name="历史", spirit_change=sc, blood_change=bc,
+                                  is_undo=False, day=day) for day, sc, bc in rows])
+            db._touch_records(s, min(day for day, _, _ in rows))
+
+    def test_range_statistics_prefix_sums(self, spirit, db):
+        import random
+        from services.constants import day_to_date
+        rng = random.Random(16)
+        today = db.current_day()
+        rows = [(today - rng.randrange(30_000), rng.randint(-5, 5), rng.randint(-3, 3)) for _ in range(3000)]
+        self._insert_history(db, rows)
+
+        for _ in range(50):
+            a, b = sorted(rng.randrange(today - 31_000, today + 10) for _ in range(2))
+            picked = [r for r in rows if a <= r[0] <= b]
+            stats = spirit.get_range_statistics(day_to_date(a), day_to_date(b))
+            assert stats["positive_total"] == sum(sc for _, sc, _ in picked if sc > 0)
+            assert stats["demon_total"] == sum(-sc for _, sc, _ in picked if sc < 0)
+            assert stats["positive_count"] == sum(1 for _, sc, _ in picked if sc > 0)
+            assert stats["net_spirit"] == sum(sc for _, sc, _ in picked)
+            assert stats["blood_change"] == sum(bc for _, _, bc in picked)
+
+        trend = spirit.get_spirit_trend(30)
+        assert [t["change"] for t in trend] == [
+            sum(sc for day, sc, _ in rows if day == d) for d in range(today - 29, today + 1)]
+
+    def test_series_recomputes_only_changed_days(self, spirit, db, monkeypatch):
+        today = db.current_day()
+        self._insert_history(db, [(today - 1000, 4, 0), (today - 10, 2, 0)])
+        assert spirit.get_statistics(2000)["positive_total"] == 6
+
+        calls = []
+        original = db.get_daily_spirit
+        monkeypatch.setattr(db, "get_daily_spirit", lambda start, end: calls.append(start) or original(start, end))
+        self._insert_history(db, [(today - 20, 7, 0)])
+        assert spirit.get_statistics(2000)["positive_total"] == 13
+        assert spirit.get_statistics(15)["positive_total"] == 2
+        assert calls == [today - 20]
+
+        # 早于序列起点的记录需要整体重建
+        self._insert_history(db, [(today - 5000, 1, 0)])
+        assert spirit.get_statistics(6000)["positive_total"] == 14
+        assert calls[-1] is None
+
+    def test_replay_clamps_each_event(self, spirit, db):
+        from database.models import TaskRecord
+        from services.constants import SPIRIT_MAX, clamp_spirit, day_to_date
+        task = db.create_task("历史", "positive", spirit_effect=1)
+        today = db.current_day()
+        # 先连续冲到上限再回落：若按日净变化从当前值反推，饱和的部分会算错
+        changes = [(today - 3, 300), (today - 3, 300), (today - 2, 300), (today - 2, -100), (today - 1, -50)]
+        with db.session_scope() as s:
+            for i, (day, change) in enumerate(changes):
+                moment = datetime.combine(day_to_date(day), datetime.min.time()) + timedelta(hours=9, minutes=i)
+                s.add(TaskRecord(task_id=task["id"], task_name="历史", spirit_change=change, blood_change=0,
+                                 is_undo=False, day=day, completed_at=moment))
+            db._touch_records(s, today - 3)
+            db._invalidate_vital_snapshots(s, datetime.combine(day_to_date(today - 3), datetime.min.time()))
+
+        expected, value = [], 0
+        for d in range(today - 4, today + 1):
+            for day, change in changes:
+                if day == d:
+                    value = clamp_spirit(value + change)
+            expected.append(value)
+        assert expected[-1] == SPIRIT_MAX - 150
+        assert [t["value"] for t in spirit.get_spirit_trend(5)] == expected
+
+        bars = spirit.replay.replay(today - 2, today - 2)
+        assert bars == [{"day": today - 2, "open": 600, "high": SPIRIT_MAX, "low": SPIRIT_MAX - 100,
+                         "close": SPIRIT_MAX - 100, "blood": db.get_user_config()["initial_blood"], "changes": 2}]
+        noon = datetime.combine(day_to_date(today - 3), datetime.min.time()) + timedelta(hours=9, seconds=30)
+        assert spirit.get_spirit_at(noon)["spirit"] == 300
+
+    def test_snapshots_anchor_replay(self, spirit, db, monkeypatch):
+        import database.db_manager as dbm
+        from database.models import VitalSnapshot
+        monkeypatch.setattr(dbm, "VITAL_SNAPSHOT_EVERY", 5)
+        task = spirit.create_positive_task("冥想", spirit_effect=3, blood_effect=1)
+        for _ in range(12):
+            db.add_task_record(task["id"], "冥想", 3, 1)
+        with db.session_scope() as s:
+            assert [v.record_id for v in s.query(VitalSnapshot).filter(VitalSnapshot.record_id > 0)] == [5, 10]
+
+        # 不经任务记录的变化（境界奖励）和撤销都会留下快照，回放结果与存储值一致
+        db.update_spirit(600)
+        record = db.add_task_record(task["id"], "冥想", 3, 1)
+        spirit.undo_task(record["id"])
+        config = db.get_user_config()
+        now = spirit.get_spirit_at(datetime.now())
+        assert (now["spirit"], now["blood"]) == (config["current_spirit"], config["current_blood"])
+        assert spirit.get_spirit_trend(1)[-1]["value"] == config["current_spirit"]
+
     def test_streak_tracking(self, spirit):
         task = spirit.create_positive_task("冥想", spirit_effect=1, enable_streak=True)
         result = spirit.complete_daily_task(task["id"])
         assert result["streak"] is not None
         assert result["streak"]["current_streak"] == 1
 
+    def test_task_board(self, spirit):
+        daily = spirit.create_positive_task("早起", spirit_effect=5, enable_streak=True)
+        rep = spirit.create_positive_task("冥想", spirit_effect=1, submission_type="repeatable")
+        spirit.create_positive_task("读书", spirit_effect=2)
+        spirit.complete_daily_task(daily["id"])
+        spirit.complete_repeatable_task(rep["id"])
+        spirit.complete_repeatable_task(rep["id"])
+        board = {t["name"]: t for t in spirit.get_task_board("positive")}
+        assert board["早起"]["completed"] is True
+        assert board["早起"]["streak"]["current_streak"] == 1
+        assert board["冥想"]["completed"] is False  # 可重复任务不算“已完成”
+        assert board["冥想"]["today_count"] == 2
+        assert board["读书"]["completed"] is False
+        assert board["读书"]["streak"] is None
+
+    def test_task_board_query_count_constant(self, spirit, db):
+        from sqlalchemy import event
+        for i in range(30):
+            task = spirit.create_positive_task(f"习惯{i}", spirit_effect=1, enable_streak=True)
+            spirit.complete_daily_task(task["id"])
+        db.get_user_config()  # 打卡改过配置，先让缓存重新读入
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, *args: statements.append(sql))
+        board = spirit.get_task_board("positive")
+        assert len(board) == 30
+        assert len(statements) == 2  # 任务、今日次数；连续打卡在打卡时已读入缓存
+
+    @staticmethod
+    def _insert_days(db, task_id, task_name, days):
+        """直接写入某任务在若干逻辑日的完成记录"""
+        from database.models import TaskRecord
+        from services.constants import day_to_date
+        days = list(days)
+        with db.session_scope() as s:
+            s.add_all([TaskRecord(task_id=task_id, task_name=task_name, spirit_change=1, blood_change=0,
+                                  is_undo=False, day=day,
+                                  completed_at=datetime.combine(day_to_date(day), datetime.min.time()))
+                       for day in days])
+            for day in days:
+                db._mark_completion(s, task_id, day, True)
+            db._touch_records(s, min(days))
+
+    def test_streak_follows_records(self, spirit, db):
+        task = spirit.create_positive_task("冥想", spirit_effect=1, enable_streak=True)
+        other = spirit.create_positive_task("跑步", spirit_effect=1, enable_streak=True)
+        today = db.current_day()
+        # 10 天前到 8 天前连续 3 天，3 天前起（漏了前天）再加上今天
+        self._insert_days(db, task["id"], "冥想", [today - d for d in (10, 9, 8, 3, 1)])
+        self._insert_days(db, other["id"], "跑步", [today - 2])
+        streak = spirit.get_streak(task["id"])
+        assert (streak["current_streak"], streak["max_streak"]) == (1, 3)
+        assert streak["last_completed_date"] == date.today() - timedelta(days=1)
+        assert streak["rates"] == {7: pytest.approx(2 / 7), 30: pytest.approx(5 / 11)}
+        assert spirit.get_streak(other["id"])["current_streak"] == 0  # 昨天没打卡，已断
+        demon = spirit.create_demon_task("熬夜", spirit_effect=1)
+        spirit.record_demon(demon["id"])
+        assert spirit.get_streak(demon["id"]) is None  # 没开连续打卡的任务不跟踪
+
+        result = spirit.complete_daily_task(task["id"])
+        assert (result["streak"]["current_streak"], result["streak"]["max_streak"]) == (2, 3)
+        # 撤销今天：连续天数退回，且读取不写库
+        statements = []
+        from sqlalchemy import event
+        spirit.undo_task(result["record"]["id"])
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, *args: statements.append(sql))
+        assert spirit.get_streak(task["id"])["current_streak"] == 1
+        assert not any(sql.lstrip().upper().startswith(("INSERT", "UPDATE", "DELETE")) for sql in statements)
+
+    def test_streak_engine_incremental_and_rebuild(self, spirit, db):
+        from services.streak_engine import StreakEngine
+        tasks = [spirit.create_positive_task(f"习惯{i}", spirit_effect=1, enable_streak=True) for i in range(3)]
+        today = db.current_day()
+        for i, task in enumerate(tasks):
+            self._insert_days(db, task["id"], task["name"], range(today - 30 * (i + 1), today))
+        engine = spirit.streaks
+        assert {t: s["current_streak"] for t, s in engine.get_all().items()} == {
+            tasks[0]["id"]: 30, tasks[1]["id"]: 60, tasks[2]["id"]: 90}
+
+        reads = []
+        original = db.get_completion_days
+        db.get_completion_days = lambda since=None, **kw: reads.append(since) or original(since, **kw)
+        result = spirit.complete_daily_task(tasks[0]["id"])
+        assert result["streak"]["max_streak"] == 31
+        assert engine.get(tasks[0]["id"])["max_streak"] == 31
+        assert reads == []  # 打卡只是追加，直接接到游程末尾，不重读
+
+        # 撤销属于修改：只从那天起重读
+        spirit.undo_task(result["record"]["id"])
+        assert engine.get(tasks[0]["id"])["max_streak"] == 30
+        assert reads == [today]
+
+        fresh = StreakEngine(db)
+        fresh.rebuild()
+        assert fresh.get_all() == engine.get_all()
+
+    def test_heatmap_counts(self, spirit, db):
+        a = spirit.create_positive_task("冥想", spirit_effect=1)
+        b = spirit.create_positive_task("跑步", spirit_effect=1)
+        today = db.current_day()
+        self._insert_days(db, a["id"], "冥想", [today - 3, today - 1])
+        self._insert_days(db, b["id"], "跑步", [today - 1, today - 400])
+
+        combined = spirit.get_heatmap()
+        assert len(combined["counts"]) == 365
+        assert combined["end"] == date.today()
+        assert combined["counts"][-4:] == [1, 0, 2, 0]
+        assert (combined["max"], combined["active_days"]) == (2, 2)
+        assert spirit.get_heatmap(a["id"])["counts"][-4:] == [1, 0, 1, 0]
+
+        past_year = (date.today() - timedelta(days=400)).year
+        past = spirit.get_heatmap(b["id"], year=past_year)
+        assert past["start"] == date(past_year, 1, 1)
+        assert past["active_days"] == 1
+
+    def test_heatmap_reuses_past_years(self, spirit, db):
+        task = spirit.create_positive_task("冥想", spirit_effect=1)
+        today = db.current_day()
+        self._insert_days(db, task["id"], "冥想", [today - 800, today - 400])
+        last_year = date.today().year - 1
+        before = spirit.get_heatmap(year=last_year)
+
+        reads = []
+        original = db.get_task_bitmaps
+        db.get_task_bitmaps = lambda ids: reads.append(ids) or original(ids)
+        spirit.complete_daily_task(task["id"])
+        # 今天的打卡不影响往年：翻回去不再读位图
+        assert spirit.get_heatmap(year=last_year) == before
+        assert reads == []
+        assert spirit.get_heatmap()["counts"][-1] == 1
+        assert len(reads) == 1
+
+        # 改动落在区间内才重算
+        from services.constants import epoch_day
+        day = next(d for d in (epoch_day(date(last_year, 6, 1)), epoch_day(date(last_year, 6, 2))) if d != today - 400)
+        self._insert_days(db, task["id"], "冥想", [day])
+        assert spirit.get_heatmap(year=last_year)["active_days"] == before["active_days"] + 1
+        assert len(reads) == 2
+
+    def test_backfill_tasks(self, spirit, db):
+        task = spirit.create_positive_task("冥想", spirit_effect=5, enable_streak=True)
+        spirit.get_statistics(7)  # 先把统计缓存建起来，验证补记后会增量刷新
+        today = date.today()
+        days = [today - timedelta(days=d) for d in (3, 2, 1, 1)]
+        result = spirit.backfill_tasks([(task["id"], d) for d in days]
+                                       + [(task["id"], today + timedelta(days=1)), (999, today)])
+        assert result["success"]
+        assert len(result["records"]) == 3 and all(r["is_makeup"] for r in result["records"])
+        assert result["skipped"] == [(task["id"], today - timedelta(days=1)),
+                                     (task["id"], today + timedelta(days=1)), (999, today)]
+        assert result["new_spirit"] == spirit.get_spirit_status()["value"] == 15
+
+        streak = spirit.get_streak(task["id"])
+        assert (streak["current_streak"], streak["max_streak"]) == (3, 3)
+        assert spirit.get_statistics(7)["positive_count"] == 3
+        assert db.get_task_bitmap(task["id"]).count(db.current_day() - 3, db.current_day()) == 3
+        # 已补过的日子再补会被跳过
+        again = spirit.backfill_tasks([(task["id"], today - timedelta(days=2))])
+        assert not again["success"] and len(again["skipped"]) == 1
+
+    def test_backfill_replays_with_clamping(self, spirit, db):
+        from services.kline_service import KlineService
+        kline = KlineService(db)
+        good = spirit.create_positive_task("冥想", spirit_effect=50)
+        demon = spirit.create_demon_task("熬夜", spirit_effect=150)
+        today = date.today()
+        spirit.backfill_tasks([(demon["id"], today - timedelta(days=3))] * 2)  # 0 → -150 → -200（触底）
+        spirit.complete_daily_task(good["id"])                                 # -150
+        db.update_spirit(30)                                                  # 不经任务记录的变化，-120
+        kline.get_today_score()
+
+        # 补在触底之前：50 → -100 → -200 → -150 → -120，当前值不变（直接加会得到 -70）
+        result = spirit.backfill_tasks([(good["id"], today - timedelta(days=5))])
+        assert result["new_spirit"] == spirit.get_spirit_status()["value"] == -120
+        assert db.get_vital_anchor(datetime.now())["spirit"] == -120
+        assert spirit.get_spirit_at(datetime.now())["spirit"] == -120
+
+        # K 线从补记日起修复，与整体重建一致
+        assert kline.get_today_score()["close_spirit"] == -120
+        assert db.get_daily_score(today - timedelta(days=5))["close_spirit"] == 50
+        def ohlc():
+            return [(r["score_date"], r["open_spirit"], r["high_spirit"], r["low_spirit"], r["close_spirit"])
+                    for r in db.get_daily_scores(today - timedelta(days=6), today)]
+        repaired = ohlc()
+        KlineService(db).rebuild()
+        assert ohlc() == repaired
+
+    def test_edit_and_delete_history(self, spirit, db):
+        from services.kline_service import KlineService
+        kline = KlineService(db)
+        good = spirit.create_positive_task("冥想", spirit_effect=50, enable_streak=True)
+        demon = spirit.create_demon_task("熬夜", spirit_effect=150)
+        today = date.today()
+        first, second = spirit.backfill_tasks([(good["id"], today - timedelta(days=7)),
+                                               (good["id"], today - timedelta(days=6))])["records"]
+        spirit.backfill_tasks([(demon["id"], today - timedelta(days=5))] * 2)
+        spirit.complete_daily_task(good["id"])
+        assert spirit.get_spirit_status()["value"] == -150  # 50, 100, -50, -200（触底）, -150
+        assert spirit.get_streak(good["id"])["max_streak"] == 2
+        kline.get_today_score()
+
+        # 改小上周的一条：10, 60, -90, -200, -150，触底吸收了差值（直接相减会得到 -190）
+        result = spirit.edit_task_record(first["id"], spirit_change=10)
+        assert result["success"] and result["record"]["new_spirit"] == -150
+        assert not spirit.edit_task_record(first["id"], spirit_change=-10)["success"]
+        assert not spirit.edit_task_record(first["id"], completed_at=datetime.now() + timedelta(hours=1))["success"]
+        assert spirit.edit_task_record(first["id"], completed_at=datetime.now())["message"] == "该日已完成该任务"
+
+        # 挪到另一天：连续打卡和位图跟着变
+        moved = datetime.combine(today - timedelta(days=2), datetime.min.time()) + timedelta(hours=12)
+        assert spirit.edit_task_record(second["id"], completed_at=moved)["success"]
+        bitmap = db.get_task_bitmap(good["id"])
+        today_day = db.current_day()
+        assert not bitmap.has(today_day - 6) and bitmap.has(today_day - 2)
+        assert spirit.get_streak(good["id"])["max_streak"] == 1
+
+        # 删除：0, -150, -200, -150, -100
+        assert spirit.delete_task_record(first["id"])["result"]["new_spirit"] == -100
+        assert not spirit.delete_task_record(first["id"])["success"]
+        assert not db.get_task_bitmap(good["id"]).has(today_day - 7)
+        assert spirit.get_spirit_status()["value"] == spirit.get_spirit_at(datetime.now())["spirit"] == -100
+
+        def ohlc():
+            return [(r["score_date"], r["open_spirit"], r["high_spirit"], r["low_spirit"], r["close_spirit"])
+                    for r in db.get_daily_scores(today - timedelta(days=8), today)]
+        assert kline.get_today_score()["close_spirit"] == -100
+        repaired = ohlc()
+        KlineService(db).rebuild()
+        assert ohlc() == repaired
+
+    def test_edit_history_replays_from_edit(self, spirit, db):
+        from services.kline_service import KlineService
+        kline = KlineService(db)
+        task = spirit.create_positive_task("冥想", spirit_effect=1, enable_streak=True)
+        today = date.today()
+        records = spirit.backfill_tasks([(task["id"], today - timedelta(days=d)) for d in range(400, 0, -1)])["records"]
+        spirit.get_streak(task["id"])
+        kline.get_today_score()
+
+        reads = []
+        original = db.get_completion_days
+        db.get_completion_days = lambda since=None, **kw: reads.append(since) or original(since, **kw)
+        spirit.edit_task_record(records[-5]["id"], spirit_change=3)
+        assert spirit.get_spirit_status()["value"] == 402
+        assert spirit.get_streak(task["id"])["current_streak"] == 400
+        assert reads == [db.current_day() - 5]  # 连续打卡只重读改动那天起
+        assert kline.repair()["days"] == 6        # K 线只重算改动那天到今天
+
+    def test_reset_all_data_invalidates_derived_caches(self, spirit, db):
+        task = spirit.create_positive_task("冥想", spirit_effect=5, enable_streak=True)
+        spirit.complete_daily_task(task["id"])
+        assert spirit.get_today_summary()["positive_count"] == 1
+        assert spirit.get_streak(task["id"])["current_streak"] == 1
+        assert spirit.get_heatmap()["active_days"] == 1
+
+        db.reset_all_data()
+        db.init_user_config(birth_year=1998)
+        task = spirit.create_positive_task("冥想", spirit_effect=5, enable_streak=True)
+        assert spirit.get_today_summary()["positive_count"] == 0
+        assert spirit.get_streak(task["id"]) is None
+        assert spirit.get_heatmap()["active_days"] == 0
+
+    def test_checkin_commits_once(self, spirit, db):
+        from sqlalchemy import event
+        tasks = [spirit.create_positive_task(f"习惯{i}", spirit_effect=1, enable_streak=True) for i in range(3)]
+        spirit.complete_daily_task(tasks[0]["id"])
+        commits = []
+        event.listen(db.engine, "commit", lambda conn: commits.append(1))
+        for task in tasks[1:]:
+            result = spirit.complete_daily_task(task["id"])
+            assert result["streak"]["current_streak"] == 1
+        assert len(commits) == 2  # 每次打卡（含连续打卡）只提交一次
+
+    def test_checkin_failure_leaves_no_partial_writes(self, spirit, db, monkeypatch):
+        task = spirit.create_positive_task("冥想", spirit_effect=1, enable_streak=True)
+
+        def broken(old_spirit, new_spirit):
+            raise RuntimeError("boom")
+        monkeypatch.setattr(spirit, "_notify_kline", broken)
+        with pytest.raises(RuntimeError):
+            spirit.complete_daily_task(task["id"])
+        assert spirit.get_spirit_status()["value"] == 0
+        assert not db.is_task_completed_today(task["id"])
+
+        # 连续打卡已在事务内读过未提交的记录后再失败：回滚后缓存里不能留下这一天
+        monkeypatch.undo()
+        original = spirit.streaks.get
+
+        def read_then_fail(*args, **kwargs):
+            original(*args, **kwargs)
+            raise RuntimeError("boom")
+        spirit.streaks.invalidate()  # 让引擎在打卡事务里首次加载
+        monkeypatch.setattr(spirit.streaks, "get", read_then_fail)
+        with pytest.raises(RuntimeError):
+            spirit.complete_daily_task(task["id"])
+        monkeypatch.undo()
+        assert spirit.get_streak(task["id"]) is None
+
 
 # ============ 境界系统 ============
 
@@ -183,6 +629,40 @@ class TestRealmService:
         assert progress["completed_sub_tasks"] == 0
         assert progress["overall_progress"] == 0
 
+    def test_realm_tree_query_count_constant(self, realm, db):
+        from sqlalchemy import event
+        r = realm.create_realm("试炼", realm_type="dungeon")
+        realm_id = r["realm"]["id"]
+        for i in range(40):
+            sk = realm.add_skill(realm_id, f"技能{i}")
+            for j in range(3):
+                realm.add_sub_task(sk["skill"]["id"], f"子任务{j}")
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, *args: statements.append(sql))
+        progress = realm.get_realm_progress(realm_id)
+        dungeons = realm.get_active_dungeons()
+        assert progress["total_sub_tasks"] == 120
+        assert len(dungeons[0]["skills"]) == 40
+        assert len(statements) <= 6  # 每次加载：境界、技能、子任务各一条
+
+    def test_progress_calculator_shared(self, realm):
+        """展示用 overall_progress 按子任务计；晋升用 avg_progress 按技能平均"""
+        r = realm.create_realm("练气期", completion_rate=50)
+        realm_id = r["realm"]["id"]
+        a = realm.add_skill(realm_id, "数学")["skill"]["id"]
+        realm.add_skill(realm_id, "英语")
+        subs = [realm.add_sub_task(a, f"任务{i}")["sub_task"]["id"] for i in range(4)]
+        for sub_id in subs:
+            realm.complete_sub_task(sub_id)
+
+        tree = realm.get_active_main_realm()
+        assert tree["overall_progress"] == 100
+        assert tree["avg_progress"] == 50
+        assert realm.summarize_realm(tree) == realm.get_realm_progress(realm_id)
+        assert tree["skills"][0]["progress"] == 1.0
+        assert realm.advance_realm(realm_id)["success"] is True
+
     def test_uncomplete_sub_task(self, realm):
         r = realm.create_realm("练气期")
         sk = realm.add_skill(r["realm"]["id"], "数学")
@@ -265,6 +745,56 @@ class TestLingshiService:
         del_result = lingshi.delete_transaction(txn_id)
         assert del_result["success"] is True
 
+    def test_rollups_follow_add_delete_redate(self, lingshi, db):
+        import random
+        rng = random.Random(3)
+        months = [date(2026, 1, 15), date(2026, 2, 3), date(2026, 3, 28)]
+        ids = []
+        for _ in range(150):
+            op = rng.random()
+            if op < 0.6 or not ids:
+                add = lingshi.add_income if rng.random() < 0.3 else lingshi.add_expense
+                r = add(rng.randint(1, 500), rng.choice(["餐饮", "交通", "工资"]),
+                        transaction_date=rng.choice(months))
+                ids.append(r["transaction"]["id"])
+            elif op < 0.8:
+                lingshi.update_transaction(rng.choice(ids), transaction_date=rng.choice(months),
+                                           category=rng.choice(["餐饮", "交通"]))
+            else:
+                lingshi.delete_transaction(ids.pop(rng.randrange(len(ids))))
+
+        for d in months:
+            month = d.strftime("%Y-%m")
+            txns = [t for t in db.get_transactions(limit=100000) if t["transaction_date"].startswith(month)]
+            expected = {}
+            for t in txns:
+                key = (t["type"], t["category"])
+                expected[key] = expected.get(key, 0) + t["amount"]
+            rollups = {(r["type"], r["category"]): r["total"] for r in db.get_month_rollups(month)}
+            assert rollups == pytest.approx(expected)
+            summary = lingshi.get_monthly_summary(month)
+            assert summary["expense_total"] == pytest.approx(
+                sum(v for (t, _), v in expected.items() if t == "expense"))
+
+    def test_budget_reads_constant_queries(self, lingshi, db):
+        from sqlalchemy import event
+        month = date.today().strftime("%Y-%m")
+        lingshi.set_budget("餐饮", 1000, month)
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, *args: statements.append(sql))
+        lingshi.add_expense(10, "餐饮")
+        few = len(statements)
+        for _ in range(200):
+            lingshi.add_expense(1, "餐饮")
+        statements.clear()
+        result = lingshi.add_expense(10, "餐饮")
+        assert len(statements) == few
+        assert not any("FROM transactions" in sql for sql in statements)
+        status = lingshi.get_budget_status(month)
+        assert status["categories"][0]["spent"] == pytest.approx(220)
+        assert "预算" not in result["message"]
+
 
 # ============ 统御系统 ============
 
@@ -355,6 +885,16 @@ class TestPanelService:
         assert dashboard["spirit"]["value"] == 5
         assert dashboard["today"]["positive_count"] == 1
 
+    def test_dashboard_does_not_query_config(self, panel, db):
+        from sqlalchemy import event
+        panel.get_dashboard()
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, *args: statements.append(sql))
+        panel.get_dashboard()
+        assert statements
+        assert not any("FROM user_config" in sql for sql in statements)
+
     def test_weekly_trend(self, panel, db):
         spirit = SpiritService(db)
         task = spirit.create_positive_task("早起", spirit_effect=5)
@@ -364,3 +904,263 @@ class TestPanelService:
         assert len(trend) == 7
         # 今天应该有数据
         assert trend[-1]["positive"] == 5
+
+    def test_weekly_trend_groups_in_sql(self, panel, db):
+        from sqlalchemy import event
+        spirit = SpiritService(db)
+        task = spirit.create_demon_task("刷手机", spirit_effect=-2)
+        for _ in range(20):
+            spirit.record_demon(task["id"])
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, *args: statements.append(sql))
+        trend = panel.get_weekly_trend()
+        assert trend[-1] == {"date": date.today().strftime("%m-%d"), "positive": 0, "demon": 40, "net": -40}
+        assert sum(t["net"] for t in trend) == -40
+        record_queries = [sql for sql in statements if "task_records" in sql]
+        assert len(record_queries) == 1 and "GROUP BY task_records.day" in record_queries[0]
+
+
+# ============ K线人生图 ============
+
+class TestKlineService:
+
+    @pytest.fixture
+    def kline(self, db):
+        from services.kline_service import KlineService
+        return KlineService(db)
+
+    def test_rebuild_matches_live_updates(self, spirit, kline, db):
+        spirit.kline_svc = kline
+        good = spirit.create_positive_task("早起", spirit_effect=5)
+        bad = spirit.create_demon_task("刷手机", spirit_effect=3)
+        spirit.complete_daily_task(good["id"])
+        spirit.record_demon(bad["id"])
+        spirit.record_demon(bad["id"])
+        live = db.get_daily_score(date.today())
+
+        with db.session_scope() as s:
+            from database.models import DailyScore
+            s.query(DailyScore).delete()
+        assert kline.rebuild() == {"days": 1, "written": 1}
+        rebuilt = db.get_daily_score(date.today())
+        fields = ("open_spirit", "close_spirit", "high_spirit", "low_spirit", "change_count")
+        assert {f: rebuilt[f] for f in fields} == {f: live[f] for f in fields} == {
+            "open_spirit": 0, "close_spirit": -1, "high_spirit": 5, "low_spirit": -1, "change_count": 3}
+
+    def test_live_updates_use_logical_day(self, spirit, kline, db):
+        from services.constants import day_to_date
+        hour = datetime.now().hour
+        if hour == 23:
+            pytest.skip("23 点之后无法让当前逻辑日落在昨天")
+        # 换日时刻设在下一个整点：此刻仍属于日历上的昨天
+        db.update_day_start_hour(hour + 1)
+        spirit.kline_svc = kline
+        a = spirit.create_positive_task("早起", spirit_effect=4)
+        b = spirit.create_positive_task("冥想", spirit_effect=4)
+        spirit.complete_daily_task(a["id"])
+        spirit.complete_daily_task(b["id"])
+        logical = day_to_date(db.current_day())
+        assert logical == date.today() - timedelta(days=1)
+
+        today = kline.get_today_score()
+        assert (today["score_date"], today["close_spirit"], today["change_count"]) == (logical, 8, 2)
+        assert [c["period_start"] for c in kline.get_candles(days=7)["candles"]] == [logical]
+        assert db.get_daily_score(date.today()) is None
+
+    def test_undo_and_realm_reward_are_repaired(self, spirit, kline, db):
+        spirit.kline_svc = kline
+        kline.get_today_score()
+        task = spirit.create_positive_task("冥想", spirit_effect=5)
+        first = spirit.complete_daily_task(task["id"])
+        assert kline.get_today_score()["close_spirit"] == 5
+
+        spirit.undo_task(first["record"]["id"])
+        today = kline.get_today_score()
+        assert (today["close_spirit"], today["high_spirit"], today["change_count"]) == (0, 0, 0)
+
+        db.update_spirit(50)  # 境界奖励不经任务记录
+        today = kline.get_today_score()
+        assert (today["close_spirit"], today["high_spirit"], today["change_count"]) == (50, 50, 1)
+
+    def test_undo_keeps_later_realm_reward(self, spirit, db):
+        from database.models import VitalSnapshot
+        task = spirit.create_positive_task("冥想", spirit_effect=5)
+        first = spirit.complete_daily_task(task["id"])
+        db.update_spirit(20)  # 打卡之后的境界奖励
+        with db.session_scope() as s:
+            reward_at = s.query(VitalSnapshot).order_by(VitalSnapshot.taken_at.desc()).first().taken_at
+
+        result = spirit.undo_task(first["record"]["id"])
+        assert result["success"]
+        assert db.get_user_config()["current_spirit"] == 20
+        with db.session_scope() as s:
+            rebased = s.query(VitalSnapshot).filter(VitalSnapshot.taken_at == reward_at).one()
+            assert rebased.spirit == 20
+        assert spirit.get_spirit_at(reward_at)["spirit"] == 20
+        assert spirit.get_spirit_at(reward_at - timedelta(microseconds=1))["spirit"] == 0
+
+    def test_rebuild_long_history_in_bulk(self, kline, db):
+        from sqlalchemy import event, insert
+        from database.models import TaskRecord
+        from services.constants import day_to_date
+        task = db.create_task("修炼", "positive", spirit_effect=1)
+        today = db.current_day()
+        days = 80 * 365
+        with db.session_scope() as s:
+            s.execute(insert(TaskRecord), [
+                {"task_id": task["id"], "task_name": "修炼", "spirit_change": 1 if d % 2 else -1,
+                 "blood_change": 0, "is_undo": False, "day": today - d,
+                 "completed_at": datetime.combine(day_to_date(today - d), datetime.min.time()) + timedelta(hours=8)}
+                for d in range(days)])
+            db._touch_records(s, today - days + 1)
+            db._invalidate_vital_snapshots(s, datetime.combine(day_to_date(today - days), datetime.min.time()))
+
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, *args: statements.append(sql))
+        assert kline.rebuild() == {"days": days, "written": days}
+        assert len(statements) < 100
+        scores = db.get_daily_scores(day_to_date(today - days + 1), day_to_date(today))
+        assert len(scores) == days
+        # 每天一次变动，开盘即前一天收盘
+        assert all(s["change_count"] == 1 for s in scores)
+        assert all(a["close_spirit"] == b["open_spirit"] for a, b in zip(scores, scores[1:]))
+
+    def test_candle_pyramid_follows_daily_rows(self, kline, db):
+        # 2026-03-30（周一）到 2026-04-05 横跨一个季度边界
+        for i, (o, c) in enumerate([(0, 10), (10, 4), (4, 30), (30, 25)]):
+            db.upsert_daily_score(date(2026, 3, 30) + timedelta(days=i), open_spirit=o, close_spirit=c,
+                                  high_spirit=max(o, c) + 1, low_spirit=min(o, c) - 1, change_count=2)
+
+        def bars(span):
+            return [(c["period_start"], c["open_spirit"], c["close_spirit"], c["high_spirit"],
+                     c["low_spirit"], c["change_count"], c["day_count"])
+                    for c in db.get_score_candles(span, date(2026, 1, 1), date(2026, 12, 31))]
+
+        assert bars("week") == [(date(2026, 3, 30), 0, 25, 31, -1, 8, 4)]
+        assert bars("month") == [(date(2026, 3, 1), 0, 4, 11, -1, 4, 2), (date(2026, 4, 1), 4, 25, 31, 3, 4, 2)]
+        assert bars("quarter") == [(date(2026, 1, 1), 0, 4, 11, -1, 4, 2), (date(2026, 4, 1), 4, 25, 31, 3, 4, 2)]
+        assert bars("year") == [(date(2026, 1, 1), 0, 25, 31, -1, 8, 4)]
+
+        # 改写、删除某天只影响它所在的周期
+        db.upsert_daily_score(date(2026, 4, 2), close_spirit=50, high_spirit=50)
+        assert bars("year")[0][2:4] == (50, 50)
+        db.delete_daily_score(db.get_daily_score(date(2026, 3, 30))["id"])
+        assert bars("quarter")[0] == (date(2026, 1, 1), 10, 4, 11, 3, 2, 1)
+        db.delete_daily_score(db.get_daily_score(date(2026, 3, 31))["id"])
+        assert bars("quarter") == [(date(2026, 4, 1), 4, 50, 50, 3, 4, 2)]
+        assert bars("week")[0][1] == 4
+
+    def test_get_candles_picks_resolution(self, kline, db):
+        start = date.today() - timedelta(days=80 * 365)
+        db.upsert_daily_scores([
+            {"score_date": start + timedelta(days=d), "open_spirit": 0, "close_spirit": 1,
+             "high_spirit": 1, "low_spirit": 0, "change_count": 1}
+            for d in range(0, 80 * 365, 10)])
+
+        assert kline.get_candles(days=30)["span"] == "day"
+        lifetime = kline.get_candles(days=80 * 365 + 1)
+        assert lifetime["span"] == "quarter"
+        assert 300 < len(lifetime["candles"]) <= 400
+        assert sum(c["day_count"] for c in lifetime["candles"]) == 80 * 365 // 10
+        assert kline.get_candles(days=80 * 365, max_candles=31)["span"] == "year"
+        assert kline.get_candles(days=182, max_candles=31)["span"] == "week"
+
+    def test_indicators_forward_fill_and_follow_today(self, spirit, kline, db):
+        today = date.today()
+        for ago, close in ((9, 10), (6, 40), (2, 20)):
+            db.upsert_daily_score(today - timedelta(days=ago), open_spirit=0, close_spirit=close,
+                                  high_spirit=close, low_spirit=0, change_count=1)
+        result = kline.get_indicators(["sma3", "drawdown"], days=10)
+        assert result["dates"][0] == today - timedelta(days=9)
+        assert result["close"] == [10, 10, 10, 40, 40, 40, 40, 20, 20, 20]
+        assert result["sma3"]["value"][:3] == [None, None, 10]
+        assert result["sma3"]["value"][-1] == 20
+        assert result["drawdown"]["max"][-1] == -20
+
+        # 今天的收盘变化：只重读今天
+        reads = []
+        original = db.get_daily_scores
+        db.get_daily_scores = lambda start, end: reads.append((start, end)) or original(start, end)
+        spirit.kline_svc = kline
+        task = spirit.create_positive_task("读书", spirit_effect=5)
+        spirit.complete_daily_task(task["id"])
+        result = kline.get_indicators(["sma3", "drawdown"], days=10)
+        assert reads == [(today, today)]
+        assert result["close"][-1] == 5
+        assert result["sma3"]["value"][-1] == pytest.approx(15)
+
+        # 改动历史上的某天：从那天起重算
+        reads.clear()
+        db.upsert_daily_score(today - timedelta(days=6), close_spirit=100, high_spirit=100)
+        result = kline.get_indicators(["sma3", "drawdown"], days=10)
+        assert reads == [(today - timedelta(days=6), today)]
+        assert result["close"] == [10, 10, 10, 100, 100, 100, 100, 20, 20, 5]
+        assert result["drawdown"]["max"][-1] == -95
+
+
+class TestIndicators:
+
+    CLOSES = [0, 5, 3, 8, 8, 12, 7, -4, -10, 2, 6, 15, 20, 18, 25, 24, 30, 28, 27, 35,
+              33, 40, 38, 20, 10, 12, 18, 25, 30, 26, 31, 29]
+
+    @staticmethod
+    def _full(name, values):
+        from services.indicators import make_indicator
+        indicator = make_indicator(name)
+        indicator.update(values)
+        return indicator
+
+    def test_moving_averages_and_bands(self):
+        import statistics
+        values = self.CLOSES
+        sma = self._full("sma5", values).outputs["value"]
+        assert sma[:4] == [None] * 4
+        assert sma[4:] == pytest.approx([sum(values[i - 4:i + 1]) / 5 for i in range(4, len(values))])
+
+        ema = self._full("ema3", values).outputs["value"]
+        expected = [values[0]]
+        for v in values[1:]:
+            expected.append(expected[-1] + 0.5 * (v - expected[-1]))
+        assert ema == pytest.approx(expected)
+
+        boll = self._full("boll20", values).outputs
+        window = values[-20:]
+        mid, std = statistics.mean(window), statistics.pstdev(window)
+        assert (boll["mid"][-1], boll["upper"][-1], boll["lower"][-1]) == pytest.approx((mid, mid + 2 * std, mid - 2 * std))
+
+    def test_rsi_macd_drawdown(self):
+        assert self._full("rsi3", [1, 2, 3, 4, 5]).outputs["value"] == [None, None, None, 100.0, 100.0]
+        assert self._full("rsi3", [7] * 5).outputs["value"][-1] == 50.0
+        rsi = self._full("rsi14", self.CLOSES).outputs["value"]
+        assert all(0 <= v <= 100 for v in rsi[14:])
+
+        macd = self._full("macd", self.CLOSES).outputs
+        fast, slow = self._full("ema12", self.CLOSES).outputs["value"], self._full("ema26", self.CLOSES).outputs["value"]
+        assert macd["macd"] == pytest.approx([f - s for f, s in zip(fast, slow)])
+        assert macd["hist"] == pytest.approx([m - s for m, s in zip(macd["macd"], macd["signal"])])
+
+        dd = self._full("drawdown", [0, 10, 4, 12, -3, 5]).outputs
+        assert dd["value"] == [0, 0, -6, 0, -15, -7]
+        assert dd["max"] == [0, 0, -6, -6, -15, -15]
+
+    @pytest.mark.parametrize("name", ["sma7", "ema12", "boll20", "rsi14", "macd", "drawdown"])
+    def test_incremental_update_matches_full(self, name):
+        values = list(self.CLOSES)
+        indicator = self._full(name, values)
+        values[-1] = -50                      # 今天的收盘变了
+        indicator.update(values, len(values) - 1)
+        values[10:12] = [60, 61]              # 改了历史上的两天，并多了一天
+        values.append(3)
+        indicator.update(values, 10)
+        full = self._full(name, values)
+        for field, out in full.outputs.items():
+            assert indicator.outputs[field] == pytest.approx(out), field
+
+    def test_unknown_indicator(self):
+        from services.indicators import make_indicator
+        with pytest.raises(ValueError):
+            make_indicator("kdj9")
+        with pytest.raises(ValueError):
+            make_indicator("sma0")
@@ -117,7 +117,7 @@ class JingjiePage(ft.Column):
 
     # ── 主境界英雄卡 ─────────────────────────────────────
     def _realm_hero_card(self, realm: dict) -> ft.Container:
-        progress = self.svc.get_realm_progress(realm["id"])
+        progress = self.svc.summarize_realm(realm)
         pct = progress["overall_progress"]
 
         return ft.Container(
@@ -174,7 +174,7 @@ class JingjiePage(ft.Column):
 
     # ── 副本英雄卡 ───────────────────────────────────────
     def _dungeon_hero_card(self, realm: dict) -> ft.Container:
-        progress = self.svc.get_realm_progress(realm["id"])
+        progress = self.svc.summarize_realm(realm)
         pct = progress["overall_progress"]
 
         return ft.Container(
@@ -228,7 +228,7 @@ class JingjiePage(ft.Column):
 
     # ── 技能树 ───────────────────────────────────────────
     def _realm_skill_tree(self, realm: dict, is_dungeon: bool = False) -> ft.Column:
-        progress = self.svc.get_realm_progress(realm["id"])
+        progress = self.svc.summarize_realm(realm)
         items = []
 
         for skill in progress.get("skills", []):
@@ -38,7 +38,8 @@ class LingshiPage(ft.Column):
             # 快捷操作
             self._quick_actions(),
             # 今日收支
-            self._section_header("📋", "今日收支"),
+            self._section_header("📋", "今日收支",
+                                 action=ft.TextButton("全部账单 ›", on_click=lambda e: self._show_ledger_dialog())),
             self._today_list(),
             # 预算
             self._section_header("📊", "本月预算"),
@@ -50,13 +51,16 @@ class LingshiPage(ft.Column):
         ]
 
     # ── 区块标题 ─────────────────────────────────────────
-    def _section_header(self, emoji: str, title: str) -> ft.Container:
+    def _section_header(self, emoji: str, title: str, action: ft.Control = None) -> ft.Container:
+        row = [
+            ft.Text(emoji, size=18),
+            ft.Text(title, size=18, weight=ft.FontWeight.W_600, color=C.TEXT_PRIMARY),
+        ]
+        if action is not None:
+            row += [ft.Container(expand=True), action]
         return ft.Container(
-            content=ft.Row([
-                ft.Text(emoji, size=18),
-                ft.Text(title, size=18, weight=ft.FontWeight.W_600, color=C.TEXT_PRIMARY),
-            ], spacing=6),
-            padding=ft.Padding.only(left=20, top=20, bottom=6),
+            content=ft.Row(row, spacing=6),
+            padding=ft.Padding.only(left=20, right=12, top=20, bottom=6),
         )
 
     # ── 余额英雄卡 ──────────────────────────────────────
@@ -242,51 +246,127 @@ class LingshiPage(ft.Column):
                 alignment=ft.Alignment.CENTER,
             )
 
-        items = []
-        for t in txns:
-            is_income = t["type"] == "income"
-            items.append(
+        return ft.Column([self._txn_row(t) for t in txns], spacing=0)
+
+    def _txn_row(self, t: dict, show_date: bool = False, on_deleted=None) -> ft.Container:
+        """单条收支记录行（今日列表与账单列表共用）"""
+        is_income = t["type"] == "income"
+        subtitle = f"{t['transaction_date']} · {t['category']}" if show_date else t["category"]
+        return ft.Container(
+            content=ft.Row([
                 ft.Container(
-                    content=ft.Row([
-                        ft.Container(
-                            content=ft.Text("↑" if is_income else "↓", size=16,
-                                            weight=ft.FontWeight.BOLD,
-                                            color=C.SUCCESS if is_income else C.ERROR),
-                            width=36, height=36, border_radius=18,
-                            bgcolor=ft.Colors.with_opacity(0.1, C.SUCCESS if is_income else C.ERROR),
-                            alignment=ft.Alignment.CENTER,
-                        ),
-                        ft.Column([
-                            ft.Text(
-                                t["description"] or t["category"],
-                                size=14, weight=ft.FontWeight.W_500, color=C.TEXT_PRIMARY,
-                            ),
-                            ft.Text(t["category"], size=11, color=C.TEXT_HINT),
-                        ], spacing=2, expand=True),
-                        ft.Text(
-                            f"{'+'if is_income else '-'}¥{t['amount']:,.2f}",
-                            size=16, weight=ft.FontWeight.BOLD,
-                            color=C.SUCCESS if is_income else C.ERROR,
-                        ),
-                        ft.IconButton(
-                            icon=ft.Icons.DELETE_OUTLINE, icon_size=18,
-                            icon_color=C.TEXT_HINT,
-                            on_click=lambda e, tid=t["id"], tdesc=t.get("description") or t["category"]: self._confirm_delete_transaction(tid, tdesc),
-                            style=ft.ButtonStyle(padding=0),
-                        ),
-                    ], vertical_alignment=ft.CrossAxisAlignment.CENTER),
-                    padding=ft.Padding.symmetric(horizontal=16, vertical=10),
-                    margin=ft.Margin.symmetric(horizontal=16, vertical=2),
-                    border_radius=12,
-                    bgcolor=C.CARD_LIGHT,
-                    shadow=ft.BoxShadow(
-                        spread_radius=0, blur_radius=4,
-                        color=ft.Colors.with_opacity(0.04, ft.Colors.BLACK),
-                        offset=ft.Offset(0, 1),
+                    content=ft.Text("↑" if is_income else "↓", size=16,
+                                    weight=ft.FontWeight.BOLD,
+                                    color=C.SUCCESS if is_income else C.ERROR),
+                    width=36, height=36, border_radius=18,
+                    bgcolor=ft.Colors.with_opacity(0.1, C.SUCCESS if is_income else C.ERROR),
+                    alignment=ft.Alignment.CENTER,
+                ),
+                ft.Column([
+                    ft.Text(
+                        t["description"] or t["category"],
+                        size=14, weight=ft.FontWeight.W_500, color=C.TEXT_PRIMARY,
                     ),
-                )
-            )
-        return ft.Column(items, spacing=0)
+                    ft.Text(subtitle, size=11, color=C.TEXT_HINT),
+                ], spacing=2, expand=True),
+                ft.Text(
+                    f"{'+'if is_income else '-'}¥{t['amount']:,.2f}",
+                    size=16, weight=ft.FontWeight.BOLD,
+                    color=C.SUCCESS if is_income else C.ERROR,
+                ),
+                ft.IconButton(
+                    icon=ft.Icons.DELETE_OUTLINE, icon_size=18,
+                    icon_color=C.TEXT_HINT,
+                    on_click=lambda e, tid=t["id"], tdesc=t.get("description") or t["category"]: self._confirm_delete_transaction(tid, tdesc, on_deleted),
+                    style=ft.ButtonStyle(padding=0),
+                ),
+            ], vertical_alignment=ft.CrossAxisAlignment.CENTER),
+            padding=ft.Padding.symmetric(horizontal=16, vertical=10),
+            margin=ft.Margin.symmetric(horizontal=16, vertical=2),
+            border_radius=12,
+            bgcolor=C.CARD_LIGHT,
+            shadow=ft.BoxShadow(
+                spread_radius=0, blur_radius=4,
+                color=ft.Colors.with_opacity(0.04, ft.Colors.BLACK),
+                offset=ft.Offset(0, 1),
+            ),
+        )
+
+    # ── 全部账单（游标分页） ─────────────────────────────
+    _LEDGER_PAGE_SIZE = 30
+
+    def _show_ledger_dialog(self):
+        """全部收支记录，滑到底部换下一页、顶部继续上拉换上一页
+
+        列表里始终只有一页的行：cursors[i] 是第 i 页的起始游标，
+        往回翻时用保存的游标重新查询，不在内存里累积已看过的页。
+        """
+        state = {"cursors": [None], "next": None, "type": None, "busy": False}
+        listview = ft.ListView(spacing=0, height=420)
+        page_label = ft.Text("", size=12, color=C.TEXT_HINT)
+
+        def load(index: int):
+            result = self.svc.get_transaction_page(
+                state["cursors"][index], self._LEDGER_PAGE_SIZE, type=state["type"])
+            del state["cursors"][index + 1:]
+            state["next"] = result["next_cursor"]
+            listview.controls = [self._txn_row(t, show_date=True, on_deleted=reload)
+                                 for t in result["items"]]
+            if not listview.controls:
+                listview.controls = [ft.Container(
+                    content=ft.Text("暂无记录", size=14, color=C.TEXT_HINT),
+                    padding=24, alignment=ft.Alignment.CENTER,
+                )]
+            page_label.value = f"第 {index + 1} 页" + ("" if state["next"] else " · 已到最早")
+
+        def reload():
+            load(len(state["cursors"]) - 1)
+            self._page.update()
+
+        async def on_scroll(e: ft.OnScrollEvent):
+            if state["busy"]:
+                return
+            at_bottom = e.pixels >= e.max_scroll_extent - 4
+            at_top = e.pixels <= e.min_scroll_extent and (e.scroll_delta or 0) < 0
+            if at_bottom and state["next"]:
+                state["busy"] = True
+                state["cursors"].append(state["next"])
+                load(len(state["cursors"]) - 1)
+                listview.update()
+                page_label.update()
+                await listview.scroll_to(offset=0)
+                state["busy"] = False
+            elif at_top and len(state["cursors"]) > 1:
+                state["busy"] = True
+                load(len(state["cursors"]) - 2)
+                listview.update()
+                page_label.update()
+                # 回到上一页的末尾，接着用户向上滑的位置
+                await listview.scroll_to(offset=-1)
+                state["busy"] = False
+
+        def on_filter(e):
+            state["type"] = None if e.control.value == "all" else e.control.value
+            state["cursors"] = [None]
+            load(0)
+            self._page.update()
+
+        listview.on_scroll = on_scroll
+        type_dd = ft.Dropdown(
+            value="all", border_radius=10, width=120, dense=True,
+            options=[ft.dropdown.Option("all", "全部"),
+                     ft.dropdown.Option("income", "收入"),
+                     ft.dropdown.Option("expense", "支出")],
+            on_select=on_filter,
+        )
+        load(0)
+
+        dlg = ft.AlertDialog(
+            title=ft.Row([ft.Text("全部账单", expand=True), type_dd]),
+            content=ft.Column([listview, page_label], tight=True, width=420, spacing=6),
+            actions=[ft.TextButton("关闭", on_click=lambda e: (setattr(dlg, "open", False), self._page.update()))],
+        )
+        self._page.show_dialog(dlg)
 
     # ── 预算卡片 ─────────────────────────────────────────
     def _budget_card(self) -> ft.Container:
@@ -658,7 +738,7 @@ class LingshiPage(ft.Column):
         )
         self._page.show_dialog(dlg)
 
-    def _confirm_delete_transaction(self, txn_id: int, description: str):
+    def _confirm_delete_transaction(self, txn_id: int, description: str, on_deleted=None):
         def on_confirm(e):
             result = self.svc.delete_transaction(txn_id)
             dlg.open = False
@@ -669,6 +749,8 @@ class LingshiPage(ft.Column):
             self._page.overlay.append(_sb)
             self._page.update()
             self._refresh()
+            if on_deleted:
+                on_deleted()
 
         dlg = ft.AlertDialog(
             title=ft.Text("确认删除"),
@@ -557,6 +557,8 @@ class PanelPage(ft.Column):
             )
 
         scores = self.kline_svc.get_scores(days=14)
+        indicators = self.kline_svc.get_indicators(["sma7", "rsi14"], days=14)
+        ma_map = dict(zip(indicators["dates"], indicators["sma7"]["value"]))
         if not scores:
             return ft.Container(
                 content=ft.Text("暂无K线数据", size=13, color=C.TEXT_HINT, text_align=ft.TextAlign.CENTER),
@@ -599,7 +601,9 @@ class PanelPage(ft.Column):
                     ft.Container(width=1, height=max(1, y_pos(max(o, c)) - wick_offset), bgcolor=color),
                     # 实体
                     ft.Container(width=10, height=body_h, bgcolor=color, border_radius=1,
-                                 tooltip=f"开{o} 收{c} 高{h} 低{l}"),
+                                 tooltip=f"开{o} 收{c} 高{h} 低{l}" + (
+                                     f" MA7 {ma_map[s['score_date']]:.0f}"
+                                     if ma_map.get(s["score_date"]) is not None else "")),
                     # 下影线
                     ft.Container(width=1, height=max(1, y_pos(l) - y_pos(min(o, c)) - body_h), bgcolor=color),
                     ft.Container(expand=True),
@@ -620,6 +624,11 @@ class PanelPage(ft.Column):
             ft.Row([ft.Container(width=10, height=10, bgcolor="#ef5350", border_radius=2),
                     ft.Text("下跌", size=10, color=C.TEXT_HINT)], spacing=4),
         ], spacing=16, alignment=ft.MainAxisAlignment.CENTER)
+        ma7, rsi = indicators["sma7"]["value"], indicators["rsi14"]["value"]
+        if ma7 and ma7[-1] is not None:
+            legend.controls.append(ft.Text(f"MA7 {ma7[-1]:.0f}", size=10, color=C.TEXT_HINT))
+        if rsi and rsi[-1] is not None:
+            legend.controls.append(ft.Text(f"RSI {rsi[-1]:.0f}", size=10, color=C.TEXT_HINT))
 
         return ft.Container(
             content=ft.Column([chart, legend], spacing=8),
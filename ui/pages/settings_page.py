@@ -50,6 +50,15 @@ class SettingsPage(ft.Column):
                     subtitle=f"¥{config['target_money']:,}" if config else "¥5,000,000",
                     on_click=lambda e: self._edit_target(),
                 ),
+                self._divider(),
+                self._setting_row(
+                    icon=ft.Icons.SCHEDULE_OUTLINED,
+                    icon_color="#3f51b5",
+                    icon_bg="#e8eaf6",
+                    title="每天开始于",
+                    subtitle=f"{config['day_start_hour']}:00（统计按此分日）" if config else "0:00",
+                    on_click=lambda e: self._edit_day_start(),
+                ),
             ]),
 
             # ── AI 设置 ──
@@ -87,6 +96,15 @@ class SettingsPage(ft.Column):
                     subtitle="从备份文件恢复",
                     on_click=lambda e: self._restore(),
                 ),
+                self._divider(),
+                self._setting_row(
+                    icon=ft.Icons.CANDLESTICK_CHART_OUTLINED,
+                    icon_color="#8e24aa",
+                    icon_bg="#f3e5f5",
+                    title="重建K线",
+                    subtitle="按全部打卡记录重新生成K线人生图",
+                    on_click=lambda e: self._rebuild_kline(),
+                ),
             ]),
 
             # ── 关于 ──
@@ -259,11 +277,7 @@ class SettingsPage(ft.Column):
                 target = int(field.value)
                 config = self.db.get_user_config()
                 if config:
-                    with self.db.session_scope() as s:
-                        from database.models import UserConfig
-                        uc = s.query(UserConfig).first()
-                        if uc:
-                            uc.target_money = target
+                    self.db.update_target_money(target)
                     dlg.open = False
                     self._page.update()
                     self._refresh()
@@ -280,6 +294,33 @@ class SettingsPage(ft.Column):
         )
         self._page.show_dialog(dlg)
 
+    def _edit_day_start(self):
+        config = self.db.get_user_config()
+        hour_dd = ft.Dropdown(
+            label="每天开始于", value=str(config["day_start_hour"] if config else 0),
+            options=[ft.dropdown.Option(str(h), f"{h}:00") for h in range(24)],
+        )
+
+        def on_save(e):
+            if self.db.get_user_config():
+                self.db.update_day_start_hour(int(hour_dd.value))
+                dlg.open = False
+                self._page.update()
+                self._refresh()
+
+        dlg = ft.AlertDialog(
+            title=ft.Text("设置每天开始时间"),
+            content=ft.Column([
+                ft.Text("该时间之前的打卡计入前一天，例如设为 4:00 时凌晨 2 点的记录算作昨天", size=12, color=C.TEXT_HINT),
+                hour_dd,
+            ], tight=True, spacing=12),
+            actions=[
+                ft.TextButton("取消", on_click=lambda e: (setattr(dlg, "open", False), self._page.update())),
+                ft.TextButton("保存", on_click=on_save),
+            ],
+        )
+        self._page.show_dialog(dlg)
+
     def _edit_ai_config(self):
         provider_dd = ft.Dropdown(
             label="提供商", value="openai",
@@ -327,6 +368,7 @@ class SettingsPage(ft.Column):
         from datetime import datetime
         backup_file = backup_dir / f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
         try:
+            self.db.checkpoint()
             shutil.copy2(self.db.db_path, str(backup_file))
             _sb = ft.SnackBar(ft.Text(f"备份成功: {backup_file.name}"), bgcolor=C.SUCCESS)
             _sb.open = True
@@ -337,6 +379,17 @@ class SettingsPage(ft.Column):
             _sb.open = True
             self._page.overlay.append(_sb)
             self._page.update()
+    def _rebuild_kline(self):
+        from services.kline_service import KlineService
+        try:
+            result = KlineService(self.db).rebuild()
+            _sb = ft.SnackBar(ft.Text(f"K线已重建：{result['days']} 天，写入 {result['written']} 条"), bgcolor=C.SUCCESS)
+        except Exception as ex:
+            _sb = ft.SnackBar(ft.Text(f"重建失败: {ex}"), bgcolor=C.ERROR)
+        _sb.open = True
+        self._page.overlay.append(_sb)
+        self._page.update()
+
     def _restore(self):
         _sb = ft.SnackBar(ft.Text("恢复功能开发中"), bgcolor=C.WARNING)
         _sb.open = True
@@ -344,9 +397,7 @@ class SettingsPage(ft.Column):
         self._page.update()
     def _confirm_reset(self):
         def on_confirm(e):
-            from database.models import Base
-            Base.metadata.drop_all(self.db.engine)
-            Base.metadata.create_all(self.db.engine)
+            self.db.reset_all_data()
             dlg.open = False
             self._page.update()
             _sb = ft.SnackBar(ft.Text("应用已重置"), bgcolor=C.WARNING)
@@ -2,12 +2,15 @@
 心境系统页面 v2
 美化版：蓝紫渐变头部、绿色正面卡片、暗红心魔卡片、日常任务、K线人生、手动柱状图统计、优化对话框
 """
-from datetime import date, timedelta
+from datetime import date
 import flet as ft
+import flet.canvas as cv
 from services.spirit_service import SpiritService
 from services.daily_task_service import DailyTaskService
 from services.kline_service import KlineService
-from services.constants import Colors as C, SPIRIT_LEVELS, SPIRIT_MIN, SPIRIT_MAX
+from services.constants import (
+    Colors as C, SPIRIT_LEVELS, SPIRIT_MIN, SPIRIT_MAX, CANDLE_SPAN_NAMES, period_at, period_end, period_index,
+)
 from ui.styles import card_container, section_title
 
 # K线颜色
@@ -18,6 +21,16 @@ CHART_BG = "#1e222d"
 MA_COLOR = "#fbbf24"
 Y_MIN = SPIRIT_MIN
 Y_MAX = SPIRIT_MAX
+# 图表一屏最多画这么多根，跨度更长时换周/月/季/年线
+KLINE_CHART_CANDLES = 31
+# 范围选项 (标签, 天数)；0 表示从出生到今天
+KLINE_RANGES = [("7天", 7), ("14天", 14), ("30天", 30), ("半年", 182), ("5年", 1826), ("一生", 0)]
+# 叠加在K线上的指标 (标签, 指标名)
+KLINE_OVERLAYS = [("MA7", "sma7"), ("MA30", "sma30"), ("EMA12", "ema12"), ("布林", "boll20")]
+# 热力图：格子边长 / 间距，颜色从无到满共 5 档
+HEATMAP_CELL = 5
+HEATMAP_GAP = 1
+HEATMAP_COLORS = ["#ebedf0", "#9be9a8", "#40c463", "#30a14e", "#216e39"]
 
 
 class XinjingPage(ft.Column):
@@ -34,6 +47,10 @@ class XinjingPage(ft.Column):
         self.expand = True
         self._current_tab = 0
         self._kline_display_days = 14
+        self._kline_overlay = "sma7"
+        self._heatmap_task = None   # None 为所有正面任务合并
+        self._heatmap_year = None   # None 为最近 365 天
+        self._heatmap_box = ft.Container()
 
     def build(self):
         status = self.svc.get_spirit_status()
@@ -136,11 +153,8 @@ class XinjingPage(ft.Column):
 
     # ─── 正面修炼 Tab ───────────────────────────────────────
     def _positive_tab(self) -> ft.Column:
-        tasks = self.svc.get_positive_tasks()
-        items = []
-        for task in tasks:
-            completed = self.svc._check_task_completed(task)
-            items.append(self._task_card(task, completed))
+        tasks = self.svc.get_task_board("positive")
+        items = [self._task_card(task, task["completed"]) for task in tasks]
         items.append(self._add_task_button("positive"))
         return ft.Column(items, spacing=0)
 
@@ -185,7 +199,7 @@ class XinjingPage(ft.Column):
 
         streak_text = ""
         if task["enable_streak"]:
-            streak = self.svc.db.get_streak(task["id"])
+            streak = task.get("streak")
             if streak and streak["current_streak"] > 0:
                 streak_text = f" 🔥{streak['current_streak']}天"
 
@@ -234,13 +248,13 @@ class XinjingPage(ft.Column):
 
     # ─── 心魔 Tab ───────────────────────────────────────────
     def _demon_tab(self) -> ft.Column:
-        tasks = self.svc.get_demon_tasks()
+        tasks = self.svc.get_task_board("demon")
         items = [self._demon_card(task) for task in tasks]
         items.append(self._add_task_button("demon"))
         return ft.Column(items, spacing=0)
 
     def _demon_card(self, task: dict) -> ft.Container:
-        today_count = self.svc.db.get_task_today_count(task["id"])
+        today_count = task.get("today_count", 0)
 
         def on_demon(e):
             result = self.svc.record_demon(task["id"])
@@ -512,16 +526,80 @@ class XinjingPage(ft.Column):
     # ─── K线人生 Tab ──────────────────────────────────────────
     def _kline_tab(self) -> ft.Column:
         today_score = self.kline_svc.get_today_score()
-        scores = self.kline_svc.get_scores(days=self._kline_display_days)
-        weekly_avg = self.kline_svc.get_weekly_avg()
+        days = self._kline_display_days or self._kline_lifetime_days()
+        chart = self.kline_svc.get_candles(days=days, max_candles=KLINE_CHART_CANDLES)
+        indicators = self.kline_svc.get_indicators([self._kline_overlay, "rsi14", "macd", "drawdown"], days=days)
         return ft.Column([
             self._kline_today_card(today_score),
             self._kline_range_selector(),
-            self._kline_chart(scores, weekly_avg),
-            section_title("历史记录"),
-            self._kline_score_list(scores),
+            self._kline_chart(chart, self._kline_overlay_points(chart, indicators)),
+            self._kline_indicator_strip(indicators),
+            section_title("历史记录" if chart["span"] == "day" else f"历史记录（{CANDLE_SPAN_NAMES[chart['span']]}）"),
+            self._kline_score_list(chart["candles"], chart["span"]),
         ], spacing=0)
 
+    def _kline_lifetime_days(self) -> int:
+        config = self.kline_svc.db.get_user_config()
+        if not config:
+            return 365
+        return (date.today() - date(config["birth_year"], 1, 1)).days + 1
+
+    def _kline_overlay_points(self, chart, indicators) -> dict:
+        """{周期第一天: [叠加指标在该周期最后一天的各输出值]}"""
+        span, name = chart["span"], self._kline_overlay
+        index = {d: i for i, d in enumerate(indicators["dates"])}
+        outputs = list(indicators[name].values())
+        points = {}
+        for i in range(period_index(chart["start"], span), period_index(chart["end"], span) + 1):
+            start = period_at(i, span)
+            pos = index.get(min(period_end(start, span), chart["end"]))
+            if pos is not None:
+                points[start] = [out[pos] for out in outputs]
+        return points
+
+    def _kline_indicator_strip(self, indicators) -> ft.Container:
+        """叠加指标切换 + 最新 RSI / MACD / 回撤"""
+        def on_select(name):
+            def handler(e):
+                self._kline_overlay = name
+                self._refresh()
+            return handler
+
+        chips = [ft.Container(
+            content=ft.Text(label, size=11, color="white" if self._kline_overlay == name else C.TEXT_SECONDARY),
+            bgcolor=MA_COLOR if self._kline_overlay == name else ft.Colors.with_opacity(0.08, C.TEXT_PRIMARY),
+            border_radius=12, padding=ft.Padding.symmetric(horizontal=8, vertical=3),
+            on_click=on_select(name),
+        ) for label, name in KLINE_OVERLAYS]
+
+        def latest(name, field):
+            values = indicators[name][field]
+            return values[-1] if values and values[-1] is not None else None
+
+        rsi, hist, dd = latest("rsi14", "value"), latest("macd", "hist"), latest("drawdown", "value")
+        readings = "  ".join([
+            f"RSI {rsi:.0f}" if rsi is not None else "RSI --",
+            f"MACD {hist:+.1f}" if hist is not None else "MACD --",
+            f"回撤 {dd:.0f}" if dd is not None else "回撤 --",
+        ])
+        return ft.Container(
+            content=ft.Column([
+                ft.Row(chips, spacing=6, alignment=ft.MainAxisAlignment.CENTER),
+                ft.Text(readings, size=11, color=C.TEXT_SECONDARY, text_align=ft.TextAlign.CENTER),
+            ], spacing=4, horizontal_alignment=ft.CrossAxisAlignment.CENTER),
+            margin=ft.Margin.symmetric(horizontal=16, vertical=4),
+        )
+
+    @staticmethod
+    def _kline_period_label(d, span) -> str:
+        if span == "month":
+            return f"{d.year % 100:02d}/{d.month}"
+        if span == "quarter":
+            return f"{d.year % 100:02d}Q{(d.month - 1) // 3 + 1}"
+        if span == "year":
+            return str(d.year)
+        return f"{d.month}/{d.day}"
+
     def _kline_today_card(self, today) -> ft.Container:
         if not today:
             return card_container(
@@ -567,38 +645,38 @@ class XinjingPage(ft.Column):
                 self._refresh()
             return handler
         buttons = []
-        for d in [7, 14, 30]:
+        for label, d in KLINE_RANGES:
             is_active = self._kline_display_days == d
             buttons.append(ft.Container(
-                content=ft.Text(f"{d}天", size=13,
+                content=ft.Text(label, size=13,
                                 weight=ft.FontWeight.W_600 if is_active else ft.FontWeight.W_400,
                                 color="white" if is_active else C.TEXT_SECONDARY),
                 bgcolor=C.PRIMARY if is_active else ft.Colors.with_opacity(0.08, C.TEXT_PRIMARY),
-                border_radius=16, padding=ft.Padding.symmetric(horizontal=16, vertical=6),
+                border_radius=16, padding=ft.Padding.symmetric(horizontal=10, vertical=6),
                 on_click=on_select(d),
             ))
         return ft.Container(
-            content=ft.Row(buttons, alignment=ft.MainAxisAlignment.CENTER, spacing=8),
+            content=ft.Row(buttons, alignment=ft.MainAxisAlignment.CENTER, spacing=6, wrap=True),
             padding=ft.Padding.symmetric(vertical=8),
         )
 
-    def _kline_chart(self, scores, weekly_avg) -> ft.Container:
+    def _kline_chart(self, chart, overlay) -> ft.Container:
         from ui.styles import ALIGN_CENTER as _AC
+        scores, span = chart["candles"], chart["span"]
         if not scores:
             return card_container(
                 ft.Container(content=ft.Text("暂无数据，完成心境任务后自动生成", size=14,
                                               color=C.TEXT_HINT, text_align=ft.TextAlign.CENTER),
                              height=KLINE_CHART_HEIGHT, alignment=_AC),
             )
-        score_map = {s["score_date"]: s for s in scores}
-        avg_map = {a["date"]: a["avg"] for a in weekly_avg}
-        end = date.today()
-        days = self._kline_display_days
-        all_dates = [end - timedelta(days=days - 1 - i) for i in range(days)]
-        candle_width = max(8, min(20, (350 - 40) // days))
-        gap = max(2, (350 - 40 - candle_width * days) // max(1, days - 1))
-        body_width = max(6, candle_width - 2)
-        wick_width = 2
+        score_map = {s["period_start"]: s for s in scores}
+        first, last = period_index(chart["start"], span), period_index(chart["end"], span)
+        all_dates = [period_at(i, span) for i in range(first, last + 1)]
+        days = len(all_dates)
+        candle_width = max(2, min(20, (350 - 40) // days))
+        gap = max(1, (350 - 40 - candle_width * days) // max(1, days - 1))
+        body_width = max(2, candle_width - 2)
+        wick_width = min(2, body_width)
         y_range = Y_MAX - Y_MIN
 
         def y_of(val):
@@ -622,15 +700,17 @@ class XinjingPage(ft.Column):
                                             left=x_pos + (body_width - wick_width) / 2, top=wick_top))
                 candles.append(ft.Container(width=body_width, height=body_h, bgcolor=color,
                                             border_radius=2, left=x_pos, top=body_top))
-            avg_val = avg_map.get(d)
-            if avg_val is not None:
-                ma_y = y_of(avg_val)
-                ma_dots.append(ft.Container(width=4, height=4, border_radius=2, bgcolor=MA_COLOR,
-                                            left=x_pos + body_width / 2 - 2, top=ma_y - 2))
+            for k, val in enumerate(overlay.get(d, ())):
+                if val is None:
+                    continue
+                # 布林带的上下轨画得淡一些
+                ma_dots.append(ft.Container(width=4, height=4, border_radius=2,
+                                            bgcolor=MA_COLOR if k == 0 else ft.Colors.with_opacity(0.5, MA_COLOR),
+                                            left=x_pos + body_width / 2 - 2, top=y_of(val) - 2))
             show_label = (i % max(1, days // 7) == 0) or i == days - 1
             if show_label:
                 x_labels.append(ft.Container(
-                    content=ft.Text(f"{d.month}/{d.day}", size=9, color=C.TEXT_HINT),
+                    content=ft.Text(self._kline_period_label(d, span), size=9, color=C.TEXT_HINT),
                     left=x_pos - 6, top=KLINE_CHART_HEIGHT + 4))
 
         y_labels = []
@@ -647,8 +727,10 @@ class XinjingPage(ft.Column):
             ft.Container(width=10, height=10, bgcolor=KLINE_RED, border_radius=2),
             ft.Text("心情变差", size=10, color=C.TEXT_SECONDARY),
             ft.Container(width=10, height=10, bgcolor=MA_COLOR, border_radius=5),
-            ft.Text("7日均线", size=10, color=C.TEXT_SECONDARY),
+            ft.Text(next(l for l, n in KLINE_OVERLAYS if n == self._kline_overlay), size=10, color=C.TEXT_SECONDARY),
         ], spacing=6, alignment=ft.MainAxisAlignment.CENTER)
+        if span != "day":
+            legend.controls.append(ft.Text(f"· {CANDLE_SPAN_NAMES[span]}", size=10, color=C.TEXT_SECONDARY))
 
         return ft.Container(
             content=ft.Column([
@@ -660,20 +742,19 @@ class XinjingPage(ft.Column):
             margin=ft.Margin.symmetric(horizontal=16, vertical=4),
         )
 
-    def _kline_score_list(self, scores) -> ft.Container:
+    def _kline_score_list(self, scores, span="day") -> ft.Container:
         if not scores:
             return card_container(
                 ft.Text("暂无记录", size=14, color=C.TEXT_HINT, text_align=ft.TextAlign.CENTER))
         rows = []
-        sorted_scores = sorted(scores, key=lambda x: x["score_date"], reverse=True)
+        sorted_scores = sorted(scores, key=lambda x: x["period_start"], reverse=True)
         for sc in sorted_scores:
             o, c = sc["open_spirit"], sc["close_spirit"]
             h, l, count = sc["high_spirit"], sc["low_spirit"], sc["change_count"]
             change = c - o
             change_str = f"{change:+d}"
             change_color = KLINE_GREEN if change >= 0 else KLINE_RED
-            d = sc["score_date"]
-            date_str = f"{d.month}/{d.day}"
+            date_str = self._kline_period_label(sc["period_start"], span)
             notes_str = sc.get("notes") or ""
             if len(notes_str) > 10:
                 notes_str = notes_str[:10] + "…"
@@ -690,7 +771,8 @@ class XinjingPage(ft.Column):
                 ], spacing=4, vertical_alignment=ft.CrossAxisAlignment.CENTER),
                 padding=ft.Padding.symmetric(horizontal=12, vertical=8),
                 border=ft.Border(bottom=ft.BorderSide(1, ft.Colors.with_opacity(0.08, C.TEXT_PRIMARY))),
-                on_click=lambda e, s=sc: self._show_kline_detail_dialog(s),
+                # 周/月/季/年线由日线合成，没有备注可看、也不能单独删除
+                on_click=(lambda e, s=sc: self._show_kline_detail_dialog(s)) if span == "day" else None,
             )
             rows.append(row)
         header = ft.Container(
@@ -767,6 +849,7 @@ class XinjingPage(ft.Column):
         task_counts = self._get_task_trigger_counts()
 
         controls = [
+            section_title("打卡热力图"), self._heatmap_card(),
             section_title("今日"), self._summary_card(summary),
             # 日常任务完成情况
             section_title("日常任务"),
@@ -783,6 +866,80 @@ class XinjingPage(ft.Column):
 
         return ft.Column(controls, spacing=0)
 
+    def _heatmap_card(self) -> ft.Container:
+        """热力图卡片：任务切换和翻年只重画卡片内部，不刷新整页"""
+        self._render_heatmap()
+        return ft.Container(
+            content=self._heatmap_box,
+            padding=12, margin=ft.Margin.symmetric(horizontal=16, vertical=4),
+            border_radius=14, bgcolor=C.CARD_LIGHT,
+            shadow=ft.BoxShadow(spread_radius=0, blur_radius=8,
+                                color=ft.Colors.with_opacity(0.06, ft.Colors.BLACK), offset=ft.Offset(0, 2)),
+        )
+
+    def _render_heatmap(self):
+        heatmap = self.svc.get_heatmap(self._heatmap_task, self._heatmap_year)
+        this_year = date.today().year
+
+        def on_task(e):
+            self._heatmap_task = int(e.control.value) if e.control.value else None
+            self._update_heatmap()
+
+        def on_year(step):
+            def handler(e):
+                year = (self._heatmap_year or this_year) + step
+                self._heatmap_year = None if year > this_year else year
+                self._update_heatmap()
+            return handler
+
+        task_dd = ft.Dropdown(
+            value=str(self._heatmap_task or ""), dense=True, width=150, border_radius=10,
+            options=[ft.dropdown.Option("", "全部任务")] + [
+                ft.dropdown.Option(str(t["id"]), t["name"]) for t in self.svc.get_positive_tasks()],
+            on_select=on_task,
+        )
+        title = "最近一年" if self._heatmap_year is None else f"{self._heatmap_year}年"
+        config = self.svc.db.get_user_config()
+        first_year = config["birth_year"] if config else this_year - 1
+        oldest = self._heatmap_year is not None and self._heatmap_year <= first_year
+        nav = ft.Row([
+            ft.IconButton(ft.Icons.CHEVRON_LEFT, icon_size=18, disabled=oldest, on_click=on_year(-1)),
+            ft.Text(title, size=13, weight=ft.FontWeight.W_600, color=C.TEXT_PRIMARY),
+            ft.IconButton(ft.Icons.CHEVRON_RIGHT, icon_size=18,
+                          disabled=self._heatmap_year is None, on_click=on_year(1)),
+        ], spacing=0)
+        self._heatmap_box.content = ft.Column([
+            ft.Row([nav, task_dd], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+            self._heatmap_canvas(heatmap),
+            ft.Text(f"{heatmap['active_days']} 天有打卡", size=11, color=C.TEXT_SECONDARY),
+        ], spacing=4)
+
+    def _update_heatmap(self):
+        self._render_heatmap()
+        try:
+            self._heatmap_box.update()
+        except RuntimeError:
+            pass
+
+    @staticmethod
+    def _heatmap_canvas(heatmap) -> cv.Canvas:
+        """一周一列（周一在上），一年约 53 列；格子直接画在画布上"""
+        step = HEATMAP_CELL + HEATMAP_GAP
+        top = 12
+        start, counts, peak = heatmap["start"], heatmap["counts"], heatmap["max"]
+        lead = start.weekday()
+        shapes = []
+        for i, count in enumerate(counts):
+            col, row = divmod(lead + i, 7)
+            level = 0 if not count else min(4, -(-count * 4 // peak))
+            shapes.append(cv.Rect(col * step, top + row * step, HEATMAP_CELL, HEATMAP_CELL, border_radius=1,
+                                  paint=ft.Paint(color=HEATMAP_COLORS[level])))
+            d = date.fromordinal(start.toordinal() + i)
+            if d.day == 1:
+                shapes.append(cv.Text(col * step, 0, f"{d.month}月", style=ft.TextStyle(size=8, color=C.TEXT_HINT)))
+        cols = (lead + len(counts) + 6) // 7
+        return cv.Canvas(shapes=shapes, width=cols * step, height=top + 7 * step)
+
     def _daily_stats_card(self, rate: dict) -> ft.Container:
         """日常任务完成统计卡片"""
         return ft.Container(
@@ -808,22 +965,7 @@ class XinjingPage(ft.Column):
 
     def _get_task_trigger_counts(self) -> list[dict]:
         """统计所有任务的触发次数（包括正面、心魔、日常）"""
-        from datetime import timedelta
-        from datetime import date as dt_date
-        end = dt_date.today()
-        start = end - timedelta(days=30)
-        records = self.svc.db.get_records_in_range(start, end)
-
-        counts = {}
-        for r in records:
-            name = r.get("task_name", "未知")
-            if name not in counts:
-                counts[name] = {"name": name, "count": 0, "spirit": 0}
-            counts[name]["count"] += 1
-            counts[name]["spirit"] += r.get("spirit_change", 0)
-
-        result = sorted(counts.values(), key=lambda x: x["count"], reverse=True)
-        return result[:15]  # Top 15
+        return self.svc.get_task_trigger_counts(days=30, limit=15)
 
     def _task_trigger_card(self, task_counts: list[dict]) -> ft.Container:
         """任务触发排行卡片"""
@@ -1004,6 +1146,3 @@ class XinjingPage(ft.Column):
         except RuntimeError:
             pass
 
-
-# 给 SpiritService 加个辅助方法引用
-SpiritService._check_task_completed = lambda self, task: self.db.is_task_completed_today(task["id"]) if task["submission_type"] == "daily_checkin" else False
@@ -23,6 +23,15 @@ def get_database_path(page: ft.Page) -> str:
     return str(get_app_data_dir(page) / "fanrenxiuxian.db")
 
 
+def get_storage_profile(page: ft.Page) -> str:
+    """根据运行平台选择数据库存储配置（见 database/storage.py）"""
+    if hasattr(page, 'platform') and page.platform in (ft.PagePlatform.ANDROID, ft.PagePlatform.IOS):
+        return "mobile"
+    if getattr(page, 'web', False):
+        return "server"
+    return "desktop"
+
+
 def get_backup_dir(page: ft.Page) -> Path:
     """获取备份目录"""
     backup_dir = get_app_data_dir(page) / "backups"